@@ -0,0 +1,129 @@
+################################################################################################################################
+############################################ CONCILIACIÓN MASIVA DE FACTURAS Y MEDICIONES ######################################
+################################################################################################################################
+
+# La comparación por la API empareja una factura con su medición y calcula el resultado de una en una. La
+# conciliación hace lo mismo para todas las facturas sin comparar de un usuario o de todos los usuarios:
+#   - Una consulta por lote empareja cada factura con la primera medición del mismo usuario que se solapa con su
+#     periodo de facturación (la misma regla que find_related_measurement), con una subconsulta correlacionada.
+#   - Las facturas del lote se facturan con el simulador de tarifas en una sola llamada vectorial.
+#   - Las comparaciones se escriben con un bulk_create por lote.
+# Los lotes avanzan por id de factura, así que las comparaciones recién creadas no alteran la paginación y un
+# proceso interrumpido se puede relanzar: las facturas ya comparadas no vuelven a entrar.
+
+import logging
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Subquery
+from apps.general.models import Invoice, InvoiceComparison, Measurement, Profile, Tariff
+from .tariffs import ConsumptionTable, TariffTable, measurement_periods, simulate_pairs
+from .views import billed_days, comparison_results
+
+
+logger = logging.getLogger(__name__)
+
+
+def uncompared_pairs(user_ids=None):
+    """
+    Facturas sin comparación anotadas con `related_measurement_id`, la medición que se les asigna.
+    """
+    overlapping = Measurement.objects.filter(
+        user=OuterRef("user"),
+        measurement_start__lte=OuterRef("billing_period_end"),
+        measurement_end__gte=OuterRef("billing_period_start"),
+    ).order_by("id")
+    invoices = Invoice.objects.filter(~Exists(InvoiceComparison.objects.filter(invoice=OuterRef("pk"))))
+    if user_ids is not None:
+        invoices = invoices.filter(user_id__in=user_ids)
+    return (
+        invoices.annotate(related_measurement_id=Subquery(overlapping.values("id")[:1]))
+        .filter(related_measurement_id__isnull=False)
+        .order_by("id")
+    )
+
+
+class Reconciliation:
+    """
+    Concilia por lotes las facturas sin comparar. Las versiones de la tarifa por defecto y las potencias
+    contratadas se cargan una vez por lote; el resultado de cada factura es el mismo que daría la API.
+    """
+
+    def __init__(self, user_ids=None, batch_size=None, tariff_code=None):
+        self.user_ids = user_ids
+        self.batch_size = batch_size or settings.RECONCILIATION_BATCH_SIZE
+        self.tariffs = TariffTable(
+            Tariff.objects.filter(code=tariff_code or settings.DEFAULT_TARIFF_CODE).order_by("version")
+        )
+        self.report = {"compared": 0, "matching": 0, "skipped": 0}
+
+    def run(self, on_batch=None):
+        last_id = 0
+        while True:
+            batch = list(uncompared_pairs(self.user_ids).filter(id__gt=last_id)[:self.batch_size])
+            if not batch:
+                return self.report
+            last_id = batch[-1].id
+            self.reconcile(batch)
+            if on_batch:
+                on_batch(self.report)
+
+    def reconcile(self, invoices):
+        measurements = Measurement.objects.in_bulk([invoice.related_measurement_id for invoice in invoices])
+        power = dict(
+            Profile.objects.filter(user_id__in={invoice.user_id for invoice in invoices})
+            .values_list("user_id", "contracted_power_kw")
+        )
+
+        # Versión de la tarifa vigente al inicio de cada periodo de facturación
+        if len(self.tariffs):
+            _, chosen = self.tariffs.versions_valid_on([invoice.billing_period_start for invoice in invoices])
+            chosen = chosen[:, 0]
+        else:
+            chosen = np.full(len(invoices), -1)
+
+        prices = np.array([
+            invoice.data.get("detalles_consumo", {}).get("precio_efectivo_energia") for invoice in invoices
+        ], dtype=np.float64)
+        billable = (chosen >= 0) & ~(prices <= 0)
+        skipped = [invoice.id for invoice, ok in zip(invoices, billable) if not ok]
+        if skipped:
+            logger.warning(f"Facturas sin tarifa vigente o con precio de energía no válido: {skipped}")
+            self.report["skipped"] += len(skipped)
+
+        invoices = [invoice for invoice, ok in zip(invoices, billable) if ok]
+        if not invoices:
+            return
+        pairs = [(invoice, measurements[invoice.related_measurement_id]) for invoice in invoices]
+        versions = [self.tariffs.tariffs[index] for index in chosen[billable]]
+        consumption = ConsumptionTable(
+            [measurement_periods(measurement.data) for _, measurement in pairs],
+            [power.get(invoice.user_id) or 0 for invoice in invoices],
+            [billed_days(invoice) for invoice in invoices],
+            [invoice.billing_period_start for invoice in invoices],
+        )
+        concepts = simulate_pairs(consumption, TariffTable(versions, energy_price=prices[billable]))
+
+        comparisons = []
+        for row, ((invoice, measurement), tariff) in enumerate(zip(pairs, versions)):
+            breakdown = {concept: round(float(values[row]), 2) for concept, values in concepts.items()}
+            results = comparison_results(invoice, measurement, breakdown, tariff)
+            comparisons.append(InvoiceComparison(
+                user_id=invoice.user_id,
+                invoice=invoice,
+                measurement=measurement,
+                comparison_results=results,
+                is_comparison_valid=results["coincidencia_general"],
+            ))
+        with transaction.atomic():
+            InvoiceComparison.objects.bulk_create(comparisons)
+        self.report["compared"] += len(comparisons)
+        self.report["matching"] += sum(comparison.is_comparison_valid for comparison in comparisons)
+
+
+def reconcile_invoices(user_ids=None, batch_size=None, on_batch=None):
+    """
+    Compara todas las facturas sin comparar (de `user_ids` o de todos los usuarios) con sus mediciones.
+    Retorna {"compared", "matching", "skipped"}.
+    """
+    return Reconciliation(user_ids, batch_size).run(on_batch)
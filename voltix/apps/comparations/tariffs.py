@@ -0,0 +1,194 @@
+################################################################################################################################
+############################################ CATÁLOGO DE TARIFAS Y SIMULADOR DE FACTURAS #######################################
+################################################################################################################################
+
+# Una factura 2.0TD se compone de:
+#   - Término de energía: kWh de cada periodo (P1, P2, P3) por su precio.
+#   - Término de potencia: kW contratados x días x precio de cada periodo de potencia (P1 punta, P2 valle).
+#   - Impuesto especial sobre la electricidad: porcentaje de energía + potencia, con una cuota mínima por kWh.
+#   - Alquiler del contador por día.
+#   - IVA sobre la suma de todo lo anterior.
+# El simulador evalúa todas las parejas (consumo, tarifa) de una vez: los consumos son una tabla de m filas, las
+# tarifas una tabla de t filas, y cada concepto de la factura se calcula como una matriz m x t con NumPy.
+
+import numpy as np
+from django.db.models import Q
+from apps.general.models import Tariff
+
+
+# Fecha de fin para las tarifas sin `valid_to` (vigentes)
+OPEN_END = np.datetime64("9999-12-31", "D")
+
+
+def tariff_for(code, day):
+    """
+    Versión de la tarifa `code` vigente el día `day` (la más reciente si se solapan), o None.
+    """
+    return (
+        Tariff.objects.filter(code=code, valid_from__lte=day)
+        .filter(Q(valid_to__isnull=True) | Q(valid_to__gte=day))
+        .order_by("-version")
+        .first()
+    )
+
+
+class TariffTable:
+    """
+    Precios de t versiones de tarifa como arrays: energía (t x 3), potencia (t x 2) e impuestos (t).
+    """
+
+    def __init__(self, tariffs, energy_price=None):
+        self.tariffs = list(tariffs)
+        self.energy = np.array(
+            [[tariff.energy_price_p1, tariff.energy_price_p2, tariff.energy_price_p3] for tariff in self.tariffs],
+            dtype=np.float64,
+        ).reshape(-1, 3)
+        # Precio efectivo de energía de una factura: sustituye a los precios por periodo del catálogo. Puede ser
+        # uno por tarifa, con NaN en las que conservan sus precios
+        if energy_price is not None:
+            override = np.broadcast_to(np.asarray(energy_price, dtype=np.float64), (len(self.tariffs),))
+            self.energy = np.where(np.isnan(override)[:, np.newaxis], self.energy, override[:, np.newaxis])
+        self.power = np.array(
+            [[tariff.power_price_p1, tariff.power_price_p2] for tariff in self.tariffs], dtype=np.float64
+        ).reshape(-1, 2)
+        self.tax_rate = self.column("electricity_tax_rate")
+        self.tax_min = self.column("electricity_tax_min_per_kwh")
+        self.vat_rate = self.column("vat_rate")
+        self.meter_rental = self.column("meter_rental_per_day")
+        self.valid_from = np.array([tariff.valid_from for tariff in self.tariffs], dtype="datetime64[D]")
+        self.valid_to = np.array(
+            [tariff.valid_to or OPEN_END for tariff in self.tariffs], dtype="datetime64[D]"
+        )
+
+    def column(self, field):
+        return np.array([getattr(tariff, field) for tariff in self.tariffs], dtype=np.float64)
+
+    def __len__(self):
+        return len(self.tariffs)
+
+    def valid_on(self, days):
+        """
+        Matriz booleana m x t: True si la tarifa estaba vigente el día de cada consumo.
+        """
+        days = np.asarray(days, dtype="datetime64[D]")[:, np.newaxis]
+        return (self.valid_from[np.newaxis, :] <= days) & (days <= self.valid_to[np.newaxis, :])
+
+    def versions_valid_on(self, days):
+        """
+        Retorna (códigos, columnas): para cada día y código, la columna de la versión más alta vigente ese
+        día (-1 si ninguna lo está), como matriz m x códigos. Las filas de la tabla pueden estar en cualquier
+        orden: no se depende de cómo ordene los códigos la base de datos.
+        """
+        codes, code_index = np.unique([tariff.code for tariff in self.tariffs], return_inverse=True)
+        versions = np.array([tariff.version for tariff in self.tariffs], dtype=np.int64)
+        # Columnas ordenadas por código y versión: cada código es un tramo contiguo y su máximo es la versión más alta
+        order = np.lexsort((versions, code_index))
+        code_starts = np.searchsorted(code_index[order], np.arange(len(codes)))
+        positions = np.where(self.valid_on(days)[:, order], np.arange(len(self)), -1)
+        chosen = np.maximum.reduceat(positions, code_starts, axis=1)
+        return codes, np.where(chosen >= 0, order[np.maximum(chosen, 0)], -1)
+
+    def latest(self, code):
+        return max((tariff for tariff in self.tariffs if tariff.code == code), key=lambda tariff: tariff.version)
+
+
+def measurement_periods(data):
+    """
+    kWh (P1, P2, P3) de los datos de una medición. Sin desglose por periodo se reparte la punta a partes
+    iguales entre P1 y P2 y el valle va a P3. Si la medición trae `consumo_total`, es la energía que se
+    factura (como en la comparación con la factura): el desglose solo indica el reparto entre periodos y se
+    escala para sumar el total; sin desglose, el total se reparte a partes iguales entre los tres.
+    """
+    periods = [0.0, 0.0, 0.0]
+    by_period = data.get("consumo_por_periodo")
+    by_band = data.get("consumo_por_franja_horaria") or {}
+    if by_period:
+        periods = [float(by_period.get(name) or 0) for name in ("P1", "P2", "P3")]
+    elif by_band.get("punta") is not None or by_band.get("valle") is not None:
+        punta = float(by_band.get("punta") or 0)
+        periods = [punta / 2, punta / 2, float(by_band.get("valle") or 0)]
+
+    total = data.get("consumo_total")
+    if total is None:
+        return periods
+    total = float(total)
+    known = sum(periods)
+    return [period * total / known for period in periods] if known > 0 else [total / 3] * 3
+
+
+class ConsumptionTable:
+    """
+    m consumos a simular: kWh por periodo (m x 3), potencia contratada (kW), días facturados y fecha de
+    inicio de cada uno (para elegir las versiones de tarifa vigentes).
+    """
+
+    def __init__(self, energy, power_kw, days, start_days):
+        self.energy = np.asarray(energy, dtype=np.float64).reshape(-1, 3)
+        self.power_kw = np.nan_to_num(np.asarray(power_kw, dtype=np.float64))
+        self.days = np.asarray(days, dtype=np.float64)
+        self.start_days = np.asarray(start_days, dtype="datetime64[D]")
+
+    @classmethod
+    def from_measurements(cls, measurements, power_kw=None):
+        measurements = list(measurements)
+        return cls(
+            [measurement_periods(measurement.data) for measurement in measurements],
+            [power_kw or 0] * len(measurements),
+            [(measurement.measurement_end.date() - measurement.measurement_start.date()).days + 1 for measurement in measurements],
+            [measurement.measurement_start.date() for measurement in measurements],
+        )
+
+    def __len__(self):
+        return len(self.days)
+
+
+def bill_concepts(kwh, power_kw, days, tariffs, tariff_index):
+    """
+    Conceptos de la factura con arrays que se combinan por broadcasting: `kwh` (..., 3), `power_kw` y `days`
+    del consumo, y las columnas de `tariffs` indexadas con `tariff_index`.
+    """
+    energy = (kwh * tariffs.energy[tariff_index]).sum(axis=-1)
+    power = power_kw * days * tariffs.power[tariff_index].sum(axis=-1)
+    electricity_tax = np.maximum(
+        (energy + power) * tariffs.tax_rate[tariff_index],
+        kwh.sum(axis=-1) * tariffs.tax_min[tariff_index],
+    )
+    meter_rental = days * tariffs.meter_rental[tariff_index]
+    subtotal = energy + power + electricity_tax + meter_rental
+    vat = subtotal * tariffs.vat_rate[tariff_index]
+    return {
+        "energia": energy,
+        "potencia": power,
+        "impuesto_electrico": electricity_tax,
+        "alquiler_contador": meter_rental,
+        "iva": vat,
+        "total": subtotal + vat,
+    }
+
+
+def simulate(consumption, tariffs):
+    """
+    Factura de cada consumo con cada tarifa. Retorna un diccionario de matrices m x t (€) con los conceptos
+    de la factura: energia, potencia, impuesto_electrico, alquiler_contador, iva y total.
+    """
+    return bill_concepts(
+        consumption.energy[:, np.newaxis, :],
+        consumption.power_kw[:, np.newaxis],
+        consumption.days[:, np.newaxis],
+        tariffs,
+        np.arange(len(tariffs))[np.newaxis, :],
+    )
+
+
+def simulate_pairs(consumption, tariffs):
+    """
+    Factura del consumo i con la tarifa i (tablas del mismo tamaño): un diccionario de arrays de m valores.
+    """
+    return bill_concepts(consumption.energy, consumption.power_kw, consumption.days, tariffs, np.arange(len(tariffs)))
+
+
+def bill(consumption_row, tariff_table):
+    """
+    Desglose (€, redondeado) del primer consumo con la primera tarifa: la factura de una sola pareja.
+    """
+    return {concept: round(float(values[0, 0]), 2) for concept, values in simulate(consumption_row, tariff_table).items()}
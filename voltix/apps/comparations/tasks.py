@@ -0,0 +1,15 @@
+import logging
+from celery import shared_task
+from .reconciliation import reconcile_invoices
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def reconcile_invoices_task(user_ids=None, batch_size=None):
+    """
+    Concilia en un worker de Celery las facturas sin comparar de `user_ids` (o de todos los usuarios).
+    """
+    report = reconcile_invoices(user_ids, batch_size)
+    logger.info(f"Conciliación terminada: {report}")
+    return report
@@ -1,3 +1,21 @@
+import os
+from datetime import date
+from django.apps import apps as django_apps
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.management.sql import emit_post_migrate_signal
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+from apps.comparations.reconciliation import reconcile_invoices, uncompared_pairs
+from apps.comparations.tariffs import ConsumptionTable, TariffTable, measurement_periods, simulate
+from apps.general.models import Invoice, InvoiceComparison, Profile, Tariff, User
+from apps.measurements.intervals import month_periods, save_measurement
+from site_app.celery import app as celery_app
+
+
 # from django.test import TestCase
 # from rest_framework.test import APITestCase, APIClient
 # from rest_framework import status
@@ -123,3 +141,199 @@
 #         )
 #         with self.assertRaises(ValidationError):  # Cambiado a ValidationError
 #             invoice.full_clean()  # Lanza error por fechas inválidas
+
+
+class TariffSimulatorTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(dni="123456789", fullname="Test User", email="testuser@example.com", password="x")
+        self.client.force_authenticate(user=self.user)
+        self.reference = Tariff.objects.get(code="voltix-referencia")
+
+    def add_tariff(self, code, version, valid_from, valid_to=None, energy=(0.2, 0.15, 0.1), power=(0.1, 0.0)):
+        return Tariff.objects.create(
+            code=code, version=version, supplier=code.title(), name="Tarifa", valid_from=valid_from, valid_to=valid_to,
+            energy_price_p1=energy[0], energy_price_p2=energy[1], energy_price_p3=energy[2],
+            power_price_p1=power[0], power_price_p2=power[1],
+        )
+
+    def test_reference_tariff_reproduces_the_previous_formula(self):
+        consumption = ConsumptionTable([[100, 100, 100]], [0], [31], ["2024-01-01"])
+        bill = simulate(consumption, TariffTable([self.reference]))
+        self.assertAlmostEqual(bill["total"][0, 0], 300 * 0.1121 * 1.051127 * 1.21)
+
+    def test_reference_tariff_is_seeded_after_migrate(self):
+        # Sin la migración de datos (los despliegues regeneran las migraciones) la tarifa se crea tras migrate
+        self.reference.delete()
+        for _ in range(2):
+            emit_post_migrate_signal(verbosity=0, interactive=False, db="default")
+
+        reference = Tariff.objects.get(code="voltix-referencia")
+        self.assertEqual((reference.version, reference.valid_from), (1, date(1900, 1, 1)))
+        self.assertEqual(reference.energy_price_p1, 0.1121)
+
+    def test_every_pair_is_evaluated_in_one_call(self):
+        tariffs = TariffTable([self.reference, self.add_tariff("x", 1, "2024-01-01")])
+        consumption = ConsumptionTable([[10, 20, 30], [0, 0, 0]], [3.3, 3.3], [30, 30], ["2024-01-01", "2024-02-01"])
+        bill = simulate(consumption, tariffs)
+
+        self.assertEqual(bill["total"].shape, (2, 2))
+        self.assertAlmostEqual(bill["energia"][0, 1], 10 * 0.2 + 20 * 0.15 + 30 * 0.1)
+        self.assertAlmostEqual(bill["potencia"][1, 1], 3.3 * 30 * 0.1)
+        self.assertAlmostEqual(bill["potencia"][1, 0], 0)
+        self.assertTrue(tariffs.valid_on(consumption.start_days)[:, 1].all())
+        # Cuota mínima del impuesto eléctrico por kWh
+        tariffs.tax_min[:] = 1.0
+        self.assertAlmostEqual(simulate(consumption, tariffs)["impuesto_electrico"][0, 0], 60)
+
+    def test_billed_energy_is_the_measured_total(self):
+        # 20 kWh fuera de punta y valle: se reparten según el desglose, sin perderse
+        periods = measurement_periods({"consumo_total": 220, "consumo_por_franja_horaria": {"punta": 150, "valle": 50}})
+        self.assertAlmostEqual(sum(periods), 220)
+        self.assertAlmostEqual(periods[2] / sum(periods), 50 / 200)
+        self.assertEqual(measurement_periods({"consumo_por_periodo": {"P1": 1, "P2": 2, "P3": 3}}), [1, 2, 3])
+        self.assertEqual(measurement_periods({"consumo_total": 30}), [10, 10, 10])
+
+    def test_versions_are_grouped_whatever_the_row_order(self):
+        rows = [
+            self.add_tariff("b", 2, "2024-02-01"),
+            self.add_tariff("B", 1, "2023-01-01"),
+            self.add_tariff("b", 1, "2023-01-01", "2024-01-31"),
+            self.add_tariff("a", 1, "2023-01-01"),
+            self.add_tariff("a", 3, "2023-06-01"),
+        ]
+        table = TariffTable(rows)
+
+        codes, chosen = table.versions_valid_on(["2024-01-15", "2024-03-01", "2022-01-01"])
+
+        chosen_versions = {
+            (row, str(code)): (table.tariffs[chosen[row, index]].code, table.tariffs[chosen[row, index]].version)
+            for row in range(3) for index, code in enumerate(codes) if chosen[row, index] >= 0
+        }
+        self.assertEqual(chosen_versions, {
+            (0, "B"): ("B", 1), (0, "a"): ("a", 3), (0, "b"): ("b", 1),
+            (1, "B"): ("B", 1), (1, "a"): ("a", 3), (1, "b"): ("b", 2),
+        })
+        self.assertEqual(table.latest("b").version, 2)
+
+    def test_comparison_uses_the_catalogue_and_the_contracted_power(self):
+        Profile.objects.update_or_create(user=self.user, defaults={"contracted_power_kw": 4})
+        with override_settings(DEFAULT_TARIFF_CODE="x"):
+            self.add_tariff("x", 1, "2023-01-01")
+            save_measurement(self.user.pk, date(2024, 1, 1), date(2024, 1, 10), {"consumo_total": 90})
+            invoice = Invoice.objects.create(
+                user=self.user, billing_period_start="2024-01-01", billing_period_end="2024-01-10",
+                data={"detalles_consumo": {"consumo_total": 90, "precio_efectivo_energia": 0.1}},
+            )
+            response = self.client.post(reverse("compare_and_save"), {"invoice": invoice.id}, format="json")
+
+        self.assertEqual(response.status_code, 200)
+        total = response.data["result"]["total_a_pagar"]
+        self.assertEqual(total["tarifa"], {"codigo": "x", "version": 1})
+        self.assertEqual(total["desglose_calculo"]["energia"], 9.0)
+        self.assertEqual(total["desglose_calculo"]["potencia"], 4.0)
+
+    def test_invoices_before_the_catalogue_use_the_reference_tariff(self):
+        save_measurement(self.user.pk, date(2018, 3, 1), date(2018, 3, 31), {"consumo_total": 100})
+        invoice = Invoice.objects.create(
+            user=self.user, billing_period_start="2018-03-01", billing_period_end="2018-03-31",
+            data={"detalles_consumo": {"consumo_total": 100}},
+        )
+
+        response = self.client.post(reverse("compare_and_save"), {"invoice": invoice.id}, format="json")
+
+        self.assertEqual(response.status_code, 200)
+        total = response.data["result"]["total_a_pagar"]
+        self.assertEqual(total["tarifa"], {"codigo": "voltix-referencia", "version": 1})
+        self.assertEqual(total["calculo_medicion"], round(100 * 0.1121 * 1.051127 * 1.21, 2))
+
+    def test_simulation_picks_the_version_valid_for_each_measurement(self):
+        self.add_tariff("barata", 1, "2023-01-01", "2024-01-31", energy=(0.05,) * 3, power=(0, 0))
+        self.add_tariff("barata", 2, "2024-02-01", energy=(0.3,) * 3, power=(0, 0))
+        self.add_tariff("parcial", 1, "2024-02-01", energy=(0.01,) * 3, power=(0, 0))
+        save_measurement(self.user.pk, date(2024, 1, 1), date(2024, 1, 31), {"consumo_por_periodo": {"P1": 10, "P2": 10, "P3": 80}})
+        save_measurement(self.user.pk, date(2024, 2, 1), date(2024, 2, 29), {"consumo_por_franja_horaria": {"punta": 20, "valle": 80}})
+
+        response = self.client.get(reverse("tariff_simulations"))
+
+        self.assertEqual(response.status_code, 200)
+        results = {result["code"]: result for result in response.data["results"]}
+        self.assertEqual([m["version"] for m in results["barata"]["per_measurement"]], [1, 2])
+        self.assertEqual(results["parcial"]["measurements_covered"], 1)
+        self.assertEqual(response.data["cheapest"], "voltix-referencia")
+        self.assertEqual(self.client.get(reverse("tariff_simulations"), {"start": "mañana"}).status_code, 400)
+
+
+class ReconciliationTests(TestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(dni=f"00000000{index}", fullname="Test User", email=f"u{index}@example.com", password="x")
+            for index in range(3)
+        ]
+
+    def add_month(self, user, month, consumption=100, total=None):
+        start = date(2024, month, 1)
+        end = month_periods(start, start)[0][1]
+        save_measurement(user.pk, start, end, {"consumo_total": consumption})
+        return Invoice.objects.create(
+            user=user, billing_period_start=start, billing_period_end=end,
+            data={"detalles_consumo": {"consumo_total": consumption}, "desglose_cargos": {"total_a_pagar": total}},
+        )
+
+    def test_batch_matches_the_api_result(self):
+        invoice = self.add_month(self.users[0], 1, total=round(100 * 0.1121 * 1.051127 * 1.21, 2))
+        client = APIClient()
+        client.force_authenticate(user=self.users[0])
+        api_result = client.post(reverse("compare_and_save"), {"invoice": invoice.id}, format="json").data["result"]
+        InvoiceComparison.objects.all().delete()
+
+        report = reconcile_invoices()
+
+        self.assertEqual(report, {"compared": 1, "matching": 1, "skipped": 0})
+        self.assertEqual(InvoiceComparison.objects.get(invoice=invoice).comparison_results, api_result)
+
+    def test_invoices_before_the_catalogue_are_not_skipped(self):
+        start = date(2020, 12, 1)
+        save_measurement(self.users[0].pk, start, date(2020, 12, 31), {"consumo_total": 100})
+        Invoice.objects.create(user=self.users[0], billing_period_start=start, billing_period_end=date(2020, 12, 31), data={})
+
+        self.assertEqual(reconcile_invoices(), {"compared": 1, "matching": 0, "skipped": 0})
+
+    def test_all_users_in_constant_queries_per_batch(self):
+        for user in self.users:
+            for month in range(1, 5):
+                self.add_month(user, month)
+        Invoice.objects.create(user=self.users[0], billing_period_start="2025-01-01", billing_period_end="2025-01-31", data={})
+
+        with CaptureQueriesContext(connection) as queries:
+            report = reconcile_invoices(batch_size=5)
+
+        self.assertEqual(report["compared"], 12)
+        # Por lote: emparejar, mediciones, potencias y bulk_create (con savepoint); más la consulta final vacía
+        self.assertLessEqual(len(queries), 3 * 6 + 1 + 2)
+        self.assertEqual(
+            set(InvoiceComparison.objects.values_list("invoice__billing_period_start", "measurement__measurement_start__date")),
+            {(date(2024, month, 1), date(2024, month, 1)) for month in range(1, 5)},
+        )
+        # Una segunda pasada no vuelve a comparar nada; la factura sin medición sigue pendiente
+        self.assertEqual(reconcile_invoices()["compared"], 0)
+        self.assertEqual(uncompared_pairs().count(), 0)
+
+    def test_command_limits_to_the_given_users(self):
+        self.add_month(self.users[0], 1)
+        self.add_month(self.users[1], 1)
+
+        call_command("reconcile_invoices", "--user", self.users[1].dni, stdout=open(os.devnull, "w"))
+        self.assertEqual(list(InvoiceComparison.objects.values_list("user_id", flat=True)), [self.users[1].pk])
+
+        call_command("reconcile_invoices", "--async", stdout=open(os.devnull, "w"))
+        self.assertEqual(InvoiceComparison.objects.count(), 2)
+        with self.assertRaises(CommandError):
+            call_command("reconcile_invoices", "--user", "desconocido", stdout=open(os.devnull, "w"))
+
+    def test_worker_registers_the_reconciliation_task(self):
+        # El worker solo registra las tareas de las apps de INSTALLED_APPS (autodiscover_tasks)
+        self.assertTrue(django_apps.is_installed("apps.comparations"))
+        celery_app.loader.import_default_modules()
+
+        self.assertIn("apps.comparations.tasks.reconcile_invoices_task", celery_app.tasks)
@@ -5,6 +5,7 @@ from .userComparisonListview import UserComparisonDetailView, UserComparisonList
 
 urlpatterns = [
     path('compare/', views.compare_invoice_and_measurement, name='compare_and_save'),
+    path('simulations/', views.simulate_tariffs, name='tariff_simulations'),
     path('comparisons/', UserComparisonListView.as_view(), name='user-comparisons'),
     path('comparisons/<int:comparison_id>/', UserComparisonDetailView.as_view(), name='user_comparison_detail'),
 ]
\ No newline at end of file
@@ -4,11 +4,14 @@ from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from django.http import JsonResponse
-from datetime import datetime
+from datetime import date, datetime
+import numpy as np
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
-from apps.general.models import Invoice, Measurement, InvoiceComparison
+from apps.general.models import Invoice, Measurement, InvoiceComparison, Profile, Tariff
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
+from .tariffs import ConsumptionTable, TariffTable, bill, measurement_periods, simulate, tariff_for
 
 # @swagger_auto_schema(
 #     method="post",
@@ -248,15 +251,23 @@ def calculate_consumption_details(invoice, measurement):
         }
     }
 
-def calculate_total_to_pay(consumption_kwh, price_per_kwh):
-    electricity_tax_rate = 0.051127
-    vat_rate = 0.21
-
-    energy_term = consumption_kwh * price_per_kwh
-    electricity_tax = energy_term * electricity_tax_rate
-    subtotal = energy_term + electricity_tax
-    vat = subtotal * vat_rate
-    return round(subtotal + vat, 2)
+def contracted_power(user):
+    profile = Profile.objects.filter(user=user).first()
+    return profile.contracted_power_kw if profile else None
+
+def billed_days(invoice):
+    days = invoice.data.get("periodo_facturacion", {}).get("dias")
+    return days or (invoice.billing_period_end - invoice.billing_period_start).days + 1
+
+def calculate_total_to_pay(invoice, measurement, tariff, price_per_kwh=None, power_kw=None):
+    """
+    Desglose de la factura que correspondería al consumo de la medición con la tarifa del catálogo. Si la
+    factura trae un precio efectivo de energía, sustituye a los precios por periodo de la tarifa.
+    """
+    consumption = ConsumptionTable(
+        [measurement_periods(measurement.data)], [power_kw or 0], [billed_days(invoice)], [invoice.billing_period_start]
+    )
+    return bill(consumption, TariffTable([tariff], energy_price=price_per_kwh))
 
 def compare_totals(invoice, calculated_total):
     total_a_pagar = invoice.data.get("desglose_cargos", {}).get("total_a_pagar", 0)
@@ -268,6 +279,35 @@ def compare_dates(invoice, measurement):
         invoice.billing_period_end == measurement.measurement_end.date()
     )
 
+def comparison_results(invoice, measurement, breakdown, tariff):
+    """
+    Resultado de comparar una factura con su medición, dado el desglose calculado con `tariff`.
+    """
+    consumption_details = calculate_consumption_details(invoice, measurement)
+    calculated_total = breakdown["total"]
+    total_a_pagar, total_to_pay_matches = compare_totals(invoice, calculated_total)
+    dates_match = compare_dates(invoice, measurement)
+
+    return {
+        "periodo_facturacion": {
+            "fecha_inicio_factura": invoice.billing_period_start.strftime('%Y-%m-%d'),
+            "fecha_fin_factura": invoice.billing_period_end.strftime('%Y-%m-%d'),
+            "fecha_inicio_medicion": measurement.measurement_start.strftime('%Y-%m-%d'),
+            "fecha_fin_medicion": measurement.measurement_end.strftime('%Y-%m-%d'),
+            "dias_facturados": invoice.data.get("periodo_facturacion", {}).get("dias", 0),
+            "coincide_fechas": dates_match
+        },
+        "detalles_consumo": consumption_details,
+        "total_a_pagar": {
+            "factura": total_a_pagar,
+            "calculo_medicion": calculated_total,
+            "coincide_total": total_to_pay_matches,
+            "desglose_calculo": breakdown,
+            "tarifa": {"codigo": tariff.code, "version": tariff.version}
+        },
+        "coincidencia_general": all(value["matches"] for value in consumption_details.values()) and total_to_pay_matches and dates_match
+    }
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def compare_invoice_and_measurement(request):
@@ -295,34 +335,16 @@ def compare_invoice_and_measurement(request):
             if not invoice:
                 return Response({"error": "No matching invoice found for the measurement."}, status=404)
 
-        consumption_details = calculate_consumption_details(invoice, measurement)
-        total_consumption_kwh = consumption_details["total_consumption_kwh"]["measurement"]
+        tariff = tariff_for(settings.DEFAULT_TARIFF_CODE, invoice.billing_period_start)
+        if not tariff:
+            return Response({"error": "No tariff in the catalogue covers the billing period."}, status=400)
 
-        price_per_kwh = invoice.data.get("detalles_consumo", {}).get("precio_efectivo_energia", 0.1121)
-        if price_per_kwh <= 0:
+        price_per_kwh = invoice.data.get("detalles_consumo", {}).get("precio_efectivo_energia")
+        if price_per_kwh is not None and price_per_kwh <= 0:
             return Response({"error": "Invalid price_per_kWh extracted from invoice."}, status=400)
 
-        calculated_total = calculate_total_to_pay(total_consumption_kwh, price_per_kwh)
-        total_a_pagar, total_to_pay_matches = compare_totals(invoice, calculated_total)
-        dates_match = compare_dates(invoice, measurement)
-
-        response_data = {
-            "periodo_facturacion": {
-                "fecha_inicio_factura": invoice.billing_period_start.strftime('%Y-%m-%d'),
-                "fecha_fin_factura": invoice.billing_period_end.strftime('%Y-%m-%d'),
-                "fecha_inicio_medicion": measurement.measurement_start.strftime('%Y-%m-%d'),
-                "fecha_fin_medicion": measurement.measurement_end.strftime('%Y-%m-%d'),
-                "dias_facturados": invoice.data.get("periodo_facturacion", {}).get("dias", 0),
-                "coincide_fechas": dates_match
-            },
-            "detalles_consumo": consumption_details,
-            "total_a_pagar": {
-                "factura": total_a_pagar,
-                "calculo_medicion": calculated_total,
-                "coincide_total": total_to_pay_matches
-            },
-            "coincidencia_general": all(value["matches"] for value in consumption_details.values()) and total_to_pay_matches and dates_match
-        }
+        breakdown = calculate_total_to_pay(invoice, measurement, tariff, price_per_kwh, contracted_power(request.user))
+        response_data = comparison_results(invoice, measurement, breakdown, tariff)
 
         comparison = InvoiceComparison.objects.create(
             user=request.user,
@@ -347,3 +369,104 @@ def compare_invoice_and_measurement(request):
         return Response(response, status=200)
     except Exception as e:
         return Response({"error": str(e)}, status=500)
+
+
+@swagger_auto_schema(
+    method="get",
+    operation_summary="Simulate Bills Across the Tariff Catalogue",
+    operation_description="""
+        Recalculates every measurement of the authenticated user with every tariff in the catalogue in a single
+        vectorised computation. For each measurement the tariff version valid on its start date is used.
+        Returns the total per tariff and the cheapest tariff among those covering every measurement.
+    """,
+    manual_parameters=[
+        openapi.Parameter("start", openapi.IN_QUERY, description="Only measurements starting on or after this date (YYYY-MM-DD).", type=openapi.TYPE_STRING),
+        openapi.Parameter("end", openapi.IN_QUERY, description="Only measurements ending on or before this date (YYYY-MM-DD).", type=openapi.TYPE_STRING),
+        openapi.Parameter("codes", openapi.IN_QUERY, description="Comma-separated tariff codes to simulate (default: all).", type=openapi.TYPE_STRING),
+    ],
+    responses={
+        200: openapi.Response(
+            description="Simulation completed.",
+            examples={
+                "application/json": {
+                    "status": "success",
+                    "measurements": 12,
+                    "cheapest": "comercializadora-x-fija",
+                    "results": [
+                        {
+                            "code": "comercializadora-x-fija",
+                            "supplier": "Comercializadora X",
+                            "name": "Precio fijo",
+                            "total": 612.4,
+                            "measurements_covered": 12,
+                            "per_measurement": [{"measurement_id": 7, "version": 2, "total": 51.3}]
+                        }
+                    ]
+                }
+            }
+        ),
+        400: openapi.Response(description="Invalid date.", examples={"application/json": {"error": "Invalid date: ..."}}),
+        404: openapi.Response(description="No measurements or tariffs.", examples={"application/json": {"error": "No measurements found."}}),
+    }
+)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def simulate_tariffs(request):
+    measurements = Measurement.objects.filter(
+        user=request.user, measurement_start__isnull=False, measurement_end__isnull=False
+    ).order_by('measurement_start')
+    try:
+        if request.query_params.get("start"):
+            measurements = measurements.filter(measurement_start__date__gte=date.fromisoformat(request.query_params["start"]))
+        if request.query_params.get("end"):
+            measurements = measurements.filter(measurement_end__date__lte=date.fromisoformat(request.query_params["end"]))
+    except ValueError as e:
+        return Response({"error": f"Invalid date: {e}"}, status=400)
+
+    tariffs = Tariff.objects.order_by('code', 'version')
+    if request.query_params.get("codes"):
+        tariffs = tariffs.filter(code__in=[code.strip() for code in request.query_params["codes"].split(",")])
+
+    measurements = list(measurements)
+    if not measurements:
+        return Response({"error": "No measurements found."}, status=404)
+    table = TariffTable(tariffs)
+    if not len(table):
+        return Response({"error": "No tariffs found in the catalogue."}, status=404)
+
+    consumption = ConsumptionTable.from_measurements(measurements, contracted_power(request.user))
+    totals = simulate(consumption, table)["total"]
+
+    codes, chosen = table.versions_valid_on(consumption.start_days)
+    covered = chosen >= 0
+    code_totals = np.where(covered, np.take_along_axis(totals, np.maximum(chosen, 0), axis=1), 0.0)
+
+    results = []
+    for index, code in enumerate(codes):
+        latest = table.latest(code)
+        results.append({
+            "code": str(code),
+            "supplier": latest.supplier,
+            "name": latest.name,
+            "total": round(float(code_totals[:, index].sum()), 2),
+            "measurements_covered": int(covered[:, index].sum()),
+            "per_measurement": [
+                {
+                    "measurement_id": measurement.id,
+                    "version": table.tariffs[chosen[row, index]].version,
+                    "total": round(float(code_totals[row, index]), 2),
+                }
+                for row, measurement in enumerate(measurements) if covered[row, index]
+            ],
+        })
+
+    # Solo compiten por el más barato las tarifas que cubren todas las mediciones
+    complete = [result for result in results if result["measurements_covered"] == len(measurements)]
+    results.sort(key=lambda result: (result["measurements_covered"] < len(measurements), result["total"]))
+    return Response({
+        "status": "success",
+        "measurements": len(measurements),
+        "cheapest": min(complete, key=lambda result: result["total"])["code"] if complete else None,
+        "results": results,
+    }, status=200)
+
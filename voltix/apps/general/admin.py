@@ -2,7 +2,7 @@ from django.contrib import admin
 from apps.general.models import (
     User, Profile, Invoice, Measurement, Notification, 
     NotificationSettings, InvoiceComparison, EmailVerification, 
-    UploadLog, ReminderSchedule
+    UploadLog, ReminderSchedule, InvoiceProcessingJob, InvoiceExtractionCache, Tariff
 )
 
 class UserAdmin(admin.ModelAdmin):
@@ -15,7 +15,7 @@ class UserAdmin(admin.ModelAdmin):
 admin.site.register(User, UserAdmin)
 
 class ProfileAdmin(admin.ModelAdmin):
-    fields = ['user', 'birth_date', 'address', 'phone_number', 'photo', 'created_at', 'updated_at']
+    fields = ['user', 'birth_date', 'address', 'phone_number', 'photo', 'contracted_power_kw', 'created_at', 'updated_at']
     list_display = ['profile_id', 'user', 'birth_date', 'address', 'phone_number', 'photo','created_at', 'updated_at']
     search_fields = ['user__dni', 'user__fullname']
     list_filter = ['birth_date', 'created_at']
@@ -146,3 +146,30 @@ class ReminderScheduleAdmin(admin.ModelAdmin):
         if obj:
             return ['user', 'invoice_comparison', 'scheduled_time']
         return []
+
+
+@admin.register(InvoiceProcessingJob)
+class InvoiceProcessingJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'file_name', 'status', 'stage', 'progress', 'invoice', 'created_at', 'updated_at')
+    list_filter = ('status', 'stage', 'created_at')
+    search_fields = ('user__dni', 'user__fullname', 'file_name', 'content_hash')
+    ordering = ('-created_at',)
+    readonly_fields = ('id', 'created_at', 'updated_at')
+
+
+@admin.register(InvoiceExtractionCache)
+class InvoiceExtractionCacheAdmin(admin.ModelAdmin):
+    list_display = ('content_hash', 'pipeline_version', 'hits', 'image_url', 'created_at', 'last_used_at')
+    list_filter = ('pipeline_version',)
+    search_fields = ('content_hash',)
+    ordering = ('-last_used_at',)
+    readonly_fields = ('created_at', 'last_used_at', 'hits')
+
+
+@admin.register(Tariff)
+class TariffAdmin(admin.ModelAdmin):
+    list_display = ('code', 'version', 'supplier', 'name', 'valid_from', 'valid_to', 'energy_price_p1', 'energy_price_p2', 'energy_price_p3')
+    list_filter = ('supplier',)
+    search_fields = ('code', 'supplier', 'name')
+    ordering = ('code', '-version')
+    readonly_fields = ('created_at', 'updated_at')
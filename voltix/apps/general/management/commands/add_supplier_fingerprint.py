@@ -0,0 +1,25 @@
+import os
+import fitz  # PyMuPDF
+from django.core.management.base import BaseCommand, CommandError
+from apps.invoices.extractors import get_extractor
+from apps.invoices.fingerprints import add_fingerprint
+from apps.invoices.processing import InvoiceProcessor
+
+class Command(BaseCommand):
+    help = 'Add the header fingerprint of a sample invoice to the supplier fingerprint index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('pdf_path', type=str, help='Sample invoice (PDF)')
+        parser.add_argument('supplier', type=str, help='Registered supplier extractor name (e.g. endesa)')
+
+    def handle(self, *args, **kwargs):
+        supplier = kwargs['supplier']
+        if get_extractor(supplier) is None:
+            raise CommandError(f"Unknown supplier '{supplier}'.")
+
+        processor = InvoiceProcessor()
+        with fitz.open(kwargs['pdf_path']) as pdf_document:
+            pix = processor.render_page(pdf_document[0], grayscale=False)
+            fingerprint = add_fingerprint(supplier, processor.pixmap_to_array(pix), source=os.path.basename(kwargs['pdf_path']))
+
+        self.stdout.write(f"Fingerprint {fingerprint} added for {supplier}.")
@@ -0,0 +1,76 @@
+import os
+import json
+from django.core.management.base import BaseCommand, CommandError
+from apps.invoices.extractor_benchmark import capture_text, default_corpus_dir, run_extractor_benchmark
+from apps.invoices.processing import InvoiceProcessor
+
+class Command(BaseCommand):
+    help = 'Benchmark the supplier extractors (parses/s, p99) over stored OCR texts and flag slow regex patterns'
+
+    def add_arguments(self, parser):
+        parser.add_argument('corpus', nargs='?', type=str, help='Directory with the OCR texts (default: facturas/ocr/)')
+        parser.add_argument('--repeat', type=int, default=200, help='Parses per text')
+        parser.add_argument('--size', type=int, default=20000, help='Characters of the small pathological input')
+        parser.add_argument('--timeout', type=float, default=2.0, help='Seconds before a pattern is flagged as catastrophic')
+        parser.add_argument('--skip-patterns', action='store_true', help='Only time whole extractors on pathological inputs')
+        parser.add_argument('--capture', nargs='+', type=str, help='Store the text of these PDFs in the corpus and exit')
+        parser.add_argument('--expected', type=str, help='Directory with the expected JSON of each text (default: facturas/expected/)')
+        parser.add_argument('--output', type=str, help='Write the JSON report to this file')
+        parser.add_argument('--fail-on-flagged', action='store_true', help='Exit with an error if a pattern is flagged')
+
+    def handle(self, *args, **kwargs):
+        corpus_dir = kwargs['corpus'] or default_corpus_dir()
+
+        if kwargs['capture']:
+            processor = InvoiceProcessor()
+            os.makedirs(corpus_dir, exist_ok=True)
+            for pdf_path in kwargs['capture']:
+                path = os.path.join(corpus_dir, os.path.splitext(os.path.basename(pdf_path))[0] + '.txt')
+                with open(path, 'w', encoding='utf-8') as text_file:
+                    text_file.write(capture_text(processor, pdf_path))
+                self.stdout.write(f"Text of {pdf_path} written to {path}.")
+            return
+
+        report = run_extractor_benchmark(
+            corpus_dir, repeat=kwargs['repeat'], size=kwargs['size'], timeout=kwargs['timeout'],
+            include_patterns=not kwargs['skip_patterns'], expected_dir=kwargs['expected'],
+        )
+
+        for name, document in report['documents'].items():
+            if 'error' in document:
+                self.stdout.write(f"{name}: {document['error']}")
+                continue
+            accuracy = document['accuracy']
+            score = f"{accuracy['matched']}/{accuracy['total']} fields" if accuracy else "no expected JSON"
+            self.stdout.write(
+                f"{name} ({document['supplier']}, {document['chars']} chars): {document['parses_per_second']:.0f} parses/s, "
+                f"p99 {document['p99_ms']:.3f} ms, {score}"
+            )
+            for mismatch in (accuracy or {}).get('mismatches', []):
+                self.stdout.write(f"  ! {mismatch['field']}: expected {mismatch['expected']!r}, got {mismatch['actual']!r}")
+
+        self.stdout.write("Per supplier:")
+        for supplier, latency in report['suppliers'].items():
+            self.stdout.write(
+                f"  {supplier:<14}{latency['parses_per_second']:>10.0f} parses/s  p50 {latency['p50_ms']:.3f} ms  "
+                f"p99 {latency['p99_ms']:.3f} ms"
+            )
+
+        summary = report['summary']
+        if summary['accuracy'] is not None:
+            self.stdout.write(f"Accuracy: {summary['fields_matched']}/{summary['fields_total']} ({summary['accuracy']:.1%})")
+
+        self.stdout.write(f"Pathological inputs ({report['pathological_size']} and more chars, timeout {report['timeout']} s):")
+        for row in summary['flagged']:
+            large = "timeout" if row['large_ms'] is None else f"{row['large_ms']:.1f} ms"
+            self.stdout.write(f"  {row['flag'].upper()} {row['supplier']}.{row['pattern']} on {row['input']}: {large}")
+        if not summary['flagged']:
+            self.stdout.write("  No slow patterns found.")
+
+        if kwargs['output']:
+            with open(kwargs['output'], 'w', encoding='utf-8') as output_file:
+                json.dump(report, output_file, indent=2, ensure_ascii=False)
+            self.stdout.write(f"Report written to {kwargs['output']}.")
+
+        if summary['flagged'] and kwargs['fail_on_flagged']:
+            raise CommandError(f"{len(summary['flagged'])} slow pattern(s) on pathological inputs.")
@@ -0,0 +1,67 @@
+import os
+import json
+from django.core.management.base import BaseCommand, CommandError
+from apps.invoices.benchmark import STAGES, compare_reports, default_corpus_dir, expected_path, run_benchmark
+
+class Command(BaseCommand):
+    help = 'Benchmark the invoice pipeline stages (time, CPU, peak RSS) and field accuracy over a corpus of PDFs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', type=str, help='PDF files or directories (default: facturas/)')
+        parser.add_argument('--repeat', type=int, default=1, help='Runs per document (median time is reported)')
+        parser.add_argument('--force-ocr', action='store_true', help='OCR every page even if it has a text layer')
+        parser.add_argument('--output', type=str, help='Write the JSON report to this file')
+        parser.add_argument('--compare', type=str, help='Baseline JSON report to compare against')
+        parser.add_argument('--max-slowdown', type=float, default=0.10, help='Allowed wall time increase per stage (0.10 = 10%%)')
+        parser.add_argument('--fail-on-regression', action='store_true', help='Exit with an error if a regression is found')
+        parser.add_argument('--update-expected', action='store_true', help='Store the extracted JSON as the expected result')
+
+    def handle(self, *args, **kwargs):
+        report = run_benchmark(kwargs['paths'] or [default_corpus_dir()], repeat=kwargs['repeat'], force_ocr=kwargs['force_ocr'])
+
+        for name, document in report['documents'].items():
+            accuracy = document['accuracy']
+            score = f"{accuracy['matched']}/{accuracy['total']} fields" if accuracy else "no expected JSON"
+            self.stdout.write(f"{name} ({document['supplier'] or 'unknown'}): {document['wall_ms']:.1f} ms, {score}")
+            for stage in STAGES:
+                metrics = document['stages'][stage]
+                self.stdout.write(
+                    f"  {stage:<12}{metrics['wall_ms']:>10.1f} ms wall{metrics['cpu_ms']:>10.1f} ms cpu"
+                    f"{metrics['peak_rss_mb']:>10.1f} MB peak"
+                )
+            for mismatch in (accuracy or {}).get('mismatches', []):
+                self.stdout.write(f"  ! {mismatch['field']}: expected {mismatch['expected']!r}, got {mismatch['actual']!r}")
+
+        summary = report['summary']
+        if summary['accuracy'] is not None:
+            self.stdout.write(f"Accuracy: {summary['fields_matched']}/{summary['fields_total']} ({summary['accuracy']:.1%})")
+        self.stdout.write(f"Total: {summary['wall_ms']:.1f} ms")
+
+        if kwargs['update_expected']:
+            for document in report['documents'].values():
+                if 'error' in document['result']:
+                    continue
+                path = expected_path(document['path'])
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'w', encoding='utf-8') as expected_file:
+                    json.dump(document['result'], expected_file, indent=2, ensure_ascii=False)
+                    expected_file.write("\n")
+                self.stdout.write(f"Expected result written to {path}.")
+
+        if kwargs['output']:
+            with open(kwargs['output'], 'w', encoding='utf-8') as output_file:
+                json.dump(report, output_file, indent=2, ensure_ascii=False)
+            self.stdout.write(f"Report written to {kwargs['output']}.")
+
+        if kwargs['compare']:
+            with open(kwargs['compare'], encoding='utf-8') as baseline_file:
+                baseline = json.load(baseline_file)
+            regressions = 0
+            self.stdout.write("Comparison with baseline:")
+            for name, metric, old, new, regression in compare_reports(baseline, report, kwargs['max_slowdown']):
+                regressions += regression
+                old_text = "-" if old is None else f"{old:.3f}"
+                new_text = "-" if new is None else f"{new:.3f}"
+                self.stdout.write(f"  {'REGRESSION ' if regression else ''}{name} {metric}: {old_text} -> {new_text}")
+            if regressions and kwargs['fail_on_regression']:
+                raise CommandError(f"{regressions} regression(s) against {kwargs['compare']}.")
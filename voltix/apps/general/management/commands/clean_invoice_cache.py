@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from apps.invoices.cache import evict_expired
+
+class Command(BaseCommand):
+    help = 'Evict expired and least recently used invoice extraction cache entries'
+
+    def handle(self, *args, **kwargs):
+        deleted = evict_expired()
+        self.stdout.write(f"Deleted {deleted} invoice cache entries.")
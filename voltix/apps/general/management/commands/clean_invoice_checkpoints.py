@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from apps.invoices.checkpoints import expire_checkpoints
+
+class Command(BaseCommand):
+    help = 'Discard expired checkpoints and orphaned PDFs of failed invoice processing jobs'
+
+    def handle(self, *args, **kwargs):
+        expired = expire_checkpoints()
+        self.stdout.write(f"Discarded {expired} invoice checkpoints and orphaned uploads.")
@@ -0,0 +1,58 @@
+import os
+import sys
+import json
+from django.core.management.base import BaseCommand, CommandError
+from apps.measurements.ingestion import FORMATS, ingest_measurements
+
+class Command(BaseCommand):
+    help = 'Stream a meter export (NDJSON or CSV) into measurements, validating each row and writing in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Export file, or '-' to read from stdin")
+        parser.add_argument(
+            '--format', choices=FORMATS,
+            help='Input format (default: from the file extension; .jsonl is NDJSON)',
+        )
+        parser.add_argument(
+            '--batch-size', type=int,
+            help='Rows per bulk insert (default: MEASUREMENT_INGEST_BATCH_SIZE)',
+        )
+        parser.add_argument(
+            '--errors-output',
+            help='Write the per-row errors to this JSON file instead of printing them',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format']
+        if file_format is None:
+            extension = os.path.splitext(path)[1].lower()
+            file_format = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}.get(extension)
+            if file_format is None:
+                raise CommandError("Cannot infer the format from the file name; use --format.")
+
+        def progress(report):
+            self.stdout.write(f"{report['rows']} rows read, {report['created']} created, {report['errors']} errors...")
+
+        try:
+            if path == '-':
+                report = ingest_measurements(sys.stdin, file_format, batch_size=options['batch_size'], on_batch=progress)
+            else:
+                with open(path, encoding='utf-8', errors='replace', newline='') as export:
+                    report = ingest_measurements(export, file_format, batch_size=options['batch_size'], on_batch=progress)
+        except OSError as e:
+            raise CommandError(f"Cannot read {path}: {e}")
+
+        if options['errors_output']:
+            with open(options['errors_output'], 'w', encoding='utf-8') as errors_file:
+                json.dump(report['error_details'], errors_file, indent=2, ensure_ascii=False)
+        else:
+            for error in report['error_details']:
+                self.stderr.write(f"Line {error['line']}: {error['error']}")
+        if report['errors_truncated']:
+            self.stderr.write(f"Only the first {len(report['error_details'])} of {report['errors']} errors were reported.")
+
+        style = self.style.SUCCESS if not report['errors'] else self.style.WARNING
+        self.stdout.write(style(
+            f"Loaded {report['created']} of {report['rows']} measurements ({report['errors']} rows with errors)."
+        ))
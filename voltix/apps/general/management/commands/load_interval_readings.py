@@ -0,0 +1,97 @@
+import csv
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from apps.general.models import Invoice, User
+from apps.measurements.intervals import SLOTS_PER_DAY, materialize_measurements, month_periods, store_readings
+
+class Command(BaseCommand):
+    help = (
+        'Load an hourly or quarter-hourly meter curve (CSV with user_dni,timestamp,kwh) into per-day interval '
+        'readings and optionally roll it up into monthly or per-invoice measurements'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file with the columns user_dni, timestamp (local time) and kwh')
+        parser.add_argument('--resolution', type=int, choices=sorted(SLOTS_PER_DAY), default=60, help='Minutes per reading')
+        parser.add_argument(
+            '--rollup', choices=('none', 'months', 'invoices'), default='none',
+            help="Also write measurements for each calendar month or each invoice billing period covered by the curve",
+        )
+        parser.add_argument('--batch-size', type=int, help='Rows per chunk (default: MEASUREMENT_INGEST_BATCH_SIZE)')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size'] or settings.MEASUREMENT_INGEST_BATCH_SIZE
+        self.user_ids = {}
+        self.covered = {}  # user_id -> (primer día, último día) cargados
+        self.days = 0
+        rows = errors = 0
+
+        try:
+            with open(options['path'], encoding='utf-8', newline='') as export:
+                reader = csv.DictReader(export)
+                chunk = []
+                for row in reader:
+                    rows += 1
+                    try:
+                        chunk.append((row['user_dni'].strip(), np.datetime64(row['timestamp'].strip(), 'm'), float(row['kwh'].replace(',', '.'))))
+                    except (AttributeError, KeyError, ValueError) as e:
+                        errors += 1
+                        self.stderr.write(f"Line {reader.line_num}: invalid row ({e})")
+                        continue
+                    if len(chunk) >= batch_size:
+                        errors += self.store_chunk(chunk, options['resolution'])
+                        chunk = []
+                if chunk:
+                    errors += self.store_chunk(chunk, options['resolution'])
+        except OSError as e:
+            raise CommandError(f"Cannot read {options['path']}: {e}")
+
+        self.stdout.write(f"Stored {self.days} meter-days from {rows - errors} of {rows} readings.")
+
+        if options['rollup'] != 'none':
+            written = 0
+            for user_id, (first_day, last_day) in self.covered.items():
+                if options['rollup'] == 'months':
+                    periods = month_periods(first_day, last_day)
+                else:
+                    periods = Invoice.objects.filter(
+                        user_id=user_id, billing_period_start__lte=last_day, billing_period_end__gte=first_day
+                    ).values_list('billing_period_start', 'billing_period_end')
+                written += materialize_measurements(user_id, periods)
+            self.stdout.write(self.style.SUCCESS(f"Rolled the curves up into {written} measurements."))
+
+    def store_chunk(self, chunk, resolution):
+        """
+        Guarda un bloque de lecturas agrupadas por usuario. Retorna las lecturas descartadas.
+        """
+        missing = {dni for dni, _, _ in chunk} - self.user_ids.keys()
+        if missing:
+            self.user_ids.update(dict.fromkeys(missing))
+            self.user_ids.update(User.objects.filter(dni__in=missing).values_list('dni', 'user_id'))
+
+        by_user = {}
+        discarded = 0
+        for dni, timestamp, kwh in chunk:
+            if self.user_ids[dni] is None:
+                discarded += 1
+                continue
+            by_user.setdefault(self.user_ids[dni], ([], []))
+            by_user[self.user_ids[dni]][0].append(timestamp)
+            by_user[self.user_ids[dni]][1].append(kwh)
+        if discarded:
+            self.stderr.write(f"Skipped {discarded} readings of unknown users.")
+
+        for user_id, (timestamps, values) in by_user.items():
+            timestamps = np.array(timestamps, dtype='datetime64[m]')
+            try:
+                self.days += store_readings(user_id, timestamps, values, resolution)
+            except ValueError as e:
+                self.stderr.write(f"User {user_id}: {e}")
+                discarded += len(values)
+                continue
+            first_day, last_day = timestamps.min().astype('datetime64[D]').item(), timestamps.max().astype('datetime64[D]').item()
+            if user_id in self.covered:
+                first_day, last_day = min(first_day, self.covered[user_id][0]), max(last_day, self.covered[user_id][1])
+            self.covered[user_id] = (first_day, last_day)
+        return discarded
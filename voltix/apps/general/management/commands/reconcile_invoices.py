@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from apps.general.models import User
+from apps.comparations.reconciliation import reconcile_invoices
+from apps.comparations.tasks import reconcile_invoices_task
+
+class Command(BaseCommand):
+    help = 'Compare every invoice without a comparison against its overlapping measurement, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', help='Only reconcile this user (DNI); can be repeated')
+        parser.add_argument('--batch-size', type=int, help='Invoices per batch (default: RECONCILIATION_BATCH_SIZE)')
+        parser.add_argument('--async', action='store_true', dest='run_async', help='Queue the reconciliation as a Celery job')
+
+    def handle(self, *args, **options):
+        user_ids = None
+        if options['user']:
+            user_ids = list(User.objects.filter(dni__in=options['user']).values_list('user_id', flat=True))
+            if len(user_ids) != len(set(options['user'])):
+                raise CommandError("Unknown user DNI.")
+
+        if options['run_async']:
+            result = reconcile_invoices_task.delay(user_ids, options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f"Queued reconciliation job {result.id}."))
+            return
+
+        def progress(report):
+            self.stdout.write(f"{report['compared']} invoices compared, {report['skipped']} skipped...")
+
+        report = reconcile_invoices(user_ids, options['batch_size'], on_batch=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f"Compared {report['compared']} invoices ({report['matching']} matching, {report['skipped']} skipped)."
+        ))
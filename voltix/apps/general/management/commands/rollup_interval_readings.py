@@ -0,0 +1,41 @@
+import time
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from apps.general.models import IntervalReading
+from apps.measurements.intervals import month_periods, rollup_users, save_measurement
+
+class Command(BaseCommand):
+    help = (
+        'Reclassify the interval readings of every customer into 2.0TD tariff periods and rewrite their '
+        'monthly measurements, processing customers in batches'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', required=True, help='First day (YYYY-MM-DD)')
+        parser.add_argument('--end', required=True, help='Last day (YYYY-MM-DD)')
+        parser.add_argument('--chunk-size', type=int, default=200, help='Customers loaded and classified per batch')
+
+    def handle(self, *args, **options):
+        try:
+            start, end = date.fromisoformat(options['start']), date.fromisoformat(options['end'])
+        except ValueError as e:
+            raise CommandError(f"Invalid date: {e}")
+        # Meses completos, para no sobrescribir una medición mensual con una parte del mes
+        start, end = month_periods(start, end)[0][0], month_periods(end, end)[-1][1]
+
+        user_ids = list(
+            IntervalReading.objects.filter(day__range=(start, end)).values_list('user_id', flat=True).distinct().order_by('user_id')
+        )
+        started = time.perf_counter()
+        written = 0
+        for index in range(0, len(user_ids), options['chunk_size']):
+            chunk = user_ids[index:index + options['chunk_size']]
+            for user_id, months in rollup_users(chunk, start, end).items():
+                for month, data in months.items():
+                    save_measurement(user_id, month, month_periods(month, month)[0][1], data)
+                    written += 1
+            self.stdout.write(f"{min(index + len(chunk), len(user_ids))}/{len(user_ids)} customers processed...")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rewrote {written} monthly measurements for {len(user_ids)} customers in {time.perf_counter() - started:.1f} s."
+        ))
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.3 on 2026-10-18 17:02
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('general', '0005_reminderschedule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceProcessingJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('file_name', models.CharField(max_length=255)),
+                ('file_path', models.CharField(blank=True, default='', max_length=500)),
+                ('status', models.CharField(choices=[('pending', 'Pendiente'), ('processing', 'Procesando'), ('success', 'Completado'), ('error', 'Error')], default='pending', max_length=20)),
+                ('stage', models.CharField(default='queued', max_length=50)),
+                ('progress', models.PositiveSmallIntegerField(default=0)),
+                ('result', models.JSONField(blank=True, null=True)),
+                ('ocr_text', models.TextField(blank=True, default='')),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('invoice', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='general.invoice')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.1.3 on 2026-10-18 17:08
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('general', '0006_invoiceprocessingjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoiceprocessingjob',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.CreateModel(
+            name='InvoiceExtractionCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64)),
+                ('pipeline_version', models.CharField(max_length=20)),
+                ('result', models.JSONField()),
+                ('ocr_text', models.TextField(blank=True, default='')),
+                ('image_url', models.URLField(blank=True, max_length=500, null=True)),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'unique_together': {('content_hash', 'pipeline_version')},
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.3 on 2026-10-18 17:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('general', '0007_invoiceextractioncache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='ocr_confidence',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='processing_metrics',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='invoiceprocessingjob',
+            name='metrics',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
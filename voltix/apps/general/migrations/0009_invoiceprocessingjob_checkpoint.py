@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-18 17:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('general', '0008_invoice_processing_metrics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoiceprocessingjob',
+            name='checkpoint',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
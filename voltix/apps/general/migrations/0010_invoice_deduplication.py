@@ -0,0 +1,61 @@
+# Generated by Django 5.1.3 on 2026-10-18 17:44
+
+from django.db import migrations, models
+
+
+def backfill_invoice_keys(apps, schema_editor):
+    # Las facturas existentes también cuentan para detectar duplicados
+    Invoice = apps.get_model('general', 'Invoice')
+    InvoiceProcessingJob = apps.get_model('general', 'InvoiceProcessingJob')
+    hashes = dict(
+        InvoiceProcessingJob.objects.exclude(invoice=None).exclude(content_hash='').values_list('invoice_id', 'content_hash')
+    )
+    for invoice in Invoice.objects.only('id', 'data').iterator():
+        reference_number = invoice.data.get('numero_referencia') if isinstance(invoice.data, dict) else None
+        invoice.reference_number = str(reference_number or '')[:100]
+        invoice.content_hash = hashes.get(invoice.id, '')
+        if invoice.reference_number or invoice.content_hash:
+            invoice.save(update_fields=['reference_number', 'content_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('general', '0009_invoiceprocessingjob_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='reference_number',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='invoiceprocessingjob',
+            name='duplicate',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='invoiceprocessingjob',
+            name='idempotency_key',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['user', 'content_hash'], name='invoice_user_hash_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['user', 'reference_number'], name='invoice_user_reference_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='invoiceprocessingjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('idempotency_key', ''), _negated=True), fields=('user', 'idempotency_key'), name='invoice_job_user_idempotency_key_unique'),
+        ),
+        migrations.RunPython(backfill_invoice_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.3 on 2026-10-18 17:49
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('general', '0010_invoice_deduplication'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IntervalReading',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('resolution_minutes', models.PositiveSmallIntegerField(choices=[(60, 'Horaria'), (15, 'Cuartohoraria')], default=60)),
+                ('values', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'day')},
+            },
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.1.3 on 2026-10-18 17:54
+
+import datetime
+from django.db import migrations, models
+
+
+def seed_reference_tariff(apps, schema_editor):
+    # Tarifa con los valores que usaba calculate_total_to_pay: precio único de energía y sin término de potencia.
+    # Como aquel cálculo, vale para cualquier fecha
+    Tariff = apps.get_model('general', 'Tariff')
+    Tariff.objects.get_or_create(
+        code='voltix-referencia',
+        version=1,
+        defaults={
+            'supplier': 'Voltix',
+            'name': 'Referencia (precio único)',
+            'valid_from': datetime.date(1900, 1, 1),
+            'energy_price_p1': 0.1121,
+            'energy_price_p2': 0.1121,
+            'energy_price_p3': 0.1121,
+            'electricity_tax_rate': 0.051127,
+            'vat_rate': 0.21,
+        },
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('general', '0011_intervalreading'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='contracted_power_kw',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='Tariff',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=50)),
+                ('version', models.PositiveIntegerField(default=1)),
+                ('supplier', models.CharField(max_length=100)),
+                ('name', models.CharField(max_length=150)),
+                ('valid_from', models.DateField()),
+                ('valid_to', models.DateField(blank=True, null=True)),
+                ('energy_price_p1', models.FloatField()),
+                ('energy_price_p2', models.FloatField()),
+                ('energy_price_p3', models.FloatField()),
+                ('power_price_p1', models.FloatField(default=0)),
+                ('power_price_p2', models.FloatField(default=0)),
+                ('electricity_tax_rate', models.FloatField(default=0.051127)),
+                ('electricity_tax_min_per_kwh', models.FloatField(default=0)),
+                ('vat_rate', models.FloatField(default=0.21)),
+                ('meter_rental_per_day', models.FloatField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('code', 'version')},
+            },
+        ),
+        migrations.RunPython(seed_reference_tariff, migrations.RunPython.noop),
+    ]
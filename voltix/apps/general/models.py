@@ -56,6 +56,7 @@ class Profile(models.Model):
     address = models.TextField()
     phone_number = models.CharField(max_length=20)
     photo = models.ImageField(upload_to='profile_photos/', blank=True, null=True) 
+    contracted_power_kw = models.FloatField(null=True, blank=True)  # Potencia contratada (kW) para simular el término de potencia
     # photo_url = models.URLField(max_length=500, null=True, blank=True) 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -71,9 +72,20 @@ class Invoice(models.Model):
     billing_period_end = models.DateField()  # Fecha de fin del período de facturación
     data = models.JSONField()  # Datos JSON (por ejemplo, OCR o metadatos)
     image_url = models.URLField(max_length=500, null=True, blank=True)
+    processing_metrics = models.JSONField(null=True, blank=True)  # Tiempos por etapa y confianza del OCR por página
+    ocr_confidence = models.FloatField(null=True, blank=True)  # Confianza media de Tesseract (0-100), None sin OCR
+    content_hash = models.CharField(max_length=64, blank=True, default='')  # SHA-256 del PDF del que se extrajo
+    reference_number = models.CharField(max_length=100, blank=True, default='')  # `numero_referencia` extraído
     created_at = models.DateTimeField(auto_now_add=True)  # Fecha de creación
     updated_at = models.DateTimeField(auto_now=True)  # Fecha de última actualización
 
+    class Meta:
+        # Detección de facturas ya subidas por el mismo usuario (mismo PDF o mismo número de referencia y periodo)
+        indexes = [
+            models.Index(fields=['user', 'content_hash'], name='invoice_user_hash_idx'),
+            models.Index(fields=['user', 'reference_number'], name='invoice_user_reference_idx'),
+        ]
+
     def __str__(self):
         return f"Invoice {self.id} - User: {self.user.fullname}"
     
@@ -96,6 +108,31 @@ class Measurement(models.Model):
         return f"Measurement {self.id} - User: {self.user.fullname} - Start: {self.measurement_start} - End: {self.measurement_end}"
 
 
+class IntervalReading(models.Model):
+    """
+    Curva de carga de un día de un usuario: `values` guarda los kWh de cada intervalo del día (24 horarios
+    o 96 cuartohorarios) como un array float32 little-endian, con NaN en los intervalos sin lectura.
+    Un año de datos cuartohorarios son 365 filas de 384 bytes en lugar de 35.040 filas.
+    """
+    RESOLUTION_CHOICES = [
+        (60, 'Horaria'),
+        (15, 'Cuartohoraria'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    day = models.DateField()  # Día local (hora oficial) de las lecturas
+    resolution_minutes = models.PositiveSmallIntegerField(choices=RESOLUTION_CHOICES, default=60)
+    values = models.BinaryField()  # kWh por intervalo (float32 little-endian)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('user', 'day')
+
+    def __str__(self):
+        return f"Curva {self.day} ({self.resolution_minutes} min) - User: {self.user.fullname}"
+
+
 class Notification(models.Model):
     notification_id = models.AutoField(primary_key=True)
     user = models.ForeignKey('User', on_delete=models.CASCADE)
@@ -191,3 +228,129 @@ class ReminderSchedule(models.Model):
     def __str__(self):
         return f"Reminder scheduled for {self.user.email} at {self.scheduled_time}"
 
+
+
+import uuid
+
+
+class InvoiceProcessingJob(models.Model):
+    """
+    Trabajo asíncrono de procesamiento de una factura subida (PDF -> OCR -> JSON).
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pendiente'),
+        ('processing', 'Procesando'),
+        ('success', 'Completado'),
+        ('error', 'Error'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    invoice = models.ForeignKey(Invoice, on_delete=models.SET_NULL, null=True, blank=True)  # Factura creada al terminar
+    file_name = models.CharField(max_length=255)
+    file_path = models.CharField(max_length=500, blank=True, default='')  # Ruta temporal del PDF mientras se procesa
+    content_hash = models.CharField(max_length=64, blank=True, default='')  # SHA-256 del PDF subido
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    stage = models.CharField(max_length=50, default='queued')  # Etapa actual del pipeline
+    progress = models.PositiveSmallIntegerField(default=0)  # Porcentaje de avance (0-100)
+    result = models.JSONField(null=True, blank=True)  # JSON extraído de la factura
+    ocr_text = models.TextField(blank=True, default='')
+    error = models.TextField(blank=True, default='')
+    metrics = models.JSONField(default=dict, blank=True)  # Tiempos de las etapas previas al worker (guardado del PDF)
+    checkpoint = models.JSONField(default=dict, blank=True)  # Resultado de cada etapa terminada, para reanudar el trabajo
+    idempotency_key = models.CharField(max_length=255, blank=True, default='')  # Cabecera Idempotency-Key de la subida
+    duplicate = models.BooleanField(default=False)  # La factura ya existía: `invoice` es la factura original
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'idempotency_key'],
+                condition=~models.Q(idempotency_key=''),
+                name='invoice_job_user_idempotency_key_unique',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Job {self.id} - User: {self.user.fullname} - {self.status} ({self.stage})"
+
+    def mark_stage(self, stage, progress, status=None):
+        self.stage = stage
+        self.progress = progress
+        if status:
+            self.status = status
+        self.save(update_fields=['stage', 'progress', 'status', 'updated_at'])
+
+    def mark_done(self, parsed_data, ocr_text, invoice=None, duplicate=False):
+        self.status = 'success'
+        self.stage = 'done'
+        self.progress = 100
+        self.result = parsed_data
+        self.ocr_text = ocr_text
+        self.invoice = invoice
+        self.duplicate = duplicate
+        self.save()
+
+    def mark_failed(self, error, parsed_data=None, ocr_text=""):
+        self.status = 'error'
+        self.error = error
+        self.result = parsed_data
+        self.ocr_text = ocr_text
+        self.save()
+
+    def save_checkpoint(self, **stages):
+        self.checkpoint = {**self.checkpoint, **stages}
+        self.save(update_fields=['checkpoint', 'updated_at'])
+
+
+class Tariff(models.Model):
+    """
+    Versión de una tarifa 2.0TD del catálogo: precios de energía (€/kWh) por periodo, de potencia
+    (€/kW·día) por periodo, impuestos y alquiler del contador, con sus fechas de vigencia. Los cambios de
+    precio se registran como una versión nueva del mismo `code`.
+    """
+    code = models.CharField(max_length=50)  # Identificador estable de la tarifa entre versiones
+    version = models.PositiveIntegerField(default=1)
+    supplier = models.CharField(max_length=100)
+    name = models.CharField(max_length=150)
+    valid_from = models.DateField()
+    valid_to = models.DateField(null=True, blank=True)  # None: vigente
+    energy_price_p1 = models.FloatField()
+    energy_price_p2 = models.FloatField()
+    energy_price_p3 = models.FloatField()
+    power_price_p1 = models.FloatField(default=0)
+    power_price_p2 = models.FloatField(default=0)
+    electricity_tax_rate = models.FloatField(default=0.051127)  # Impuesto especial sobre la electricidad
+    electricity_tax_min_per_kwh = models.FloatField(default=0)  # Cuota mínima del impuesto (€/kWh)
+    vat_rate = models.FloatField(default=0.21)
+    meter_rental_per_day = models.FloatField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('code', 'version')
+
+    def __str__(self):
+        return f"{self.supplier} - {self.name} (v{self.version})"
+
+
+class InvoiceExtractionCache(models.Model):
+    """
+    Resultado del pipeline de facturas indexado por el SHA-256 del PDF y la versión del pipeline.
+    Permite responder a las re-subidas de un mismo PDF sin volver a ejecutar OCR ni subir imágenes.
+    """
+    content_hash = models.CharField(max_length=64)  # SHA-256 del PDF
+    pipeline_version = models.CharField(max_length=20)
+    result = models.JSONField()  # JSON extraído de la factura
+    ocr_text = models.TextField(blank=True, default='')
+    image_url = models.URLField(max_length=500, null=True, blank=True)
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=now, db_index=True)  # Para expirar por TTL y desalojar por LRU
+
+    class Meta:
+        unique_together = ('content_hash', 'pipeline_version')
+
+    def __str__(self):
+        return f"Cache {self.content_hash[:12]} (v{self.pipeline_version}) - {self.hits} hits"
@@ -1,4 +1,6 @@
-from django.db.models.signals import post_save
+import datetime
+from django.apps import apps as global_apps
+from django.db.models.signals import post_migrate, post_save
 from django.dispatch import receiver
 from django.contrib.contenttypes.models import ContentType
 from .models import User, Profile, InvoiceComparison, Notification, NotificationSettings, ReminderSchedule
@@ -32,6 +34,34 @@ def save_user_profile(sender, instance, **kwargs):
     instance.profile.save()
 
 
+# Tarifa de referencia del catálogo (la de DEFAULT_TARIFF_CODE por defecto): los valores que usaba
+# calculate_total_to_pay, con un precio único de energía, sin término de potencia y válida para cualquier fecha
+REFERENCE_TARIFF_CODE = 'voltix-referencia'
+REFERENCE_TARIFF = {
+    'supplier': 'Voltix',
+    'name': 'Referencia (precio único)',
+    'valid_from': datetime.date(1900, 1, 1),
+    'energy_price_p1': 0.1121,
+    'energy_price_p2': 0.1121,
+    'energy_price_p3': 0.1121,
+    'electricity_tax_rate': 0.051127,
+    'vat_rate': 0.21,
+}
+
+
+@receiver(post_migrate)
+def seed_reference_tariff(sender, apps=global_apps, **kwargs):
+    # Los despliegues regeneran las migraciones con makemigrations, que no conserva las migraciones de datos:
+    # la tarifa de referencia se crea (si falta) después de cada migrate
+    if sender.name != 'apps.general':
+        return
+    try:
+        Tariff = apps.get_model('general', 'Tariff')
+    except LookupError:
+        return
+    Tariff.objects.get_or_create(code=REFERENCE_TARIFF_CODE, version=1, defaults=REFERENCE_TARIFF)
+
+
 @receiver(post_save, sender=InvoiceComparison)
 def create_notification_for_discrepancies(sender, instance, created, **kwargs):
     if created and not instance.is_comparison_valid:
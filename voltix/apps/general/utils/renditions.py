@@ -0,0 +1,111 @@
+################################################################################################################################
+############################################ VARIANTES DE TAMAÑO DE LAS IMÁGENES ###############################################
+################################################################################################################################
+
+# Las imágenes que sirve la API se ofrecen en tres variantes: miniatura, vista previa y original. Las de Cloudinary
+# (facturas) no se duplican: sus variantes son transformaciones en la URL, que Cloudinary genera en la primera
+# petición y cachea en su CDN. Las del almacenamiento local (fotos de perfil) se generan con Pillow al subirlas.
+
+import os
+import logging
+from io import BytesIO
+from PIL import Image, ImageOps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+logger = logging.getLogger(__name__)
+
+RENDITIONS = ("thumbnail", "medium", "original")
+
+# Formato de Pillow -> (extensión, formato de entrega de Cloudinary)
+FORMATS = {"WEBP": ("webp", "webp"), "JPEG": ("jpg", "jpg")}
+
+CLOUDINARY_UPLOAD_MARKER = "/image/upload/"
+
+
+def rendition_sizes():
+    """
+    Lado máximo (px) de cada variante redimensionada, de mayor a menor.
+    """
+    return {"medium": settings.IMAGE_MEDIUM_SIZE, "thumbnail": settings.IMAGE_THUMBNAIL_SIZE}
+
+
+def cloudinary_renditions(url):
+    """
+    Retorna {variante: URL} para una imagen de Cloudinary, o None si no hay imagen. Las URL que no son
+    de Cloudinary se devuelven sin transformar en todas las variantes.
+    """
+    if not url:
+        return None
+    if CLOUDINARY_UPLOAD_MARKER not in url:
+        return {rendition: url for rendition in RENDITIONS}
+
+    prefix, path = url.split(CLOUDINARY_UPLOAD_MARKER, 1)
+    _, delivery_format = FORMATS[settings.IMAGE_RENDITION_FORMAT]
+    renditions = {}
+    for rendition, size in rendition_sizes().items():
+        # c_limit: solo reduce, conservando la proporción
+        transformation = f"c_limit,w_{size},h_{size},q_{settings.IMAGE_RENDITION_QUALITY},f_{delivery_format}"
+        renditions[rendition] = f"{prefix}{CLOUDINARY_UPLOAD_MARKER}{transformation}/{path}"
+    renditions["original"] = url
+    return renditions
+
+
+def rendition_name(name, rendition):
+    """
+    Nombre en el almacenamiento de una variante: "profile_photos/foto.jpg" -> "profile_photos/renditions/foto.thumbnail.webp".
+    """
+    directory, file_name = os.path.split(name)
+    extension, _ = FORMATS[settings.IMAGE_RENDITION_FORMAT]
+    return os.path.join(directory, "renditions", f"{os.path.splitext(file_name)[0]}.{rendition}.{extension}")
+
+
+def generate_renditions(name, storage=default_storage):
+    """
+    Genera con Pillow las variantes que falten de una imagen del almacenamiento, en IMAGE_RENDITION_FORMAT
+    (WebP o JPEG) con IMAGE_RENDITION_QUALITY. Retorna {variante: nombre en el almacenamiento}.
+    """
+    names = {rendition: rendition_name(name, rendition) for rendition in rendition_sizes()}
+    pending = {rendition: size for rendition, size in rendition_sizes().items() if not storage.exists(names[rendition])}
+
+    if pending:
+        with storage.open(name, "rb") as source, Image.open(source) as image:
+            # Los JPEG se decodifican directamente a la escala más cercana a la variante mayor
+            largest = max(pending.values())
+            image.draft("RGB", (largest, largest))
+            image = ImageOps.exif_transpose(image).convert("RGB")
+            # De mayor a menor: cada variante se reduce a partir de la anterior
+            for rendition, size in pending.items():
+                image.thumbnail((size, size), Image.LANCZOS)
+                buffer = BytesIO()
+                image.save(buffer, format=settings.IMAGE_RENDITION_FORMAT, quality=settings.IMAGE_RENDITION_QUALITY)
+                names[rendition] = storage.save(names[rendition], ContentFile(buffer.getvalue()))
+
+    names["original"] = name
+    return names
+
+
+def local_renditions(image_field, build_url, storage=default_storage):
+    """
+    Retorna {variante: URL absoluta} de una imagen del almacenamiento local, generando las variantes que
+    falten (por ejemplo, de fotos subidas antes de existir las variantes). None si no hay imagen.
+    `build_url` convierte la ruta del almacenamiento en URL absoluta (request.build_absolute_uri).
+    """
+    if not image_field:
+        return None
+    try:
+        names = generate_renditions(image_field.name, storage=storage)
+    except (OSError, ValueError) as e:
+        logger.error(f"Error al generar las variantes de '{image_field.name}': {str(e)}")
+        names = {rendition: image_field.name for rendition in RENDITIONS}
+    return {rendition: build_url(storage.url(names[rendition])) for rendition in RENDITIONS}
+
+
+def delete_renditions(name, storage=default_storage):
+    """
+    Elimina las variantes generadas de una imagen del almacenamiento.
+    """
+    for rendition in rendition_sizes():
+        if storage.exists(rendition_name(name, rendition)):
+            storage.delete(rendition_name(name, rendition))
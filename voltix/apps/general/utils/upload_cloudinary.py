@@ -57,3 +57,31 @@ def process_and_upload_image(photo, folder="profiles", max_size=5 * 1024 * 1024)
 
     except IOError:
         raise ValueError("El archivo está corrupto o no es una imagen válida.")
+
+
+def upload_image_bytes(image_data, folder="invoices", filename="image.png", timeout=None):
+    """
+    Sube a Cloudinary una imagen ya codificada por el propio backend (por ejemplo, una página
+    renderizada de una factura). No se revalida ni se recodifica como en process_and_upload_image.
+
+    Args:
+        image_data (bytes): Imagen codificada (PNG, JPEG o WebP).
+        folder (str): Carpeta en Cloudinary donde se almacenará la imagen.
+        filename (str): Nombre del archivo enviado a Cloudinary.
+        timeout (int): Segundos máximos de la petición HTTP (sin límite si es None). Las peticiones
+            reutilizan el pool de conexiones HTTP del SDK de Cloudinary, compartido por el proceso.
+
+    Returns:
+        str: URL de la imagen subida a Cloudinary.
+
+    Raises:
+        CloudinaryError: Si hay un error al subir la imagen.
+    """
+    upload_result = upload(
+        image_data, folder=folder, filename=filename, overwrite=True, resource_type="image", timeout=timeout
+    )
+    photo_url = upload_result.get("secure_url")
+    if not photo_url:
+        raise CloudinaryError("Error al subir la imagen a Cloudinary.")
+
+    return photo_url
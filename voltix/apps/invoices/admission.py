@@ -0,0 +1,168 @@
+################################################################################################################################
+############################################ CONTROL DE ADMISIÓN DEL OCR #######################################################
+################################################################################################################################
+
+# Limita cuántos trabajos de OCR hay en curso a la vez, en total y por usuario. Cada trabajo admitido ocupa una
+# plaza (con caducidad, para no perderla si un worker muere) en dos conjuntos ordenados de Redis compartidos
+# por todos los workers. El worker renueva la plaza al empezar el trabajo y tras cada página de OCR, así un
+# trabajo que espera en la cola o tarda en el OCR no la pierde mientras sigue en curso; la plaza se libera al
+# terminar el trabajo. Sin Redis configurado se cuentan los
+# trabajos pendientes en la base de datos.
+
+import time
+import logging
+import redis
+from collections import namedtuple
+from django.conf import settings
+from django.utils.timezone import now, timedelta
+from apps.general.models import InvoiceProcessingJob
+
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_KEY = "voltix:invoices:ocr:inflight"
+USER_KEY = "voltix:invoices:ocr:inflight:user:{user_id}"
+
+# Resultado de pedir plaza: `reason` es None si se admite, "global" o "user" si no hay capacidad
+Admission = namedtuple("Admission", ["admitted", "reason", "queue_depth", "user_in_flight", "retry_after"])
+
+# Comprobar y reservar plaza en una sola operación atómica: 1 admitido, 0 sin plaza global, -1 sin plaza del usuario
+ACQUIRE_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[2])
+local global_count = redis.call('ZCARD', KEYS[1])
+local user_count = redis.call('ZCARD', KEYS[2])
+if global_count >= tonumber(ARGV[4]) then
+    return {0, global_count, user_count}
+end
+if user_count >= tonumber(ARGV[5]) then
+    return {-1, global_count, user_count}
+end
+redis.call('ZADD', KEYS[1], ARGV[1], ARGV[3])
+redis.call('ZADD', KEYS[2], ARGV[1], ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[6])
+redis.call('EXPIRE', KEYS[2], ARGV[6])
+return {1, global_count + 1, user_count + 1}
+"""
+
+_client = None
+
+
+def get_redis():
+    """
+    Cliente de Redis del proceso (con su pool de conexiones), o None si no hay Redis configurado.
+    """
+    global _client
+    if _client is None and settings.INVOICE_ADMISSION_REDIS_URL:
+        _client = redis.Redis.from_url(
+            settings.INVOICE_ADMISSION_REDIS_URL, socket_timeout=1, socket_connect_timeout=1
+        )
+    return _client
+
+
+def acquire(job):
+    """
+    Reserva una plaza de OCR para el trabajo si hay capacidad global y del usuario.
+    Si Redis no responde se admite el trabajo: la admisión nunca debe tumbar las subidas.
+    """
+    client = get_redis()
+    if client is None:
+        return acquire_from_database(job)
+
+    current = time.time()
+    lease = settings.INVOICE_ADMISSION_LEASE_SECONDS
+    try:
+        result, queue_depth, user_in_flight = client.eval(
+            ACQUIRE_SCRIPT, 2, GLOBAL_KEY, USER_KEY.format(user_id=job.user_id),
+            current, current - lease, str(job.id),
+            settings.INVOICE_ADMISSION_MAX_JOBS, settings.INVOICE_ADMISSION_MAX_JOBS_PER_USER, lease,
+        )
+    except Exception as e:
+        logger.error(f"Error en el control de admisión (Redis): {str(e)}")
+        return Admission(True, None, None, None, None)
+
+    reason = {1: None, 0: "global", -1: "user"}[int(result)]
+    return Admission(reason is None, reason, int(queue_depth), int(user_in_flight),
+                     None if reason is None else settings.INVOICE_ADMISSION_RETRY_AFTER)
+
+
+def acquire_from_database(job):
+    """
+    Admisión sin Redis: cuenta los trabajos pendientes o en curso (no es atómica entre workers).
+    """
+    in_flight = InvoiceProcessingJob.objects.filter(
+        status__in=("pending", "processing"),
+        updated_at__gte=now() - timedelta(seconds=settings.INVOICE_ADMISSION_LEASE_SECONDS),
+    ).exclude(pk=job.pk)
+    queue_depth = in_flight.count()
+    user_in_flight = in_flight.filter(user_id=job.user_id).count()
+
+    reason = None
+    if queue_depth >= settings.INVOICE_ADMISSION_MAX_JOBS:
+        reason = "global"
+    elif user_in_flight >= settings.INVOICE_ADMISSION_MAX_JOBS_PER_USER:
+        reason = "user"
+    if reason:
+        return Admission(False, reason, queue_depth, user_in_flight, settings.INVOICE_ADMISSION_RETRY_AFTER)
+    return Admission(True, None, queue_depth + 1, user_in_flight + 1, None)
+
+
+def renew(job):
+    """
+    Renueva la caducidad de la plaza de OCR del trabajo (o la vuelve a ocupar si caducó mientras el
+    trabajo esperaba en la cola). Sin Redis no hace nada: la plaza se cuenta por `updated_at`.
+    """
+    client = get_redis()
+    if client is None:
+        return
+    lease = settings.INVOICE_ADMISSION_LEASE_SECONDS
+    current = time.time()
+    try:
+        pipeline = client.pipeline()
+        for key in (GLOBAL_KEY, USER_KEY.format(user_id=job.user_id)):
+            pipeline.zadd(key, {str(job.id): current})
+            pipeline.expire(key, lease)
+        pipeline.execute()
+    except Exception as e:
+        logger.error(f"Error al renovar la plaza de OCR del trabajo {job.id}: {str(e)}")
+
+
+def release(job):
+    """
+    Libera la plaza de OCR del trabajo (no hace nada si no la tenía).
+    """
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        pipeline = client.pipeline()
+        pipeline.zrem(GLOBAL_KEY, str(job.id))
+        pipeline.zrem(USER_KEY.format(user_id=job.user_id), str(job.id))
+        pipeline.execute()
+    except Exception as e:
+        logger.error(f"Error al liberar la plaza de OCR del trabajo {job.id}: {str(e)}")
+
+
+def current_load(user=None):
+    """
+    Retorna (trabajos de OCR en curso, trabajos en curso del usuario).
+    """
+    client = get_redis()
+    if client is None:
+        in_flight = InvoiceProcessingJob.objects.filter(
+            status__in=("pending", "processing"),
+            updated_at__gte=now() - timedelta(seconds=settings.INVOICE_ADMISSION_LEASE_SECONDS),
+        )
+        return in_flight.count(), in_flight.filter(user=user).count() if user else None
+
+    expire_before = time.time() - settings.INVOICE_ADMISSION_LEASE_SECONDS
+    try:
+        pipeline = client.pipeline()
+        pipeline.zcount(GLOBAL_KEY, expire_before, "+inf")
+        if user:
+            pipeline.zcount(USER_KEY.format(user_id=user.pk), expire_before, "+inf")
+        counts = pipeline.execute()
+    except Exception as e:
+        logger.error(f"Error al consultar la cola de OCR (Redis): {str(e)}")
+        return None, None
+    return counts[0], counts[1] if user else None
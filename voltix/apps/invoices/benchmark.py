@@ -0,0 +1,270 @@
+################################################################################################################################
+############################################ BENCHMARK DEL PIPELINE DE FACTURAS ################################################
+################################################################################################################################
+
+# Ejecuta las etapas del pipeline de forma secuencial sobre un corpus de PDF (por defecto `facturas/`) y mide,
+# por etapa, el tiempo real, el tiempo de CPU y el pico de memoria residente. Si junto a un PDF existe
+# `expected/<nombre>.json`, se compara campo a campo con el JSON extraído. Lo usa el comando `benchmark_invoices`.
+
+import os
+import glob
+import json
+import time
+import resource
+import statistics
+from contextlib import contextmanager
+import fitz  # PyMuPDF
+from django.conf import settings
+from django.utils.timezone import now
+from .cache import PIPELINE_VERSION
+from .ocr import get_ocr_backend
+from .processing import InvoiceProcessor
+
+# Etapas en el orden en que se ejecutan
+STAGES = ("text_layer", "render", "identify", "preprocess", "ocr", "extract")
+
+# Diferencia admitida al comparar importes y consumos con el JSON esperado
+FLOAT_TOLERANCE = 0.01
+
+# Por debajo de esta diferencia (ms) un aumento de tiempo se considera ruido de medida, no una regresión
+MIN_REGRESSION_MS = 5.0
+
+
+def default_corpus_dir():
+    return os.path.join(settings.BASE_DIR.parent, "facturas")
+
+
+def expected_path(pdf_path):
+    directory, file_name = os.path.split(pdf_path)
+    return os.path.join(directory, "expected", os.path.splitext(file_name)[0] + ".json")
+
+
+def reset_peak_rss():
+    """
+    Reinicia el pico de memoria residente del proceso (VmHWM) para medirlo por etapa. Solo en Linux;
+    en otros sistemas el pico es el acumulado desde el arranque del proceso.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB en Linux
+
+
+class StageTimer:
+    """
+    Acumula tiempo real, tiempo de CPU y pico de memoria de cada etapa de un documento.
+    """
+
+    def __init__(self):
+        self.stages = {stage: {"wall_ms": 0.0, "cpu_ms": 0.0, "peak_rss_mb": 0.0} for stage in STAGES}
+
+    @contextmanager
+    def measure(self, stage):
+        reset_peak_rss()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            metrics = self.stages[stage]
+            metrics["wall_ms"] += (time.perf_counter() - wall) * 1000
+            metrics["cpu_ms"] += (time.process_time() - cpu) * 1000
+            metrics["peak_rss_mb"] = max(metrics["peak_rss_mb"], peak_rss_mb())
+
+
+def run_document(processor, pdf_path, force_ocr=False):
+    """
+    Ejecuta una vez las etapas del pipeline sobre un PDF. Retorna (StageTimer, JSON extraído, comercializadora).
+    Con `force_ocr` se hace OCR de todas las páginas aunque tengan capa de texto.
+    """
+    timer = StageTimer()
+    with fitz.open(pdf_path) as pdf_document:
+        page_numbers = range(min(len(pdf_document), settings.INVOICE_MAX_PAGES))
+
+        with timer.measure("text_layer"):
+            text_layers = processor.extract_text_layers(pdf_document, page_numbers)
+        if force_ocr:
+            text_layers = {page_number: None for page_number in page_numbers}
+
+        page_texts = []
+        supplier = None
+        for page_number in page_numbers:
+            if page_number > 0 and text_layers[page_number]:
+                page_texts.append(text_layers[page_number]["text"])
+                continue
+
+            with timer.measure("render"):
+                pix = processor.render_page(pdf_document[page_number])
+            image = processor.pixmap_to_array(pix)
+
+            if page_number == 0:
+                with timer.measure("identify"):
+                    supplier = processor.identify_supplier(image, text_layers)
+                if text_layers[0]:
+                    page_texts.append(text_layers[0]["text"])
+                    continue
+
+            with timer.measure("preprocess"):
+                grayscale_image = processor.process_image(image)
+            with timer.measure("ocr"):
+                page_texts.append(processor.perform_ocr(grayscale_image))
+            del image, pix
+
+        with timer.measure("extract"):
+            parsed_data = processor.convert_ocr_to_json(
+                "".join(text + "\n" for text in page_texts), supplier=supplier
+            )
+    return timer, parsed_data, supplier
+
+
+def flatten(data, prefix=""):
+    """
+    Convierte un JSON anidado en {"seccion.campo": valor}.
+    """
+    fields = {}
+    for key, value in data.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            fields.update(flatten(value, prefix=f"{path}."))
+        else:
+            fields[path] = value
+    return fields
+
+
+def values_match(expected, actual):
+    if isinstance(expected, (int, float)) and isinstance(actual, (int, float)):
+        return abs(expected - actual) <= FLOAT_TOLERANCE
+    return expected == actual
+
+
+def field_accuracy(expected, actual):
+    """
+    Compara campo a campo el JSON esperado con el extraído.
+    """
+    expected_fields, actual_fields = flatten(expected), flatten(actual)
+    mismatches = [
+        {"field": field, "expected": value, "actual": actual_fields.get(field)}
+        for field, value in expected_fields.items()
+        if not values_match(value, actual_fields.get(field))
+    ]
+    total = len(expected_fields)
+    return {
+        "matched": total - len(mismatches),
+        "total": total,
+        "accuracy": (total - len(mismatches)) / total if total else 1.0,
+        "mismatches": mismatches,
+    }
+
+
+def run_benchmark(paths, repeat=1, force_ocr=False):
+    """
+    Ejecuta el benchmark sobre los PDF indicados (archivos o directorios) y retorna el informe.
+    Con varias repeticiones se toma la mediana de los tiempos de cada etapa y el máximo del pico de memoria.
+    """
+    pdf_paths = []
+    for path in paths:
+        pdf_paths.extend(sorted(glob.glob(os.path.join(path, "*.pdf"))) if os.path.isdir(path) else [path])
+
+    processor = InvoiceProcessor()
+    documents = {}
+    for pdf_path in pdf_paths:
+        runs = []
+        for _ in range(repeat):
+            runs.append(run_document(processor, pdf_path, force_ocr=force_ocr))
+        _, parsed_data, supplier = runs[-1]
+
+        stages = {
+            stage: {
+                "wall_ms": statistics.median(timer.stages[stage]["wall_ms"] for timer, _, _ in runs),
+                "cpu_ms": statistics.median(timer.stages[stage]["cpu_ms"] for timer, _, _ in runs),
+                "peak_rss_mb": max(timer.stages[stage]["peak_rss_mb"] for timer, _, _ in runs),
+            }
+            for stage in STAGES
+        }
+
+        accuracy = None
+        if os.path.exists(expected_path(pdf_path)):
+            with open(expected_path(pdf_path), encoding="utf-8") as expected_file:
+                accuracy = field_accuracy(json.load(expected_file), parsed_data)
+
+        documents[os.path.basename(pdf_path)] = {
+            "path": pdf_path,
+            "supplier": supplier,
+            "stages": stages,
+            "wall_ms": sum(metrics["wall_ms"] for metrics in stages.values()),
+            "accuracy": accuracy,
+            "result": parsed_data,
+        }
+
+    return {
+        "created_at": now().isoformat(),
+        "pipeline_version": PIPELINE_VERSION,
+        "ocr_backend": get_ocr_backend().name,
+        "repeat": repeat,
+        "force_ocr": force_ocr,
+        "documents": documents,
+        "summary": summarize(documents),
+    }
+
+
+def summarize(documents):
+    """
+    Totales por etapa y precisión global (campos acertados / campos esperados) del corpus.
+    """
+    stages = {
+        stage: {
+            "wall_ms": sum(document["stages"][stage]["wall_ms"] for document in documents.values()),
+            "cpu_ms": sum(document["stages"][stage]["cpu_ms"] for document in documents.values()),
+            "peak_rss_mb": max((document["stages"][stage]["peak_rss_mb"] for document in documents.values()), default=0.0),
+        }
+        for stage in STAGES
+    }
+    scored = [document["accuracy"] for document in documents.values() if document["accuracy"]]
+    matched, total = sum(score["matched"] for score in scored), sum(score["total"] for score in scored)
+    return {
+        "stages": stages,
+        "wall_ms": sum(metrics["wall_ms"] for metrics in stages.values()),
+        "fields_matched": matched,
+        "fields_total": total,
+        "accuracy": matched / total if total else None,
+    }
+
+
+def compare_reports(baseline, current, max_slowdown=0.10):
+    """
+    Compara dos informes. Retorna una lista de (etapa o documento, métrica, antes, después, regresión),
+    donde regresión indica si el tiempo real crece más de `max_slowdown` (y de MIN_REGRESSION_MS) o baja la precisión.
+    """
+    rows = []
+    for stage in STAGES:
+        before = baseline["summary"]["stages"].get(stage, {})
+        after = current["summary"]["stages"][stage]
+        for metric in ("wall_ms", "cpu_ms", "peak_rss_mb"):
+            old, new = before.get(metric), after[metric]
+            regression = (
+                metric == "wall_ms" and old is not None
+                and new > old * (1 + max_slowdown) and new - old > MIN_REGRESSION_MS
+            )
+            rows.append((stage, metric, old, new, regression))
+
+    old_accuracy, new_accuracy = baseline["summary"]["accuracy"], current["summary"]["accuracy"]
+    rows.append(("total", "accuracy", old_accuracy, new_accuracy,
+                 old_accuracy is not None and new_accuracy is not None and new_accuracy < old_accuracy))
+
+    for name, document in current["documents"].items():
+        previous = baseline["documents"].get(name)
+        if previous and previous["accuracy"] and document["accuracy"]:
+            old, new = previous["accuracy"]["accuracy"], document["accuracy"]["accuracy"]
+            rows.append((name, "accuracy", old, new, new < old))
+    return rows
@@ -0,0 +1,91 @@
+################################################################################################################################
+############################################ CACHÉ DE RESULTADOS POR HASH DEL PDF ##############################################
+################################################################################################################################
+
+import logging
+from django.conf import settings
+from django.db.models import F
+from django.utils.timezone import now, timedelta
+from apps.general.models import InvoiceExtractionCache
+
+
+logger = logging.getLogger(__name__)
+
+# Incrementar al cambiar el render, el OCR o los extractores para que no se reutilicen resultados antiguos
+PIPELINE_VERSION = "2"
+
+
+def get_cached_result(content_hash):
+    """
+    Devuelve la entrada de caché vigente para el hash (o None) y la marca como usada. Las entradas
+    cuya imagen aún no se ha publicado (o no se pudo publicar) no se sirven: la factura creada desde
+    la caché se quedaría sin imagen para siempre.
+    """
+    if not content_hash:
+        return None
+
+    expires_before = now() - timedelta(days=settings.INVOICE_CACHE_TTL_DAYS)
+    entry = InvoiceExtractionCache.objects.filter(
+        content_hash=content_hash,
+        pipeline_version=PIPELINE_VERSION,
+        last_used_at__gte=expires_before,
+        image_url__isnull=False,
+    ).first()
+    if entry:
+        InvoiceExtractionCache.objects.filter(pk=entry.pk).update(hits=F('hits') + 1, last_used_at=now())
+        logger.info(f"Resultado de factura recuperado de la caché ({content_hash[:12]}).")
+    return entry
+
+
+def store_result(content_hash, parsed_data, ocr_text, image_url):
+    """
+    Guarda (o renueva) el resultado del pipeline para el hash del PDF.
+    """
+    if not content_hash:
+        return
+
+    InvoiceExtractionCache.objects.update_or_create(
+        content_hash=content_hash,
+        pipeline_version=PIPELINE_VERSION,
+        defaults={
+            "result": parsed_data,
+            "ocr_text": ocr_text,
+            "image_url": image_url,
+            "last_used_at": now(),
+        },
+    )
+
+
+def store_image_url(content_hash, image_url):
+    """
+    Completa la URL de la imagen de la entrada del hash, que se guarda antes de publicar la imagen.
+    """
+    if not content_hash:
+        return
+
+    InvoiceExtractionCache.objects.filter(content_hash=content_hash, pipeline_version=PIPELINE_VERSION).update(
+        image_url=image_url
+    )
+
+
+def evict_expired():
+    """
+    Elimina las entradas caducadas (TTL) y las menos usadas recientemente por encima del máximo (LRU).
+    Retorna el número de entradas eliminadas.
+    """
+    expires_before = now() - timedelta(days=settings.INVOICE_CACHE_TTL_DAYS)
+    deleted, _ = InvoiceExtractionCache.objects.filter(last_used_at__lt=expires_before).delete()
+
+    # Las entradas de versiones anteriores del pipeline ya no se pueden reutilizar
+    stale, _ = InvoiceExtractionCache.objects.exclude(pipeline_version=PIPELINE_VERSION).delete()
+    deleted += stale
+
+    overflow_ids = list(
+        InvoiceExtractionCache.objects.order_by('-last_used_at')
+        .values_list('pk', flat=True)[settings.INVOICE_CACHE_MAX_ENTRIES:]
+    )
+    if overflow_ids:
+        lru, _ = InvoiceExtractionCache.objects.filter(pk__in=overflow_ids).delete()
+        deleted += lru
+
+    return deleted
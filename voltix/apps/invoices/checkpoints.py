@@ -0,0 +1,98 @@
+################################################################################################################################
+############################################ CHECKPOINTS DE LOS TRABAJOS DE FACTURAS ###########################################
+################################################################################################################################
+
+# Cada InvoiceProcessingJob guarda en `checkpoint` el resultado de las etapas terminadas (texto del OCR y JSON
+# extraído) y conserva su PDF mientras el trabajo se pueda reintentar o falte publicar la imagen. El PDF y los
+# checkpoints se eliminan al publicar la imagen, ante fallos definitivos o, si nadie reintenta, al caducar
+# (clean_invoice_checkpoints).
+
+import os
+import logging
+from django.conf import settings
+from django.core.files.move import file_move_safe
+from django.db.models import Q
+from django.utils.timezone import now, timedelta
+from apps.general.models import InvoiceProcessingJob
+
+
+logger = logging.getLogger(__name__)
+
+
+def upload_temp_dir():
+    """
+    Carpeta donde se guardan los PDF subidos mientras se procesan.
+    """
+    return settings.FILE_UPLOAD_TEMP_DIR or os.path.join(settings.BASE_DIR, "media", "temp")
+
+
+def store_upload(job, uploaded_file):
+    """
+    Guarda el PDF subido con un nombre único por trabajo y retorna su ruta. Si Django ya lo volcó a un
+    archivo temporal (subidas mayores que FILE_UPLOAD_MAX_MEMORY_SIZE) se mueve en lugar de copiarlo.
+    Nunca sobrescribe un archivo existente.
+    """
+    temp_folder = upload_temp_dir()
+    os.makedirs(temp_folder, exist_ok=True)
+    file_path = os.path.join(temp_folder, f"{job.id}.pdf")
+    if hasattr(uploaded_file, "temporary_file_path"):
+        file_move_safe(uploaded_file.temporary_file_path(), file_path, allow_overwrite=False)
+    else:
+        with open(file_path, "xb") as destination:
+            for chunk in uploaded_file.chunks():
+                destination.write(chunk)
+    return file_path
+
+
+def is_resumable(job):
+    """
+    Un trabajo fallido se puede reintentar si conserva su PDF o ya tiene el JSON extraído.
+    """
+    return job.status == "error" and (
+        "extract" in job.checkpoint or bool(job.file_path and os.path.exists(job.file_path))
+    )
+
+
+def discard_checkpoint(job):
+    """
+    Elimina el PDF subido y los checkpoints del trabajo. La ruta del PDF también se vacía, de modo que el
+    trabajo deja de ser candidato de expire_checkpoints.
+    """
+    if job.file_path and os.path.exists(job.file_path):
+        os.remove(job.file_path)
+        logger.info(f"Archivo PDF '{job.file_name}' eliminado.")
+    if job.file_path or job.checkpoint:
+        job.file_path = ""
+        job.checkpoint = {}
+        job.save(update_fields=["file_path", "checkpoint", "updated_at"])
+
+
+def expire_checkpoints():
+    """
+    Descarta los checkpoints de los trabajos fallidos que nadie ha reintentado en INVOICE_CHECKPOINT_TTL_HOURS
+    y los PDF huérfanos de la carpeta temporal. Retorna el número de trabajos y archivos limpiados.
+    """
+    expires_before = now() - timedelta(hours=settings.INVOICE_CHECKPOINT_TTL_HOURS)
+    expired = 0
+    # Trabajos que aún conservan el PDF o algún checkpoint
+    pending = ~Q(file_path="") | ~Q(checkpoint={})
+    for job in InvoiceProcessingJob.objects.filter(pending, status="error", updated_at__lt=expires_before):
+        discard_checkpoint(job)
+        expired += 1
+
+    # PDF de subidas interrumpidas (el trabajo ya no existe o terminó sin borrarlo)
+    temp_folder = upload_temp_dir()
+    if os.path.isdir(temp_folder):
+        active = set(
+            InvoiceProcessingJob.objects.filter(status__in=("pending", "processing", "error"))
+            .exclude(file_path="")
+            .values_list("file_path", flat=True)
+        )
+        for file_name in os.listdir(temp_folder):
+            path = os.path.join(temp_folder, file_name)
+            if path in active or not os.path.isfile(path):
+                continue
+            if os.path.getmtime(path) < expires_before.timestamp():
+                os.remove(path)
+                expired += 1
+    return expired
@@ -0,0 +1,107 @@
+################################################################################################################################
+############################################ SUBIDAS IDEMPOTENTES Y FACTURAS DUPLICADAS ########################################
+################################################################################################################################
+
+# Los clientes móviles repiten la subida cuando la red falla. Para no crear otra factura ni repetir el OCR:
+#   1. Si la subida trae la cabecera Idempotency-Key y el usuario ya la usó (en INVOICE_IDEMPOTENCY_TTL_HOURS),
+#      se responde con el trabajo original sin leer el archivo.
+#   2. Si el usuario ya tiene una factura del mismo PDF (SHA-256) o un trabajo en curso con él, se devuelve ese.
+#   3. Al guardar, si el usuario ya tiene una factura con el mismo `numero_referencia` y el mismo periodo de
+#      facturación (el mismo documento escaneado o exportado otra vez), el trabajo se enlaza a ella en lugar de
+#      crear otra. El número de referencia identifica el contrato, no la factura: se repite todos los meses, y
+#      algunos extractores devuelven un valor de relleno ("XXXXXXXXX") que no identifica nada.
+
+import re
+import logging
+from django.conf import settings
+from django.utils.timezone import now, timedelta
+from apps.general.models import Invoice, InvoiceProcessingJob
+
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_KEY_MAX_LENGTH = InvoiceProcessingJob._meta.get_field("idempotency_key").max_length
+
+# Trabajos que todavía no han terminado
+IN_FLIGHT_STATUSES = ("pending", "processing")
+
+# Números de referencia de relleno de los extractores sin implementar
+PLACEHOLDER_REFERENCE_RE = re.compile(r"X+", re.IGNORECASE)
+
+
+def idempotency_key(request):
+    """
+    Valor de la cabecera Idempotency-Key ('' si no se envía).
+    """
+    return request.headers.get(IDEMPOTENCY_HEADER, "").strip()
+
+
+def find_idempotent_job(user, key):
+    """
+    Trabajo del usuario creado con `key`, si está en curso o terminó con su factura. Las claves caducadas
+    o de trabajos fallidos se liberan para que la subida se procese de nuevo.
+    """
+    if not key:
+        return None
+    job = InvoiceProcessingJob.objects.select_related("invoice").filter(user=user, idempotency_key=key).first()
+    if job is None:
+        return None
+
+    expires_before = now() - timedelta(hours=settings.INVOICE_IDEMPOTENCY_TTL_HOURS)
+    replayable = job.status in IN_FLIGHT_STATUSES or (job.status == "success" and job.invoice_id)
+    if replayable and job.created_at >= expires_before:
+        return job
+
+    job.idempotency_key = ""
+    job.save(update_fields=["idempotency_key", "updated_at"])
+    return None
+
+
+def find_duplicate_upload(job):
+    """
+    Retorna (factura, trabajo en curso) del mismo usuario con el mismo PDF que `job`; como mucho uno no es None.
+    """
+    invoice = Invoice.objects.filter(user=job.user, content_hash=job.content_hash).order_by("id").first()
+    if invoice:
+        return invoice, None
+    in_flight = (
+        InvoiceProcessingJob.objects.filter(user=job.user, content_hash=job.content_hash, status__in=IN_FLIGHT_STATUSES)
+        .exclude(pk=job.pk)
+        .exclude(file_path="")
+        .order_by("created_at")
+        .first()
+    )
+    return None, in_flight
+
+
+def reference_number(parsed_data):
+    """
+    `numero_referencia` extraído, normalizado para compararlo ('' si no se extrajo o es un valor de relleno).
+    """
+    value = parsed_data.get("numero_referencia") if isinstance(parsed_data, dict) else None
+    reference = str(value or "").strip()
+    if PLACEHOLDER_REFERENCE_RE.fullmatch(reference):
+        return ""
+    return reference[:Invoice._meta.get_field("reference_number").max_length]
+
+
+def find_duplicate_invoice(user, parsed_data):
+    """
+    Factura del usuario con el mismo número de referencia y el mismo periodo de facturación que
+    `parsed_data`, o None.
+    """
+    reference = reference_number(parsed_data)
+    period = parsed_data.get("periodo_facturacion") or {}
+    if not (reference and period.get("inicio") and period.get("fin")):
+        return None
+    return (
+        Invoice.objects.filter(
+            user=user,
+            reference_number=reference,
+            billing_period_start=period["inicio"],
+            billing_period_end=period["fin"],
+        )
+        .order_by("id")
+        .first()
+    )
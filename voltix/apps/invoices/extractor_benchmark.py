@@ -0,0 +1,291 @@
+################################################################################################################################
+############################################ BENCHMARK DE LOS EXTRACTORES ######################################################
+################################################################################################################################
+
+# Mide los extractores por comercializadora sin OCR ni render: cada texto del corpus (`facturas/ocr/*.txt`, el texto
+# que el pipeline entrega al extractor) se convierte a JSON muchas veces para obtener parseos por segundo y p99, y se
+# compara con el JSON esperado del mismo nombre en `facturas/expected/`: los datos reales de cada factura, los mismos
+# que usa el benchmark del pipeline. Además cada expresión regular de los extractores se ejecuta
+# sobre textos de OCR degradados de dos tamaños, en un proceso aparte con tiempo máximo, para detectar patrones con
+# backtracking catastrófico (se agota el tiempo) o coste superlineal (crece mucho más que el texto).
+
+import os
+import re
+import sys
+import glob
+import json
+import math
+import logging
+import random
+import statistics
+import time
+import multiprocessing
+from functools import partial
+import fitz  # PyMuPDF
+from django.conf import settings
+from django.utils.timezone import now
+from .benchmark import field_accuracy
+from .cache import PIPELINE_VERSION
+from .extractors import EXTRACTORS, find_extractor
+
+# Un patrón es superlineal si al multiplicar el texto por GROWTH_FACTOR su tiempo crece más de GROWTH_FACTOR ** 1.5
+GROWTH_FACTOR = 4
+SUPERLINEAR_EXPONENT = 1.5
+
+# Por debajo de este tiempo (ms, con el texto grande) el crecimiento se considera ruido de medida
+MIN_FLAG_MS = 20.0
+
+
+def default_corpus_dir():
+    return os.path.join(settings.BASE_DIR.parent, "facturas", "ocr")
+
+
+def default_expected_dir():
+    return os.path.join(settings.BASE_DIR.parent, "facturas", "expected")
+
+
+def load_corpus(corpus_dir):
+    """
+    Retorna [(nombre, ruta, texto)] de los textos del corpus, ordenados por nombre.
+    """
+    corpus = []
+    for path in sorted(glob.glob(os.path.join(corpus_dir, "*.txt"))):
+        with open(path, encoding="utf-8") as text_file:
+            corpus.append((os.path.splitext(os.path.basename(path))[0], path, text_file.read()))
+    return corpus
+
+
+def capture_text(processor, pdf_path):
+    """
+    Texto que el pipeline entregaría al extractor para un PDF: la capa de texto de cada página o, si no
+    la tiene, su OCR.
+    """
+    with fitz.open(pdf_path) as pdf_document:
+        page_numbers = range(min(len(pdf_document), settings.INVOICE_MAX_PAGES))
+        text_layers = processor.extract_text_layers(pdf_document, page_numbers)
+        page_texts = []
+        for page_number in page_numbers:
+            if text_layers[page_number]:
+                page_texts.append(text_layers[page_number]["text"])
+                continue
+            pix = processor.render_page(pdf_document[page_number])
+            page_texts.append(processor.perform_ocr(processor.process_image(processor.pixmap_to_array(pix))))
+    return "".join(text + "\n" for text in page_texts)
+
+
+def latency_summary(timings_ms):
+    """
+    Parseos por segundo, p50 y p99 (ms) de una lista de tiempos.
+    """
+    quantiles = statistics.quantiles(timings_ms, n=100, method="inclusive") if len(timings_ms) > 1 else timings_ms * 99
+    return {
+        "parses": len(timings_ms),
+        "parses_per_second": len(timings_ms) / (sum(timings_ms) / 1000) if sum(timings_ms) else None,
+        "p50_ms": quantiles[49],
+        "p99_ms": quantiles[98],
+    }
+
+
+def run_throughput(corpus, repeat=200, expected_dir=None):
+    """
+    Convierte cada texto del corpus `repeat` veces con el extractor de su comercializadora y, si existe
+    `<expected_dir>/<nombre>.json`, lo compara con él. Retorna (resultados por documento, resumen por comercializadora).
+    """
+    expected_dir = expected_dir or default_expected_dir()
+    documents = {}
+    supplier_timings = {}
+    for name, path, text in corpus:
+        extractor = find_extractor(text)
+        if extractor is None:
+            documents[name] = {"supplier": None, "chars": len(text), "error": "No se reconoció ninguna comercializadora."}
+            continue
+
+        timings_ms = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            parsed_data = extractor.extract(text)
+            timings_ms.append((time.perf_counter() - started) * 1000)
+        supplier_timings.setdefault(extractor.name, []).extend(timings_ms)
+
+        accuracy = None
+        expected_path = os.path.join(expected_dir, f"{name}.json")
+        if os.path.exists(expected_path):
+            with open(expected_path, encoding="utf-8") as expected_file:
+                accuracy = field_accuracy(json.load(expected_file), parsed_data)
+
+        documents[name] = {
+            "path": path,
+            "supplier": extractor.name,
+            "chars": len(text),
+            **latency_summary(timings_ms),
+            "accuracy": accuracy,
+            "result": parsed_data,
+        }
+
+    suppliers = {supplier: latency_summary(timings_ms) for supplier, timings_ms in sorted(supplier_timings.items())}
+    return documents, suppliers
+
+
+################################################################################################################################
+############################################ ENTRADAS PATOLÓGICAS ##############################################################
+################################################################################################################################
+
+# Cada generador construye, a partir de textos reales de la comercializadora, un texto de OCR degradado de `size`
+# caracteres. Están pensados para que los patrones no encuentren su final y recorran todo el texto.
+
+def without_terminators(seed, size):
+    # Se conservan los anclajes ("Potencia", "Total", "Días"...) pero no los finales de los patrones
+    degraded = re.sub(r"[€\n]+", " ", seed) or "x"
+    return (degraded * (size // len(degraded) + 1))[:size]
+
+
+def shuffled_lines(seed, size):
+    # OCR con las líneas desordenadas y repetidas
+    lines = [line for line in seed.splitlines() if line.strip()] or ["x"]
+    rng = random.Random(len(seed))
+    chunks, length = [], 0
+    while length < size:
+        line = rng.choice(lines)
+        chunks.append(line)
+        length += len(line) + 1
+    return "\n".join(chunks)[:size]
+
+
+def digit_run(seed, size):
+    # Importes sin símbolo de moneda ni salto de línea detrás
+    return ("1.234,5 " * (size // 8 + 1))[:size]
+
+
+def uppercase_lines(seed, size):
+    # Bloques de mayúsculas y espacios, como los de un sello o una cabecera mal leída
+    return ("NOMBRE APELLIDO\n \n" * (size // 18 + 1))[:size]
+
+
+PATHOLOGICAL_INPUTS = {
+    "without_terminators": without_terminators,
+    "shuffled_lines": shuffled_lines,
+    "digit_run": digit_run,
+    "uppercase_lines": uppercase_lines,
+}
+
+
+def extractor_patterns(extractor):
+    """
+    Retorna [(nombre, patrón)] de las expresiones regulares compiladas en el módulo del extractor.
+    """
+    module = sys.modules[type(extractor).__module__]
+    return [(name, value) for name, value in vars(module).items() if isinstance(value, re.Pattern)]
+
+
+def scan_pattern(pattern, text):
+    for _ in pattern.finditer(text):
+        pass
+
+
+def _timed_calls(function, texts, connection):
+    # Los extractores registran avisos con cada campo que no encuentran en el texto degradado
+    logging.disable(logging.CRITICAL)
+    for text in texts:
+        started = time.perf_counter()
+        function(text)
+        connection.send((time.perf_counter() - started) * 1000)
+    connection.close()
+
+
+def time_calls(function, texts, timeout):
+    """
+    Ejecuta `function` con cada texto en un proceso aparte y retorna el tiempo (ms) de cada llamada.
+    Si una llamada supera `timeout` segundos se mata el proceso: su tiempo y el de las siguientes es None.
+    """
+    context = multiprocessing.get_context()
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_timed_calls, args=(function, texts, sender), daemon=True)
+    process.start()
+    sender.close()
+
+    timings_ms = []
+    try:
+        while len(timings_ms) < len(texts) and receiver.poll(timeout):
+            timings_ms.append(receiver.recv())
+    except EOFError:
+        pass
+    finally:
+        if process.is_alive():
+            process.kill()
+        process.join()
+        receiver.close()
+    return timings_ms + [None] * (len(texts) - len(timings_ms))
+
+
+def classify(timings_ms):
+    """
+    Retorna (exponente de crecimiento, marca) a partir de los tiempos con el texto pequeño y el grande.
+    La marca es "timeout" (backtracking catastrófico), "superlinear" o None.
+    """
+    small, large = timings_ms
+    if small is None or large is None:
+        return None, "timeout"
+    exponent = math.log(max(large, 1e-3) / max(small, 1e-3), GROWTH_FACTOR)
+    if exponent > SUPERLINEAR_EXPONENT and large > MIN_FLAG_MS:
+        return exponent, "superlinear"
+    return exponent, None
+
+
+def run_pathological(corpus, size=20000, timeout=2.0, include_patterns=True):
+    """
+    Ejecuta cada extractor completo y, con `include_patterns`, cada una de sus expresiones regulares sobre
+    las entradas patológicas de tamaño `size` y `size * GROWTH_FACTOR`. Retorna una fila por combinación.
+    """
+    rows = []
+    for extractor in EXTRACTORS:
+        seed = "\n".join(
+            text for _, _, text in corpus if find_extractor(text) is extractor
+        ) or "\n".join((extractor.label, *extractor.keywords))
+
+        checks = [("<extract>", extractor.extract)]
+        if include_patterns:
+            checks += [(name, partial(scan_pattern, pattern)) for name, pattern in extractor_patterns(extractor)]
+
+        for input_name, generator in PATHOLOGICAL_INPUTS.items():
+            texts = [generator(seed, size), generator(seed, size * GROWTH_FACTOR)]
+            for check_name, function in checks:
+                timings_ms = time_calls(function, texts, timeout)
+                exponent, flag = classify(timings_ms)
+                rows.append({
+                    "supplier": extractor.name,
+                    "pattern": check_name,
+                    "input": input_name,
+                    "small_ms": timings_ms[0],
+                    "large_ms": timings_ms[1],
+                    "exponent": exponent,
+                    "flag": flag,
+                })
+    return rows
+
+
+def run_extractor_benchmark(corpus_dir, repeat=200, size=20000, timeout=2.0, include_patterns=True, expected_dir=None):
+    """
+    Ejecuta el benchmark de rendimiento y el de entradas patológicas y retorna el informe.
+    """
+    corpus = load_corpus(corpus_dir)
+    documents, suppliers = run_throughput(corpus, repeat=repeat, expected_dir=expected_dir)
+    pathological = run_pathological(corpus, size=size, timeout=timeout, include_patterns=include_patterns)
+
+    scored = [document["accuracy"] for document in documents.values() if document.get("accuracy")]
+    matched, total = sum(score["matched"] for score in scored), sum(score["total"] for score in scored)
+    return {
+        "created_at": now().isoformat(),
+        "pipeline_version": PIPELINE_VERSION,
+        "repeat": repeat,
+        "pathological_size": size,
+        "timeout": timeout,
+        "documents": documents,
+        "suppliers": suppliers,
+        "pathological": pathological,
+        "summary": {
+            "fields_matched": matched,
+            "fields_total": total,
+            "accuracy": matched / total if total else None,
+            "flagged": [row for row in pathological if row["flag"]],
+        },
+    }
@@ -0,0 +1,7 @@
+from .registry import (
+    EXTRACTORS, SupplierExtractor, register, get_extractor, find_extractor, detect_supplier, extract_invoice_data
+)
+from .normalizers import InvoiceText
+
+# El orden de importación fija el orden de detección (las facturas de Endesa mencionan a EDISTRIBUCION)
+from . import endesa, iberdrola, lidera, naturgy, edistribucion  # noqa: F401
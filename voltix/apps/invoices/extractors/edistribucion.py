@@ -0,0 +1,12 @@
+from .normalizers import placeholder_invoice_json
+from .registry import SupplierExtractor, register
+
+
+@register
+class EDistribucionExtractor(SupplierExtractor):
+    name = "edistribucion"
+    label = "E-Distribución"
+    keywords = ("e-distribución",)
+
+    def parse(self, text):
+        return placeholder_invoice_json("E-DISTRIBUCIÓN TESTE")
@@ -0,0 +1,107 @@
+import re
+import logging
+from .normalizers import invoice_json, group, parse_es_number, spanish_date, to_iso_date
+from .registry import SupplierExtractor, register
+
+logger = logging.getLogger(__name__)
+
+AMOUNT = r"\d{1,3}(?:\.\d{3})*,\d{2}"
+
+NOMBRE_CLIENTE_RE = re.compile(r"Titular del contrato:\s*(.*?)\s*\n\nCUPS:", re.IGNORECASE)
+NUMERO_REFERENCIA_RE = re.compile(r"Referencia:\s*([\w\/-]+)")
+FECHA_EMISION_RE = re.compile(r"Fecha emisión factur[a|:]*\s*(\d{2}/\d{2}/\d{4})", re.IGNORECASE)
+PERIODO_INICIO_RE = re.compile(r"Periodo de facturación: del\s*(\d{2}/\d{2}/\d{4})")
+PERIODO_FIN_RE = re.compile(r"a\s*(\d{2}/\d{2}/\d{4})")
+DIAS_RE = re.compile(r"\((\d+)\s*días\)")
+FECHA_CARGO_RE = re.compile(r"Fecha de cargo:\s*(\d{2})\s*de\s*(\w+)\s*de\s*(\d{4})")
+MANDATO_RE = re.compile(r"Cod\.?Mandato:\s*(\w+)")
+COSTO_POTENCIA_RE = re.compile(rf"Potencia.*? ({AMOUNT}) €")
+COSTO_ENERGIA_RE = re.compile(rf"Energía\s+({AMOUNT})")
+DESCUENTOS_RE = re.compile(rf"Descuentos.*? (-?{AMOUNT}) €")
+IMPUESTOS_RE = re.compile(rf"Impuestos.*? ({AMOUNT}) €")
+TOTAL_A_PAGAR_RE = re.compile(rf"Total.*? ({AMOUNT}) €")
+AMOUNT_RE = re.compile(rf"({AMOUNT})")
+LLANO_RE = re.compile(r"llano", re.IGNORECASE)
+POTENCIA_RE = re.compile(r"potencia", re.IGNORECASE)
+CONSUMO_TOTAL_RE = re.compile(r"Consumo total\s*(\d[\d.,]*)\s*kWh", re.IGNORECASE)
+PRECIO_EFECTIVO_RE = re.compile(r"ha salido a\s*([\d,\.]+) €/kWh")
+FORMA_PAGO_RE = re.compile(r"Forma de pago:\s*([^\d\n]*)", re.IGNORECASE)
+
+# Facturas con tarifa de discriminación horaria ("Tempo"): titular en su propia línea y consumos con etiqueta
+TITULAR_LINEA_RE = re.compile(r"Titular del contrato:\s*([^\n]+)")
+CONSUMO_PUNTA_RE = re.compile(r"Consumo punta\s*(\d[\d.,]*)\s*kWh", re.IGNORECASE)
+CONSUMO_VALLE_RE = re.compile(r"Consumo valle\s*(\d[\d.,]*)\s*kWh", re.IGNORECASE)
+
+
+@register
+class EndesaExtractor(SupplierExtractor):
+    name = "endesa"
+    label = "Endesa"
+    keywords = ("endesa",)
+
+    def parse(self, text):
+        normalized_text = text.collapsed
+
+        def amount(pattern):
+            match = pattern.search(normalized_text)
+            return parse_es_number(match.group(1)) if match else None
+
+        fecha_cargo_match = FECHA_CARGO_RE.search(normalized_text)
+        dias = group(DIAS_RE.search(normalized_text))
+
+        # Consumos con etiqueta si la factura los trae; si no, por su posición en el texto
+        consumo_punta = amount(CONSUMO_PUNTA_RE)
+        if consumo_punta is None:
+            consumo_punta = self.consumo_punta(normalized_text)
+        consumo_valle = amount(CONSUMO_VALLE_RE)
+        if consumo_valle is None:
+            consumo_valle = self.consumo_valle(normalized_text)
+
+        return invoice_json(
+            nombre_cliente=group(NOMBRE_CLIENTE_RE.search(text.raw) or TITULAR_LINEA_RE.search(text.raw)),
+            numero_referencia=group(NUMERO_REFERENCIA_RE.search(normalized_text)),
+            fecha_emision=to_iso_date(group(FECHA_EMISION_RE.search(normalized_text))),
+            periodo_inicio=to_iso_date(group(PERIODO_INICIO_RE.search(normalized_text))),
+            periodo_fin=to_iso_date(group(PERIODO_FIN_RE.search(normalized_text))),
+            dias=int(dias) if dias else None,
+            forma_pago=group(FORMA_PAGO_RE.search(normalized_text)),
+            fecha_cargo=spanish_date(*fecha_cargo_match.groups()) if fecha_cargo_match else None,
+            mandato=group(MANDATO_RE.search(normalized_text)),
+            costo_potencia=amount(COSTO_POTENCIA_RE),
+            costo_energia=amount(COSTO_ENERGIA_RE),
+            descuentos=amount(DESCUENTOS_RE),
+            impuestos=amount(IMPUESTOS_RE),
+            total_a_pagar=amount(TOTAL_A_PAGAR_RE),
+            consumo_punta=consumo_punta,
+            consumo_valle=consumo_valle,
+            consumo_total=amount(CONSUMO_TOTAL_RE),
+            precio_efectivo_energia=self.precio_efectivo_energia(normalized_text),
+        )
+
+    def consumo_punta(self, normalized_text):
+        # Último importe antes de "llano"
+        try:
+            llano_match = LLANO_RE.search(normalized_text)
+            if not llano_match:
+                return None
+            numeros = AMOUNT_RE.findall(normalized_text, 0, llano_match.start())
+            return parse_es_number(numeros[-1]) if numeros else None
+        except Exception as e:
+            logger.error(f"Error al extraer consumo_punta: {str(e)}")
+            return None
+
+    def consumo_valle(self, normalized_text):
+        # Antepenúltimo importe antes de la sexta aparición de "potencia"
+        try:
+            potencia_positions = [match.start() for match in POTENCIA_RE.finditer(normalized_text)]
+            if len(potencia_positions) < 6:
+                return None
+            numeros = AMOUNT_RE.findall(normalized_text, 0, potencia_positions[5])
+            return parse_es_number(numeros[-3]) if len(numeros) >= 3 else None
+        except Exception as e:
+            logger.error(f"Error al extraer consumo_valle: {str(e)}")
+            return None
+
+    def precio_efectivo_energia(self, normalized_text):
+        match = PRECIO_EFECTIVO_RE.search(normalized_text)
+        return float(match.group(1).replace(",", ".")) if match else None
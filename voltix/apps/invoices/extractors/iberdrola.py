@@ -0,0 +1,114 @@
+import re
+import logging
+from .normalizers import invoice_json, group, parse_decimal_comma, spanish_date, to_iso_date
+from .registry import SupplierExtractor, register
+
+logger = logging.getLogger(__name__)
+
+# El bloque del nombre está acotado: sin límite, un OCR con muchas líneas en mayúsculas provoca backtracking catastrófico
+NOMBRE_CLIENTE_RE = re.compile(r"(?:\n)([A-Z\s]{1,200})\n.*Potencia punta")
+NUMERO_REFERENCIA_RE = re.compile(r"N\* DE CONTRATO:\s*([\d]+)")
+FECHA_EMISION_RE = re.compile(r"FECHA DE EMISIÓN:.*?\n\n.*?\n\n(\d{1,2})\s+de\s+(\w+)\s+de\s+(\d{4})", re.DOTALL)
+PERIODO_RE = re.compile(r"PERIODO DE FACTURACIÓN.*?\n\n(\d{1,2}/\d{1,2}/\d{4})\s+(\d{1,2}/\d{1,2}/\d{4})", re.DOTALL)
+DIAS_RE = re.compile(r"FECHA DE EMISIÓN:.*?\n\n.*?\n\n(\d+)", re.DOTALL)
+FORMA_PAGO_RE = re.compile(r"Forma de pago\s*([^\n]+)")
+FECHA_CARGO_RE = re.compile(r"FECHA PREVISTA DE COBRO:\s*(\d{2}/\d{2}/\d{4})")
+MANDATO_RE = re.compile(r"Codigo de mandato\s*([\d]+)")
+COSTO_PUNTA_RE = re.compile(r"([\d,\.]+)\s*€\s*\n\n\s*Valle")
+COSTO_VALLE_RE = re.compile(r"([\d,\.]+)\s*€\s*\n\n\s*Total importe potencia")
+COSTO_ENERGIA_RE = re.compile(r"([\d,\.]+)\s*€\s*\n\n\s*Energia consumida")
+DESCUENTOS_RE = re.compile(r"Descuentos.*?(-?\d{1,3},\d{2}) €")
+IMPUESTOS_ENERGIA_RE = re.compile(r"([\d,\.]+)\s*€\s*\n\n\s*TOTAL ENERGÍA")
+IMPUESTOS_FACTURA_RE = re.compile(r"([\d,\.]+)\s*€\s*\n\n\s*TOTAL IMPORTE FACTURA")
+TOTAL_A_PAGAR_RE = re.compile(r"TOTAL IMPORTE FACTURA\s*\n\n\s*([\d,\.]+)\s*€")
+CONSUMO_PUNTA_RE = re.compile(r"desagregados han sido punta:\s*([\d,\.]+)\s*kWh", re.IGNORECASE)
+CONSUMO_VALLE_RE = re.compile(r"([\d,\.]+)\s*kWh,\s*\n=4\s*\nLas potencias máximas demandadas", re.IGNORECASE)
+CONSUMO_TOTAL_RE = re.compile(r"(\d{1,3},\d{2})\s*kWh")
+PRECIO_EFECTIVO_RE = re.compile(r"([\d,\.]+)\s*€/kWh")
+
+# Maqueta anterior de la factura ("FACTURA DE ELECTRICIDAD"): los datos van en una línea junto a su etiqueta
+TITULAR_RE = re.compile(r"\n\nTitular\s+([^\n]+)")
+REFERENCIA_CONTRATO_RE = re.compile(r"Referencia contrato suministro:?\s*(\d+)")
+FECHA_EMISION_LINEA_RE = re.compile(r"Fecha de emisión de factura\s+(\d{1,2})\s+de\s+(\w+)\s+de\s+(\d{4})")
+PERIODO_LINEA_RE = re.compile(r"Periodo de facturación\s+(\d{1,2}/\d{1,2}/\d{4})\s*-\s*(\d{1,2}/\d{1,2}/\d{4})")
+FECHA_CARGO_LINEA_RE = re.compile(r"Fecha prevista de cargo\s+(\d{2}/\d{2}/\d{4})")
+MANDATO_LINEA_RE = re.compile(r"Código de mandato:\s*(\d+)")
+TOTAL_A_PAGAR_LINEA_RE = re.compile(r"TOTAL IMPORTE FACTURA:\s*\n\n\s*([\d,\.]+)\s*€")
+
+
+@register
+class IberdrolaExtractor(SupplierExtractor):
+    name = "iberdrola"
+    label = "Iberdrola"
+    keywords = ("iberdrola",)
+
+    def parse(self, text):
+        ocr_text = text.raw
+
+        def amount(pattern, default=0.0):
+            # Valor por defecto si no se encuentra el patrón o el formato no es válido
+            match = pattern.search(ocr_text)
+            return parse_decimal_comma(match.group(1), default) if match else default
+
+        def search(*patterns):
+            # Primer patrón que aparece en el texto (maqueta actual y después la anterior)
+            return next((match for match in (pattern.search(ocr_text) for pattern in patterns) if match), None)
+
+        fecha_emision_match = search(FECHA_EMISION_RE, FECHA_EMISION_LINEA_RE)
+
+        periodo_inicio, periodo_fin = None, None
+        periodo_match = search(PERIODO_RE, PERIODO_LINEA_RE)
+        if periodo_match:
+            periodo_inicio, periodo_fin = to_iso_date(periodo_match.group(1)), to_iso_date(periodo_match.group(2))
+            if periodo_inicio is None or periodo_fin is None:
+                periodo_inicio, periodo_fin = None, None
+
+        dias = group(DIAS_RE.search(ocr_text))
+
+        # Los importes de potencia punta y valle se leen sin separador decimal: mover el punto 2 posiciones
+        costo_punta = amount(COSTO_PUNTA_RE) / 100
+        costo_valle = amount(COSTO_VALLE_RE) / 100
+
+        descuentos_match = DESCUENTOS_RE.search(ocr_text)
+        descuentos = float(descuentos_match.group(1).replace(",", ".")) if descuentos_match else None
+
+        consumo_total_match = CONSUMO_TOTAL_RE.search(ocr_text)
+
+        return invoice_json(
+            nombre_cliente=group(search(NOMBRE_CLIENTE_RE, TITULAR_RE)),
+            numero_referencia=group(search(NUMERO_REFERENCIA_RE, REFERENCIA_CONTRATO_RE)),
+            fecha_emision=spanish_date(*fecha_emision_match.groups()) if fecha_emision_match else None,
+            periodo_inicio=periodo_inicio,
+            periodo_fin=periodo_fin,
+            dias=int(dias) if dias else None,
+            forma_pago=group(FORMA_PAGO_RE.search(ocr_text)),
+            fecha_cargo=to_iso_date(group(search(FECHA_CARGO_RE, FECHA_CARGO_LINEA_RE))),
+            mandato=group(search(MANDATO_RE, MANDATO_LINEA_RE)),
+            costo_potencia=round(costo_punta + costo_valle, 2),
+            costo_energia=amount(COSTO_ENERGIA_RE),
+            descuentos=descuentos if descuentos else 0,
+            impuestos=amount(IMPUESTOS_ENERGIA_RE) + amount(IMPUESTOS_FACTURA_RE),
+            total_a_pagar=amount(TOTAL_A_PAGAR_RE) or amount(TOTAL_A_PAGAR_LINEA_RE),
+            consumo_punta=self.consumo_punta(ocr_text),
+            consumo_valle=self.consumo_valle(ocr_text),
+            consumo_total=float(consumo_total_match.group(1).replace(",", ".")) if consumo_total_match else 0,
+            precio_efectivo_energia=amount(PRECIO_EFECTIVO_RE, default=0),
+        )
+
+    def consumo_punta(self, ocr_text):
+        # Valor después de "desagregados han sido punta:" (la coma es separador de miles)
+        try:
+            match = CONSUMO_PUNTA_RE.search(ocr_text)
+            return round(float(match.group(1).replace(",", "")), 2) if match else 0.00
+        except Exception as e:
+            logger.error(f"Error al extraer 'consumo_punta': {str(e)}")
+            return 0.00
+
+    def consumo_valle(self, ocr_text):
+        # Valor en el contexto de "Las potencias máximas demandadas"
+        try:
+            match = CONSUMO_VALLE_RE.search(ocr_text)
+            return float(match.group(1).replace(",", ".")) if match else 0.00
+        except Exception as e:
+            logger.error(f"Error al extraer 'consumo_valle': {str(e)}")
+            return 0.00
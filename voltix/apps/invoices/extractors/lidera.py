@@ -0,0 +1,101 @@
+import re
+import logging
+from .normalizers import invoice_json, group, spanish_date, to_iso_date
+from .registry import SupplierExtractor, register
+
+logger = logging.getLogger(__name__)
+
+NOMBRE_CLIENTE_RE = re.compile(r"Titular del contrato:\s*(.*?)\n")
+NUMERO_REFERENCIA_RE = re.compile(r"Referencia del contrato de sumi\n\ntro \(LIDERA COMERCIALIZADORA ENERGIA\):\s*(.+)")
+FECHA_EMISION_RE = re.compile(r"Fecha emi\n\nn factura:\s*(.+)")
+FECHA_TEXTO_RE = re.compile(r"(\d{1,2})\s+de\s+(\w+)\s+de\s+(\d{4})")
+PERIODO_RE = re.compile(r"Periodo de consumo:\n\nDe\s*(\d{1,2}/\d{1,2}/\d{4})\s*al\s*(\d{1,2}/\d{1,2}/\d{4})")
+DIAS_RE = re.compile(r"(\d+)\s+Días")
+FORMA_PAGO_RE = re.compile(r"Forma de pago:\s*(.+)")
+FECHA_CARGO_RE = re.compile(r"Fecha de cargo:\n\n(\d{2}/\d{2}/\d{4})")
+DETALLE_FACTURA_RE = re.compile(r"DETALLE DE LA FACTURA", re.IGNORECASE)
+# Acepta "€/KW día" y la variante del OCR "E/KW día"
+POTENCIA_DIAS_RE = re.compile(r"Días.*?[€E]/KW día\n\n([\d,\.]+)", re.IGNORECASE)
+IMPUESTOS_RE = re.compile(r"Impuesto Electricidad\n\n([\d.,]+)", re.IGNORECASE)
+TOTAL_A_PAGAR_RE = re.compile(r"TOTAL IMPORTE FACTURA\n\n([\d.,]+)", re.IGNORECASE)
+
+
+@register
+class LideraExtractor(SupplierExtractor):
+    name = "lidera"
+    label = "Lidera Energia"
+    keywords = ("lidera comercializadora energia",)
+
+    def parse(self, text):
+        ocr_text = text.raw
+
+        fecha_emision = None
+        fecha_emision_raw = group(FECHA_EMISION_RE.search(ocr_text))
+        if fecha_emision_raw:
+            fecha_match = FECHA_TEXTO_RE.match(fecha_emision_raw)
+            fecha_emision = spanish_date(*fecha_match.groups()) if fecha_match else None
+
+        inicio, fin = None, None
+        periodo_match = PERIODO_RE.search(ocr_text)
+        if periodo_match:
+            inicio, fin = self.convertir_fecha(periodo_match.group(1)), self.convertir_fecha(periodo_match.group(2))
+
+        dias = group(DIAS_RE.search(ocr_text))
+
+        impuestos_match = IMPUESTOS_RE.search(ocr_text)
+        impuestos = float(impuestos_match.group(1).replace(",", ".")) if impuestos_match else 0.0
+
+        total_match = TOTAL_A_PAGAR_RE.search(ocr_text)
+        if total_match:
+            total_raw = total_match.group(1)
+            total_a_pagar = float(total_raw.replace(".", "").replace(",", ".") if "," in total_raw else total_raw.replace(",", ""))
+        else:
+            total_a_pagar = 0.0
+
+        return invoice_json(
+            nombre_cliente=group(NOMBRE_CLIENTE_RE.search(ocr_text)),
+            numero_referencia=group(NUMERO_REFERENCIA_RE.search(ocr_text)),
+            fecha_emision=fecha_emision,
+            periodo_inicio=inicio,
+            periodo_fin=fin,
+            dias=int(dias) if dias else None,
+            forma_pago=group(FORMA_PAGO_RE.search(ocr_text)),
+            fecha_cargo=to_iso_date(group(FECHA_CARGO_RE.search(ocr_text))),
+            mandato="SIN CODIGO DE MANDATO",
+            costo_potencia=self.costo_potencia(ocr_text),
+            descuentos=0,
+            impuestos=impuestos,
+            total_a_pagar=total_a_pagar,
+            consumo_punta=0,
+            consumo_valle=0,
+            consumo_total=0,
+            precio_efectivo_energia=0,
+        )
+
+    def convertir_fecha(self, fecha_raw):
+        fecha = to_iso_date(fecha_raw.strip())
+        if fecha is None:
+            logger.error(f"Error al convertir fecha: {fecha_raw}")
+        return fecha
+
+    def costo_potencia(self, ocr_text):
+        """
+        Suma los importes que siguen a cada "Días ... €/KW día" después de "DETALLE DE LA FACTURA".
+        """
+        try:
+            section_match = DETALLE_FACTURA_RE.search(ocr_text)
+            if not section_match:
+                logger.warning("No se encontró la sección 'DETALLE DE LA FACTURA' en el OCR.")
+                return 0.0
+
+            valores = []
+            for match in POTENCIA_DIAS_RE.finditer(ocr_text, section_match.end()):
+                try:
+                    valores.append(float(match.group(1).replace(",", ".")))
+                except ValueError:
+                    logger.warning(f"Valor inválido encontrado: {match.group(1)}")
+            return round(sum(valores), 2)
+
+        except Exception as e:
+            logger.error(f"Error al calcular 'costo_potencia': {str(e)}")
+            return 0.0
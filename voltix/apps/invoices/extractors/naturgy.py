@@ -0,0 +1,12 @@
+from .normalizers import placeholder_invoice_json
+from .registry import SupplierExtractor, register
+
+
+@register
+class NaturgyExtractor(SupplierExtractor):
+    name = "naturgy"
+    label = "Naturgy"
+    keywords = ("naturgy iberia",)
+
+    def parse(self, text):
+        return placeholder_invoice_json("NATURGY TESTE")
@@ -0,0 +1,139 @@
+################################################################################################################################
+############################################ NORMALIZADORES DE FECHAS E IMPORTES ###############################################
+################################################################################################################################
+
+import re
+from datetime import datetime
+from functools import cached_property
+
+# Mapeo de meses en español a números
+MESES = {
+    "enero": "01", "febrero": "02", "marzo": "03", "abril": "04",
+    "mayo": "05", "junio": "06", "julio": "07", "agosto": "08",
+    "septiembre": "09", "octubre": "10", "noviembre": "11", "diciembre": "12"
+}
+
+WHITESPACE_RE = re.compile(r"\s+")
+
+
+class InvoiceText:
+    """
+    Texto de una factura con sus variantes normalizadas, calculadas una sola vez y compartidas
+    entre la detección de la comercializadora y los extractores.
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    @cached_property
+    def lower(self):
+        return self.raw.lower()
+
+    @cached_property
+    def collapsed(self):
+        # Reemplazar múltiples espacios o saltos de línea con un solo espacio
+        return WHITESPACE_RE.sub(" ", self.raw)
+
+
+def to_iso_date(date_str, date_format="%d/%m/%Y"):
+    """
+    Convierte una fecha (por defecto DD/MM/YYYY) al formato YYYY-MM-DD. Retorna None si no es válida.
+    """
+    try:
+        return datetime.strptime(date_str, date_format).strftime("%Y-%m-%d")
+    except (ValueError, TypeError):
+        return None
+
+
+def spanish_date(dia, mes_texto, anio):
+    """
+    Convierte una fecha con el nombre del mes ("4 de enero de 2021") al formato YYYY-MM-DD.
+    """
+    mes = MESES.get(mes_texto.lower())
+    if not mes:
+        return None
+    return f"{anio}-{mes}-{dia.zfill(2)}"
+
+
+def parse_es_number(raw):
+    """
+    Convierte un número en formato español ("1.112,537", "436,36", "213") a float. Si el OCR confunde
+    el separador de miles con comas ("1,112,537"), la última coma se toma como separador decimal.
+    """
+    if "," in raw:
+        integer, _, decimal = raw.rpartition(",")
+        return float(f"{integer.replace('.', '').replace(',', '')}.{decimal}")
+    return float(raw.replace(".", ""))
+
+
+def parse_decimal_comma(raw, default=None):
+    """
+    Convierte un número con coma decimal ("45,6") a float. Retorna `default` si no es válido.
+    """
+    try:
+        return float(raw.replace(",", "."))
+    except ValueError:
+        return default
+
+
+def invoice_json(
+    nombre_cliente=None, numero_referencia=None, fecha_emision=None,
+    periodo_inicio=None, periodo_fin=None, dias=None, forma_pago=None, fecha_cargo=None, mandato=None,
+    costo_potencia=None, costo_energia=None, descuentos=None, impuestos=None, total_a_pagar=None,
+    consumo_punta=None, consumo_valle=None, consumo_total=None, precio_efectivo_energia=None,
+):
+    """
+    Construye el JSON común de una factura, igual para todas las comercializadoras.
+    """
+    return {
+        "nombre_cliente": nombre_cliente,
+        "numero_referencia": numero_referencia,
+        "fecha_emision": fecha_emision,
+        "periodo_facturacion": {
+            "inicio": periodo_inicio,
+            "fin": periodo_fin,
+            "dias": dias,
+        },
+        "forma_pago": forma_pago,
+        "fecha_cargo": fecha_cargo,
+        "mandato": mandato,
+        "desglose_cargos": {
+            "costo_potencia": costo_potencia,
+            "costo_energia": costo_energia,
+            "descuentos": descuentos,
+            "impuestos": impuestos,
+            "total_a_pagar": total_a_pagar,
+        },
+        "detalles_consumo": {
+            "consumo_punta": consumo_punta,
+            "consumo_valle": consumo_valle,
+            "consumo_total": consumo_total,
+            "precio_efectivo_energia": precio_efectivo_energia,
+        },
+    }
+
+
+def placeholder_invoice_json(nombre_cliente):
+    """
+    Datos de prueba mientras no exista un extractor real para la comercializadora.
+    """
+    return invoice_json(
+        nombre_cliente=nombre_cliente,
+        numero_referencia="XXXXXXXXX",
+        fecha_emision="1990-01-01",
+        periodo_inicio="1990-01-01",
+        periodo_fin="1990-01-01",
+        dias="00",
+        forma_pago="teste forma de pago",
+        fecha_cargo="1990-01-01",
+        mandato="XXXXXXXXX",
+        costo_potencia=0, costo_energia=0, descuentos=0, impuestos=0, total_a_pagar=0,
+        consumo_punta=0, consumo_valle=0, consumo_total=0, precio_efectivo_energia=0,
+    )
+
+
+def group(match, index=1):
+    """
+    Retorna el grupo del match sin espacios alrededor, o None si no hubo coincidencia.
+    """
+    return match.group(index).strip() if match else None
@@ -0,0 +1,82 @@
+################################################################################################################################
+############################################ REGISTRO DE EXTRACTORES POR COMERCIALIZADORA ######################################
+################################################################################################################################
+
+import logging
+from .normalizers import InvoiceText
+
+logger = logging.getLogger(__name__)
+
+# Extractores registrados, en el orden en que se comprueban sus palabras clave
+EXTRACTORS = []
+
+
+class SupplierExtractor:
+    """
+    Extractor de los datos de las facturas de una comercializadora. Las subclases definen `name`,
+    `label`, `keywords` (en minúsculas) y `parse`, y compilan sus expresiones regulares a nivel de módulo.
+    """
+    name = None
+    label = None
+    keywords = ()
+
+    def matches(self, text):
+        return any(keyword in text.lower for keyword in self.keywords)
+
+    def parse(self, text):
+        raise NotImplementedError
+
+    def extract(self, text):
+        """
+        Extrae el JSON de la factura a partir de un InvoiceText (o de un str).
+        """
+        if isinstance(text, str):
+            text = InvoiceText(text)
+        try:
+            return self.parse(text)
+        except Exception as e:
+            logger.error(f"Error al convertir OCR a JSON para {self.label}: {str(e)}")
+            return {"error": f"Error al convertir OCR a JSON para {self.label}."}
+
+
+def register(extractor_class):
+    """
+    Decorador que registra una instancia del extractor.
+    """
+    EXTRACTORS.append(extractor_class())
+    return extractor_class
+
+
+def get_extractor(name):
+    return next((extractor for extractor in EXTRACTORS if extractor.name == name), None)
+
+
+def find_extractor(text):
+    """
+    Retorna el primer extractor cuyas palabras clave aparecen en el texto, o None.
+    """
+    if isinstance(text, str):
+        text = InvoiceText(text)
+    return next((extractor for extractor in EXTRACTORS if extractor.matches(text)), None)
+
+
+def detect_supplier(text):
+    extractor = find_extractor(text)
+    return extractor.name if extractor else None
+
+
+def extract_invoice_data(ocr_text, supplier=None):
+    """
+    Convierte el texto de una factura (OCR o capa de texto) a JSON con el extractor de `supplier` o,
+    si no se indica, el de la comercializadora detectada en el texto.
+    """
+    try:
+        text = InvoiceText(ocr_text)
+        extractor = get_extractor(supplier) if supplier else find_extractor(text)
+        if not extractor:
+            return {"error": "No se reconoció ninguna comercializadora en el OCR."}
+        return extractor.extract(text)
+
+    except Exception as e:
+        logger.error(f"Error al convertir OCR a JSON: {str(e)}")
+        return {"error": "Error al convertir OCR a JSON."}
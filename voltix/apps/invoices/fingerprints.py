@@ -0,0 +1,109 @@
+################################################################################################################################
+############################################ HUELLA VISUAL DE LA COMERCIALIZADORA ##############################################
+################################################################################################################################
+
+# Identifica la comercializadora antes de cualquier OCR comparando un hash perceptual (pHash) de la zona del
+# logotipo de la primera página con un índice local de diseños conocidos (fingerprints.json). El índice se
+# amplía con `python manage.py add_supplier_fingerprint <pdf> <comercializadora>`.
+
+import os
+import json
+import logging
+import threading
+import cv2
+import numpy as np
+from django.conf import settings
+from .layouts import crop_region
+
+logger = logging.getLogger(__name__)
+
+# Zona de la primera página con el logotipo (fracciones de la página, como las plantillas de layouts.py)
+FINGERPRINT_REGION = {"name": "logotipo", "page": 0, "bbox": (0.0, 0.0, 0.5, 0.15)}
+
+INDEX_PATH = os.path.join(os.path.dirname(__file__), "fingerprints.json")
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def perceptual_hash(image):
+    """
+    Calcula el pHash (64 bits) de una imagen de NumPy: DCT de la imagen reducida a 32x32 y un bit por
+    cada coeficiente de baja frecuencia según quede por encima o por debajo de la mediana.
+    No depende de la resolución del render ni de pequeñas diferencias de texto o ruido.
+    """
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    reduced = cv2.resize(image, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    coefficients = cv2.dct(reduced)[:8, :8].flatten()
+    # El coeficiente de continua (brillo medio) no entra en la mediana
+    bits = coefficients > np.median(coefficients[1:])
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+def hamming_distance(hash_a, hash_b):
+    return bin(hash_a ^ hash_b).count("1")
+
+
+def page_fingerprint(image):
+    """
+    Hash perceptual de la zona del logotipo de una página renderizada.
+    """
+    return perceptual_hash(crop_region(image, FINGERPRINT_REGION["bbox"]))
+
+
+def load_index():
+    """
+    Devuelve el índice de huellas [(comercializadora, hash)], leído una sola vez por proceso.
+    """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                try:
+                    with open(INDEX_PATH, encoding="utf-8") as index_file:
+                        entries = json.load(index_file)
+                except FileNotFoundError:
+                    entries = []
+                _index = [(entry["supplier"], int(entry["hash"], 16)) for entry in entries]
+    return _index
+
+
+def match_supplier(image):
+    """
+    Retorna (comercializadora, distancia) de la huella más cercana del índice a la página, o
+    (None, None) si ninguna está a menos de INVOICE_FINGERPRINT_MAX_DISTANCE bits.
+    """
+    fingerprint = page_fingerprint(image)
+    best_supplier, best_distance = None, None
+    for supplier, known_hash in load_index():
+        distance = hamming_distance(fingerprint, known_hash)
+        if best_distance is None or distance < best_distance:
+            best_supplier, best_distance = supplier, distance
+
+    if best_distance is None or best_distance > settings.INVOICE_FINGERPRINT_MAX_DISTANCE:
+        return None, None
+    return best_supplier, best_distance
+
+
+def add_fingerprint(supplier, image, source=""):
+    """
+    Añade al índice la huella de una página de la comercializadora (si no hay ya una idéntica).
+    Retorna el hash en hexadecimal.
+    """
+    global _index
+    fingerprint = f"{page_fingerprint(image):016x}"
+    with _index_lock:
+        try:
+            with open(INDEX_PATH, encoding="utf-8") as index_file:
+                entries = json.load(index_file)
+        except FileNotFoundError:
+            entries = []
+
+        if not any(entry["supplier"] == supplier and entry["hash"] == fingerprint for entry in entries):
+            entries.append({"supplier": supplier, "hash": fingerprint, "source": source})
+            with open(INDEX_PATH, "w", encoding="utf-8") as index_file:
+                json.dump(entries, index_file, indent=2, ensure_ascii=False)
+                index_file.write("\n")
+        _index = None
+    return fingerprint
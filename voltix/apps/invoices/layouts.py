@@ -0,0 +1,45 @@
+################################################################################################################################
+############################################ PLANTILLAS DE DISEÑO POR COMERCIALIZADORA #########################################
+################################################################################################################################
+
+# Cada plantilla declara las zonas de la factura que leen los extractores. Las cajas son fracciones de la página
+# (x0, y0, x1, y1), así no dependen de la resolución del render. Cada zona indica el modo de segmentación de
+# Tesseract (psm) y, opcionalmente, los caracteres permitidos (whitelist).
+
+import string
+
+# Letras, dígitos y signos que aparecen en los campos de una factura (sin espacios: Tesseract los admite siempre)
+TEXT_WHITELIST = string.ascii_letters + string.digits + "áéíóúÁÉÍÓÚñÑüÜºª.,:;/-()%€*"
+
+# Zona donde aparece el nombre de la comercializadora en la primera página
+HEADER_REGION = {"name": "cabecera", "page": 0, "bbox": (0.0, 0.0, 1.0, 0.2), "psm": 6, "whitelist": None}
+
+SUPPLIER_LAYOUTS = {
+    "endesa": {
+        "regions": [
+            {"name": "datos_factura", "page": 0, "bbox": (0.50, 0.03, 1.00, 0.13), "psm": 6, "whitelist": TEXT_WHITELIST},
+            {"name": "resumen", "page": 0, "bbox": (0.05, 0.25, 0.50, 0.38), "psm": 6, "whitelist": TEXT_WHITELIST},
+            {"name": "pago", "page": 0, "bbox": (0.55, 0.25, 1.00, 0.34), "psm": 6, "whitelist": TEXT_WHITELIST},
+            {"name": "consumo", "page": 0, "bbox": (0.05, 0.38, 0.50, 0.62), "psm": 6, "whitelist": TEXT_WHITELIST},
+            {"name": "contrato", "page": 1, "bbox": (0.05, 0.04, 0.52, 0.17), "psm": 6, "whitelist": None},
+        ],
+    },
+    "iberdrola": {
+        "regions": [
+            {"name": "datos_factura", "page": 0, "bbox": (0.05, 0.16, 0.50, 0.35), "psm": 6, "whitelist": TEXT_WHITELIST},
+            {"name": "cliente", "page": 0, "bbox": (0.52, 0.18, 0.92, 0.28), "psm": 6, "whitelist": None},
+            {"name": "resumen", "page": 0, "bbox": (0.05, 0.37, 0.50, 0.50), "psm": 6, "whitelist": TEXT_WHITELIST},
+            {"name": "suministro", "page": 1, "bbox": (0.05, 0.06, 0.95, 0.25), "psm": 6, "whitelist": None},
+            {"name": "detalle", "page": 1, "bbox": (0.05, 0.25, 0.70, 0.68), "psm": 6, "whitelist": TEXT_WHITELIST},
+        ],
+    },
+}
+
+
+def crop_region(image, bbox):
+    """
+    Devuelve la vista (sin copia) de la zona `bbox` de una imagen de NumPy.
+    """
+    height, width = image.shape[:2]
+    x0, y0, x1, y1 = bbox
+    return image[int(y0 * height):int(y1 * height), int(x0 * width):int(x1 * width)]
@@ -0,0 +1,120 @@
+################################################################################################################################
+############################################ MÉTRICAS DEL PIPELINE DE FACTURAS #################################################
+################################################################################################################################
+
+# Cada factura guarda en `Invoice.processing_metrics` el tiempo de cada etapa y la confianza media del OCR por
+# página. Los histogramas se calculan a partir de esos registros (no hay estado en memoria que se pierda entre
+# workers de Celery) y se exportan en JSON o en el formato de texto de Prometheus.
+
+import time
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Etapas medidas, en el orden del pipeline (las facturas servidas desde la caché solo tienen "save" y "persist").
+# "publish" (subida de la imagen) se ejecuta en segundo plano después de guardar la factura
+STAGES = ("save", "text_layer", "render", "identify", "preprocess", "ocr", "extract", "persist", "publish")
+
+# Límites superiores (ms) de los buckets de los histogramas
+BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+
+class PipelineMetrics:
+    """
+    Acumula los tiempos por etapa y la confianza del OCR de un trabajo. Es seguro usarlo desde los
+    hilos del pool de OCR: el tiempo de "preprocess" y "ocr" es la suma del de todos los hilos.
+    """
+
+    def __init__(self, stages_ms=None):
+        self.stages_ms = defaultdict(float, stages_ms or {})
+        self.page_confidences = defaultdict(list)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with self._lock:
+                self.stages_ms[name] += elapsed_ms
+
+    @contextmanager
+    def page(self, page_number):
+        """
+        Asocia a `page_number` las confianzas de OCR registradas en este hilo.
+        """
+        previous = getattr(self._local, "page", None)
+        self._local.page = page_number
+        try:
+            yield
+        finally:
+            self._local.page = previous
+
+    def add_confidence(self, confidence):
+        if confidence is None:
+            return
+        page_number = getattr(self._local, "page", None) or 0
+        with self._lock:
+            self.page_confidences[page_number].append(confidence)
+
+    def mean_confidence(self):
+        """
+        Confianza media de todas las lecturas de OCR (0-100), o None si no hubo OCR.
+        """
+        confidences = [confidence for values in self.page_confidences.values() for confidence in values]
+        return round(sum(confidences) / len(confidences), 2) if confidences else None
+
+    def as_dict(self, supplier=None, page_count=None):
+        return {
+            "supplier": supplier,
+            "pages": page_count,
+            "stages_ms": {name: round(value, 2) for name, value in self.stages_ms.items()},
+            "ocr_confidence": {
+                str(page_number): round(sum(values) / len(values), 2)
+                for page_number, values in sorted(self.page_confidences.items())
+            },
+        }
+
+
+def stage_histograms(invoices):
+    """
+    Histogramas acumulados (como los de Prometheus) del tiempo de cada etapa, etiquetados por
+    comercializadora y número de páginas, a partir de las facturas indicadas.
+    Retorna {(etapa, comercializadora, páginas): {"buckets": [...], "count": n, "sum_ms": total}}.
+    """
+    histograms = {}
+    for processing_metrics in invoices.exclude(processing_metrics=None).values_list("processing_metrics", flat=True):
+        supplier = processing_metrics.get("supplier") or "unknown"
+        pages = processing_metrics.get("pages") or 0
+        for stage, elapsed_ms in processing_metrics.get("stages_ms", {}).items():
+            histogram = histograms.setdefault(
+                (stage, supplier, pages), {"buckets": [0] * len(BUCKETS_MS), "count": 0, "sum_ms": 0.0}
+            )
+            for index, upper_bound in enumerate(BUCKETS_MS):
+                if elapsed_ms <= upper_bound:
+                    histogram["buckets"][index] += 1
+            histogram["count"] += 1
+            histogram["sum_ms"] += elapsed_ms
+    return histograms
+
+
+def render_prometheus(histograms):
+    """
+    Exporta los histogramas en el formato de texto de Prometheus (en segundos).
+    """
+    name = "voltix_invoice_stage_duration_seconds"
+    lines = [
+        f"# HELP {name} Duración de cada etapa del procesamiento de facturas.",
+        f"# TYPE {name} histogram",
+    ]
+    for (stage, supplier, pages), histogram in sorted(histograms.items()):
+        labels = f'stage="{stage}",supplier="{supplier}",pages="{pages}"'
+        for upper_bound, count in zip(BUCKETS_MS, histogram["buckets"]):
+            lines.append(f'{name}_bucket{{{labels},le="{upper_bound / 1000:g}"}} {count}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram["count"]}')
+        lines.append(f"{name}_sum{{{labels}}} {histogram['sum_ms'] / 1000:.6f}")
+        lines.append(f"{name}_count{{{labels}}} {histogram['count']}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,186 @@
+################################################################################################################################
+############################################ MOTORES DE OCR (TESSERACT) ########################################################
+################################################################################################################################
+
+import queue
+import logging
+import threading
+import numpy as np
+from collections import namedtuple
+import pytesseract
+from PIL import Image
+from django.conf import settings
+
+try:
+    import tesserocr
+except ImportError:  # tesserocr es opcional: sin él se usa pytesseract
+    tesserocr = None
+
+
+logger = logging.getLogger(__name__)
+
+# Mismo modo que `--psm 11` (texto disperso) y motor por defecto (`--oem 3`)
+OCR_LANG = "spa"
+OCR_PSM = 11
+OCR_OEM = 3
+
+# Texto reconocido y confianza media de las palabras (0-100, None si no hay palabras)
+OcrResult = namedtuple("OcrResult", ["text", "confidence"])
+
+
+def mean_confidence(confidences):
+    # Tesseract asigna -1 a las filas que no son palabras
+    confidences = [float(confidence) for confidence in confidences if float(confidence) >= 0]
+    return sum(confidences) / len(confidences) if confidences else None
+
+
+class OcrBackend:
+    """
+    Interfaz común de los motores de OCR. Reciben una imagen de NumPy (escala de grises o RGB).
+    """
+    name = None
+
+    def image_to_string(self, image, timeout=0, psm=OCR_PSM, whitelist=None):
+        raise NotImplementedError
+
+    def image_to_data(self, image, timeout=0, psm=OCR_PSM, whitelist=None):
+        """
+        Retorna un OcrResult con el texto y la confianza media de las palabras reconocidas.
+        """
+        raise NotImplementedError
+
+
+class TesserocrBackend(OcrBackend):
+    """
+    Usa la API en C de Tesseract a través de tesserocr. Los motores (con el modelo de idioma ya
+    cargado) se guardan en un pool del proceso y se reutilizan durante toda la vida del worker,
+    aunque los hilos que los usan se creen y destruyan con cada factura.
+    """
+    name = "tesserocr"
+
+    def __init__(self):
+        # PyTessBaseAPI no es thread-safe: cada OCR en curso toma un motor del pool y lo devuelve al
+        # terminar. El pool crece hasta el número máximo de OCR simultáneos del proceso
+        self._engines = queue.LifoQueue()
+        # El primer motor se crea al elegir el backend: si Tesseract no arranca (modelo de idioma o
+        # TESSDATA_PREFIX incorrectos), tesserocr lanza RuntimeError aquí y no en cada OCR
+        self.checkin(self.create_api())
+
+    def create_api(self):
+        kwargs = {"lang": OCR_LANG, "psm": OCR_PSM, "oem": OCR_OEM}
+        if settings.TESSERACT_DATA_PATH:
+            kwargs["path"] = settings.TESSERACT_DATA_PATH
+        api = tesserocr.PyTessBaseAPI(**kwargs)
+        logger.info(f"Motor de Tesseract inicializado ({self._engines.qsize() + 1} en el pool).")
+        return api
+
+    def checkout(self):
+        try:
+            return self._engines.get_nowait()
+        except queue.Empty:
+            return self.create_api()
+
+    def checkin(self, api):
+        api.Clear()
+        self._engines.put(api)
+
+    def image_to_string(self, image, timeout=0, psm=OCR_PSM, whitelist=None):
+        return self.image_to_data(image, timeout=timeout, psm=psm, whitelist=whitelist).text
+
+    def image_to_data(self, image, timeout=0, psm=OCR_PSM, whitelist=None):
+        # tesserocr no admite timeout: el límite por factura lo aplica el pool de OCR
+        image = np.ascontiguousarray(image)
+        height, width = image.shape[:2]
+        bytes_per_pixel = 1 if image.ndim == 2 else image.shape[2]
+
+        api = self.checkout()
+        try:
+            api.SetPageSegMode(psm)
+            api.SetVariable("tessedit_char_whitelist", whitelist or "")
+            api.SetImageBytes(image.tobytes(), width, height, bytes_per_pixel, width * bytes_per_pixel)
+            # Las confianzas salen del mismo reconocimiento que el texto, sin una segunda pasada
+            text = api.GetUTF8Text()
+            return OcrResult(text, mean_confidence(api.AllWordConfidences()))
+        finally:
+            self.checkin(api)
+
+
+class PytesseractBackend(OcrBackend):
+    """
+    Ejecuta el binario de Tesseract en un subproceso por imagen (pytesseract). Sirve de respaldo
+    cuando tesserocr no está instalado.
+    """
+    name = "pytesseract"
+
+    def __init__(self):
+        pytesseract.pytesseract.tesseract_cmd = settings.TESSERACT_CMD
+
+    def config(self, psm, whitelist):
+        config = f"--oem {OCR_OEM} --psm {psm}"
+        if whitelist:
+            config += f" -c tessedit_char_whitelist={whitelist}"
+        return config
+
+    def image_to_string(self, image, timeout=0, psm=OCR_PSM, whitelist=None):
+        return pytesseract.image_to_string(
+            Image.fromarray(image), lang=OCR_LANG, config=self.config(psm, whitelist), timeout=timeout
+        )
+
+    def image_to_data(self, image, timeout=0, psm=OCR_PSM, whitelist=None):
+        # Una sola ejecución de Tesseract (TSV): el texto se reconstruye con el formato de image_to_string
+        data = pytesseract.image_to_data(
+            Image.fromarray(image), lang=OCR_LANG, config=self.config(psm, whitelist), timeout=timeout,
+            output_type=pytesseract.Output.DICT,
+        )
+        return OcrResult(self.tsv_to_text(data), mean_confidence(data["conf"]))
+
+    def tsv_to_text(self, data):
+        """
+        Une las palabras del TSV de Tesseract como su salida de texto: palabras de una línea separadas por
+        espacios, una línea por renglón y una línea en blanco al final de cada párrafo.
+        """
+        paragraphs = {}
+        for block, paragraph, line, word in zip(data["block_num"], data["par_num"], data["line_num"], data["text"]):
+            if word.strip():
+                paragraphs.setdefault((block, paragraph), {}).setdefault(line, []).append(word)
+        return "".join(
+            "".join(" ".join(words) + "\n" for words in lines.values()) + "\n"
+            for lines in paragraphs.values()
+        )
+
+
+OCR_BACKENDS = {
+    TesserocrBackend.name: TesserocrBackend,
+    PytesseractBackend.name: PytesseractBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_ocr_backend():
+    """
+    Devuelve el motor de OCR del proceso, creándolo la primera vez según INVOICE_OCR_BACKEND
+    ("auto", "tesserocr" o "pytesseract"). En modo "auto" se prefiere tesserocr si está disponible.
+    Si tesserocr no está instalado o su motor no se puede inicializar se usa pytesseract.
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                name = settings.INVOICE_OCR_BACKEND
+                if name == "auto":
+                    name = TesserocrBackend.name if tesserocr is not None else PytesseractBackend.name
+                elif name == TesserocrBackend.name and tesserocr is None:
+                    logger.warning("tesserocr no está instalado; se usará pytesseract.")
+                    name = PytesseractBackend.name
+                try:
+                    _backend = OCR_BACKENDS[name]()
+                except RuntimeError as e:
+                    if name != TesserocrBackend.name:
+                        raise
+                    logger.warning(f"No se pudo inicializar tesserocr ({str(e)}); se usará pytesseract.")
+                    name = PytesseractBackend.name
+                    _backend = OCR_BACKENDS[name]()
+                logger.info(f"Motor de OCR seleccionado: {name}.")
+    return _backend
@@ -0,0 +1,676 @@
+################################################################################################################################
+############################## PIPELINE DE FACTURAS: PDF -> IMÁGENES -> OCR -> JSON -> BASE DE DATOS ###########################
+################################################################################################################################
+
+import os
+import math
+import time
+import cv2
+import logging
+import fitz  # PyMuPDF
+import numpy as np
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from django.conf import settings
+from apps.general.models import Invoice
+from apps.general.utils.upload_cloudinary import upload_image_bytes
+from . import admission
+from .cache import store_image_url, store_result
+from .checkpoints import discard_checkpoint
+from .dedupe import find_duplicate_invoice, reference_number
+from .extractors import detect_supplier, extract_invoice_data
+from .fingerprints import match_supplier
+from .layouts import HEADER_REGION, SUPPLIER_LAYOUTS, crop_region
+from .metrics import PipelineMetrics
+from .ocr import OCR_PSM, get_ocr_backend
+
+
+logger = logging.getLogger(__name__)
+
+# Perfiles de preprocesado, del más barato al más pesado
+PREPROCESSING_PROFILES = ("fast", "standard", "heavy")
+
+# Campos que deben extraerse; si quedan vacíos se repite el OCR (página completa o perfil más pesado)
+REQUIRED_FIELDS = (
+    ("periodo_facturacion", "inicio"),
+    ("periodo_facturacion", "fin"),
+    ("desglose_cargos", "total_a_pagar"),
+)
+
+# Petición de OCR de una página: zonas de la plantilla (None = página completa) y texto ya leído que se antepone
+OcrRequest = namedtuple("OcrRequest", ["pix", "profile", "regions", "prefix"])
+
+# Núcleo para estimar el ruido de una imagen (Immerkær, 1996)
+NOISE_KERNEL = np.array([[1, -2, 1],
+                         [-2, 4, -2],
+                         [1, -2, 1]], dtype=np.float32)
+
+
+class PipelineError(Exception):
+    """
+    Fallo de una etapa del pipeline. Si es `resumable` se conservan el PDF y los checkpoints para
+    que un reintento continúe desde esa etapa.
+    """
+
+    def __init__(self, message, resumable=True, parsed_data=None, ocr_text=""):
+        super().__init__(message)
+        self.resumable = resumable
+        self.parsed_data = parsed_data
+        self.ocr_text = ocr_text
+
+
+class InvoiceProcessor:
+    """
+    Ejecuta el procesamiento completo de una factura en PDF fuera del ciclo de la petición HTTP.
+    Lo utilizan los workers de Celery a través de la tarea `process_invoice_job`.
+    """
+
+    def __init__(self):
+        # Tiempos por etapa y confianza del OCR del trabajo en curso
+        self.metrics = PipelineMetrics()
+
+    def process_job(self, job):
+        """
+        Procesa el PDF asociado a un InvoiceProcessingJob, actualizando su etapa y progreso.
+        Si el trabajo ya tiene checkpoints de un intento anterior, continúa desde la primera etapa
+        que no terminó (sin repetir el OCR).
+        Retorna True si la factura se guardó y falta publicar su imagen (tarea publish_invoice_image).
+        """
+        checkpoint = job.checkpoint
+        self.metrics = PipelineMetrics(checkpoint.get("stages_ms") or job.metrics.get("stages_ms"))
+        # Ante fallos transitorios se conservan el PDF y los checkpoints para poder reintentar
+        keep_checkpoint = True
+        image_pending = False
+        try:
+            # La plaza de OCR cuenta desde que el worker toma el trabajo, no desde que se admitió
+            admission.renew(job)
+            job.mark_stage("render", 10, status="processing")
+            if "extract" in checkpoint:
+                logger.info(f"Reanudando el trabajo {job.id} sin repetir el OCR.")
+            elif "ocr" in checkpoint:
+                logger.info(f"Reanudando el trabajo {job.id} desde el texto del OCR.")
+                self.extract_from_checkpoint(job)
+            else:
+                self.recognize(job)
+
+            ocr = job.checkpoint["ocr"]
+            parsed_data = job.checkpoint["extract"]["parsed_data"]
+            if "error" in parsed_data:
+                raise PipelineError(parsed_data["error"], resumable=False, parsed_data=parsed_data, ocr_text=ocr["text"])
+
+            # Guardar los datos en la base de datos. La imagen se publica después, fuera del pipeline:
+            # la latencia o las caídas de Cloudinary no retrasan ni hacen fallar la factura
+            job.mark_stage("persist", 95)
+            metrics = self.metrics.as_dict(supplier=ocr["supplier"], page_count=ocr["page_count"])
+            if self.persist_invoice(job, parsed_data, ocr["text"], None, metrics=metrics):
+                # Las re-subidas del mismo PDF se resolverán desde la caché
+                store_result(job.content_hash, parsed_data, ocr["text"], None)
+                # El PDF se conserva hasta que se publique la imagen (las duplicadas ya tienen la suya)
+                image_pending = not job.duplicate
+                keep_checkpoint = image_pending
+
+        except PipelineError as e:
+            logger.error(f"Error en el trabajo {job.id} ({job.stage}): {str(e)}")
+            job.mark_failed(str(e), parsed_data=e.parsed_data, ocr_text=e.ocr_text)
+            keep_checkpoint = e.resumable
+
+        except Exception as e:
+            logger.error(f"Error durante el procesamiento: {str(e)}")
+            job.mark_failed(str(e))
+
+        finally:
+            # Liberar la plaza de OCR del trabajo (control de admisión)
+            admission.release(job)
+
+            # Eliminar el PDF subido y los checkpoints, salvo si el trabajo se puede reintentar
+            if not keep_checkpoint:
+                discard_checkpoint(job)
+        return image_pending
+
+    def recognize(self, job):
+        """
+        Etapas render -> preprocesado -> OCR -> extracción. Guarda como checkpoints el texto leído
+        ("ocr") y el JSON extraído ("extract").
+        """
+        with fitz.open(job.file_path) as pdf_document:
+            # Solo se leen las primeras páginas; el resto del documento nunca se renderiza
+            page_count = len(pdf_document)
+            page_numbers = range(min(page_count, settings.INVOICE_MAX_PAGES))
+            with self.metrics.stage("text_layer"):
+                text_layers = self.extract_text_layers(pdf_document, page_numbers)
+
+            # La primera página siempre se renderiza para identificar la comercializadora; el resto
+            # solo si necesita OCR. Todas directamente en escala de grises
+            pages = self.iter_page_images(
+                pdf_document,
+                page_numbers,
+                should_render=lambda n: n == 0 or not text_layers[n],
+            )
+
+            # El preprocesado y el OCR de cada página se reparten en un pool de hilos acotado:
+            # OpenCV y el subproceso de Tesseract liberan el GIL
+            executor = ThreadPoolExecutor(max_workers=settings.INVOICE_OCR_WORKERS)
+            ocr_deadline = time.monotonic() + settings.INVOICE_OCR_TIMEOUT
+            try:
+                supplier = None
+                header_text = ""
+                ocr_pages = {}  # Página -> OcrRequest
+                ocr_futures = {}
+                for page_number, pix in pages:
+                    if page_number == 0:
+                        # La comercializadora se identifica antes de cualquier OCR para elegir su
+                        # extractor y su plantilla, y descartar en milisegundos las no soportadas
+                        image = self.pixmap_to_array(pix)
+                        with self.metrics.stage("identify"):
+                            supplier = self.identify_supplier(image, text_layers)
+                        if supplier is None and not text_layers[0]:
+                            # Último recurso: OCR solo de la cabecera
+                            header_text = self.ocr_region(image, HEADER_REGION, self.select_profile(image))
+                            supplier = detect_supplier(header_text)
+                        if supplier is None and not text_layers[0] and settings.INVOICE_REJECT_UNKNOWN_SUPPLIER:
+                            # Antes de rechazar un escaneo se busca la comercializadora en el texto de la página
+                            # completa, como en la extracción. Ese OCR se reutiliza como el de la página
+                            request = OcrRequest(pix, self.select_profile(image), None, "")
+                            page_text = self.run_ocr_request(0, request)
+                            supplier = detect_supplier(page_text)
+                            ocr_pages[0] = request
+                            ocr_futures[0] = Future()
+                            ocr_futures[0].set_result(page_text)
+                        if supplier is None and settings.INVOICE_REJECT_UNKNOWN_SUPPLIER:
+                            logger.info(f"Trabajo {job.id} rechazado: comercializadora no soportada.")
+                            raise PipelineError(
+                                "No se reconoció ninguna comercializadora soportada en la factura.", resumable=False
+                            )
+
+                    # Los PDF digitales ya traen el texto: solo se hace OCR si la página no tiene capa de texto
+                    if not text_layers[page_number] and page_number not in ocr_futures:
+                        profile = self.select_profile(self.pixmap_to_array(pix))
+                        # Con la comercializadora identificada solo se hace OCR de las zonas de su plantilla
+                        regions = self.layout_regions(supplier, page_number) if settings.INVOICE_ROI_OCR else None
+                        prefix = header_text if page_number == 0 and regions is not None else ""
+                        request = OcrRequest(pix, profile, regions, prefix)
+                        ocr_pages[page_number] = request
+                        ocr_futures[page_number] = executor.submit(self.run_ocr_request, page_number, request)
+
+                job.mark_stage("ocr", 35)
+                try:
+                    page_texts = self.collect_page_texts(job, page_numbers, text_layers, ocr_futures, ocr_deadline)
+                except FuturesTimeoutError:
+                    logger.error(f"Tiempo de OCR agotado para el trabajo {job.id}.")
+                    raise PipelineError(f"El OCR superó el tiempo máximo de {settings.INVOICE_OCR_TIMEOUT} segundos.")
+
+                source = "ocr" if ocr_futures or not page_texts else "text_layer"
+                ocr_text_combined = "".join(text + "\n" for text in page_texts)
+                ocr = {"text": ocr_text_combined, "source": source, "supplier": supplier, "page_count": page_count}
+                job.save_checkpoint(ocr=ocr, stages_ms=dict(self.metrics.stages_ms))
+
+                # Convertir OCR a JSON
+                job.mark_stage("extract", 85)
+                with self.metrics.stage("extract"):
+                    parsed_data = self.convert_ocr_to_json(ocr_text_combined, source=source, supplier=supplier)
+
+                # Si con la capa de texto faltan campos obligatorios (texto desordenado o de una maqueta que el
+                # extractor no reconoce), se repite la lectura de esas páginas con OCR. Se conserva la capa de
+                # texto si el OCR no mejora la extracción
+                text_layer_pages = [n for n in page_numbers if text_layers[n]]
+                if text_layer_pages and self.missing_required_fields(parsed_data):
+                    logger.info(f"Campos obligatorios vacíos con la capa de texto: OCR de {len(text_layer_pages)} página(s).")
+                    layer_requests = {
+                        n: OcrRequest(pix, self.select_profile(self.pixmap_to_array(pix)), None, "")
+                        for n, pix in self.iter_page_images(pdf_document, text_layer_pages)
+                    }
+                    admission.renew(job)
+                    try:
+                        layer_texts = self.run_ocr_requests(executor, layer_requests, ocr_deadline)
+                    except (FuturesTimeoutError, PipelineError) as e:
+                        logger.warning(f"No se pudo hacer OCR de las páginas con capa de texto del trabajo {job.id}: {str(e) or 'tiempo agotado'}.")
+                        layer_texts = {}
+                    if layer_texts:
+                        ocr_texts = list(page_texts)
+                        for page_number, text in layer_texts.items():
+                            ocr_texts[page_numbers.index(page_number)] = text
+                        ocr_text = "".join(text + "\n" for text in ocr_texts)
+                        with self.metrics.stage("extract"):
+                            ocr_parsed_data = self.convert_ocr_to_json(ocr_text, source="ocr", supplier=supplier)
+                        if len(self.missing_required_fields(ocr_parsed_data)) <= len(self.missing_required_fields(parsed_data)):
+                            page_texts, parsed_data, source = ocr_texts, ocr_parsed_data, "ocr"
+                            ocr.update(text=ocr_text, source=source)
+                            ocr_pages.update(layer_requests)
+
+                # Si faltan campos obligatorios, repetir el OCR de la página completa (si solo se leyeron
+                # zonas) o con el siguiente perfil de preprocesado
+                while self.missing_required_fields(parsed_data):
+                    ocr_pages = {
+                        n: escalated
+                        for n, escalated in ((n, self.escalate_ocr_request(request)) for n, request in ocr_pages.items())
+                        if escalated
+                    }
+                    if not ocr_pages:
+                        break
+                    logger.info(f"Campos obligatorios vacíos: repitiendo el OCR de {len(ocr_pages)} página(s).")
+                    admission.renew(job)
+                    try:
+                        escalated_texts = self.run_ocr_requests(executor, ocr_pages, ocr_deadline)
+                    except (FuturesTimeoutError, PipelineError) as e:
+                        # Se conserva el resultado del último perfil que terminó a tiempo
+                        logger.warning(f"No se pudo escalar el preprocesado del trabajo {job.id}: {str(e) or 'tiempo agotado'}.")
+                        break
+                    for page_number, text in escalated_texts.items():
+                        page_texts[page_numbers.index(page_number)] = text
+                    ocr["text"] = "".join(text + "\n" for text in page_texts)
+                    with self.metrics.stage("extract"):
+                        parsed_data = self.convert_ocr_to_json(ocr["text"], source=source, supplier=supplier)
+            finally:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+        job.save_checkpoint(ocr=ocr, extract={"parsed_data": parsed_data}, stages_ms=dict(self.metrics.stages_ms))
+
+    def extract_from_checkpoint(self, job):
+        """
+        Etapa de extracción a partir del texto guardado en el checkpoint "ocr", sin renderizar ni
+        repetir el OCR. Sin las imágenes de las páginas no se escala el preprocesado.
+        """
+        ocr = job.checkpoint["ocr"]
+        job.mark_stage("extract", 85)
+        with self.metrics.stage("extract"):
+            parsed_data = self.convert_ocr_to_json(ocr["text"], source=ocr["source"], supplier=ocr["supplier"])
+        job.save_checkpoint(extract={"parsed_data": parsed_data}, stages_ms=dict(self.metrics.stages_ms))
+
+    def publish(self, job):
+        """
+        Etapa "publish" (tarea publish_invoice_image, después de guardar la factura): renderiza en color
+        la primera página del PDF conservado, la sube a Cloudinary y completa `image_url` de la factura.
+        Lanza PipelineError si falla (reanudable si es un error de Cloudinary).
+        """
+        invoice = job.invoice
+        if invoice is None or not job.file_path or not os.path.exists(job.file_path):
+            raise PipelineError("El PDF o la factura del trabajo ya no están disponibles.", resumable=False)
+
+        started = time.perf_counter()
+        try:
+            with fitz.open(job.file_path) as pdf_document:
+                pix = self.render_page(pdf_document[0], grayscale=False)
+            image_url = self.upload_page_image(pix)
+        except Exception as cloudinary_error:
+            logger.error(f"Error al subir la imagen a Cloudinary: {str(cloudinary_error)}")
+            raise PipelineError(f"Error al subir la imagen: {str(cloudinary_error)}")
+
+        invoice.image_url = image_url
+        if invoice.processing_metrics:
+            invoice.processing_metrics["stages_ms"]["publish"] = round((time.perf_counter() - started) * 1000, 2)
+        invoice.save(update_fields=["image_url", "processing_metrics"])
+        store_image_url(job.content_hash, image_url)
+        logger.info(f"Imagen de la factura {invoice.id} publicada en {image_url}.")
+        return image_url
+
+    def complete_from_cache(self, job, entry):
+        """
+        Completa un trabajo con un resultado de la caché, sin OCR ni subida a Cloudinary.
+        """
+        job.mark_stage("cache", 90, status="processing")
+        self.metrics = PipelineMetrics(job.metrics.get("stages_ms"))
+        return self.persist_invoice(job, entry.result, entry.ocr_text, entry.image_url, metrics=self.metrics.as_dict())
+
+    def persist_invoice(self, job, parsed_data, ocr_text, photo_url, metrics=None):
+        """
+        Crea la factura del usuario y cierra el trabajo. Retorna la factura o None si falla.
+        `metrics` (tiempos por etapa y confianza del OCR) se guarda con la factura, añadiendo el
+        tiempo de la propia escritura en base de datos. Si el usuario ya tiene una factura con el
+        mismo número de referencia y periodo no se crea otra: el trabajo se cierra como duplicado de esa.
+        """
+        period = parsed_data.get("periodo_facturacion") or {}
+        if not (period.get("inicio") and period.get("fin")):
+            logger.error(f"El trabajo {job.id} no tiene periodo de facturación: no se guarda la factura.")
+            job.mark_failed(
+                "No se pudo extraer el periodo de facturación de la factura.", parsed_data=parsed_data, ocr_text=ocr_text
+            )
+            return None
+
+        try:
+            duplicate = find_duplicate_invoice(job.user, parsed_data)
+            if duplicate:
+                logger.info(f"El trabajo {job.id} es un duplicado de la factura {duplicate.id}.")
+                job.mark_done(parsed_data, ocr_text, duplicate, duplicate=True)
+                return duplicate
+
+            started = time.perf_counter()
+            invoice = Invoice.objects.create(
+                user=job.user,  # Relacionar la factura con el usuario que la subió
+                billing_period_start=parsed_data["periodo_facturacion"].get("inicio"),
+                billing_period_end=parsed_data["periodo_facturacion"].get("fin"),
+                data=parsed_data,  # Guardar todo el JSON en el campo 'data'
+                image_url=photo_url,  # Guardar la URL de la primera página en el modelo
+                ocr_confidence=self.metrics.mean_confidence(),
+                content_hash=job.content_hash,
+                reference_number=reference_number(parsed_data),
+            )
+
+            if metrics is not None:
+                metrics["stages_ms"]["persist"] = round((time.perf_counter() - started) * 1000, 2)
+                invoice.processing_metrics = metrics
+                invoice.save(update_fields=["processing_metrics"])
+                logger.info(f"Tiempos por etapa (ms) de la factura {invoice.id}: {metrics['stages_ms']}")
+
+            logger.info("Factura guardada exitosamente en la base de datos.")
+        except Exception as db_error:
+            logger.error(f"Error al guardar en la base de datos: {str(db_error)}")
+            job.mark_failed(
+                f"Error al guardar los datos en la base de datos: {str(db_error)}",
+                parsed_data=parsed_data,
+                ocr_text=ocr_text,
+            )
+            return None
+
+        job.mark_done(parsed_data, ocr_text, invoice)
+        return invoice
+
+    def collect_page_texts(self, job, page_numbers, text_layers, ocr_futures, deadline):
+        """
+        Reúne el texto de cada página en orden: la capa de texto si existe o el resultado del OCR.
+        Lanza TimeoutError si el OCR no termina antes de `deadline` (time.monotonic()).
+        """
+        page_texts = []
+        for done, page_number in enumerate(page_numbers, start=1):
+            if text_layers[page_number]:
+                page_texts.append(text_layers[page_number]["text"])
+            else:
+                page_texts.append(ocr_futures[page_number].result(timeout=max(0, deadline - time.monotonic())))
+                job.mark_stage("ocr", 35 + int(45 * done / len(page_numbers)))
+                admission.renew(job)
+        return page_texts
+
+    def run_ocr_requests(self, executor, requests, deadline):
+        """
+        Ejecuta en el pool de hilos las peticiones de OCR {página: OcrRequest} y retorna {página: texto}.
+        Lanza TimeoutError si el OCR no termina antes de `deadline` (time.monotonic()).
+        """
+        futures = {n: executor.submit(self.run_ocr_request, n, request) for n, request in requests.items()}
+        return {n: future.result(timeout=max(0, deadline - time.monotonic())) for n, future in futures.items()}
+
+    def run_ocr_request(self, page_number, request):
+        """
+        Ejecuta en el pool de hilos el OCR de una página, asociando a ella la confianza del OCR.
+        """
+        with self.metrics.page(page_number):
+            return self.ocr_page(*request)
+
+    def ocr_page(self, pix, profile=None, regions=None, prefix=""):
+        """
+        Preprocesa y ejecuta OCR sobre una página renderizada. Se ejecuta en el pool de hilos.
+        Con `regions` solo se leen esas zonas de la plantilla (una lista vacía omite la página) y el
+        texto se antepone con `prefix` (la cabecera ya leída al identificar la comercializadora).
+        """
+        image = self.pixmap_to_array(pix)
+        if regions is None:
+            with self.metrics.stage("preprocess"):
+                grayscale_image = self.process_image(image, profile=profile)
+            with self.metrics.stage("ocr"):
+                return self.perform_ocr(grayscale_image, timeout=settings.INVOICE_OCR_TIMEOUT)
+
+        texts = [prefix] + [self.ocr_region(image, region, profile) for region in regions]
+        return "\n\n".join(text for text in texts if text)
+
+    def ocr_region(self, image, region, profile=None):
+        """
+        Ejecuta OCR sobre una zona de la página con el PSM y la lista de caracteres de su plantilla.
+        Las líneas se separan con una línea en blanco, como en la salida de `--psm 11` que esperan los extractores.
+        """
+        with self.metrics.stage("preprocess"):
+            grayscale_image = self.process_image(crop_region(image, region["bbox"]), profile=profile)
+        with self.metrics.stage("ocr"):
+            text = self.perform_ocr(
+                grayscale_image, timeout=settings.INVOICE_OCR_TIMEOUT, psm=region["psm"], whitelist=region["whitelist"]
+            )
+        return "\n\n".join(line.strip() for line in text.splitlines() if line.strip())
+
+    def identify_supplier(self, image, text_layers):
+        """
+        Identifica la comercializadora sin OCR: por la huella visual de la zona del logotipo de la
+        primera página y, si no se parece a ningún diseño conocido, por las palabras clave de la capa
+        de texto. Retorna el nombre del extractor o None.
+        """
+        started = time.perf_counter()
+        supplier, distance = match_supplier(image)
+        method = f"huella visual (distancia {distance})"
+        if supplier is None:
+            supplier = detect_supplier(" ".join(layer["text"] for layer in text_layers.values() if layer))
+            method = "capa de texto"
+        if supplier:
+            logger.info(f"Comercializadora '{supplier}' identificada por {method} en {(time.perf_counter() - started) * 1000:.1f} ms.")
+        return supplier
+
+    def layout_regions(self, supplier, page_number):
+        """
+        Zonas de la plantilla de la comercializadora en una página, o None si no hay plantilla
+        (en ese caso se hace OCR de la página completa).
+        """
+        layout = SUPPLIER_LAYOUTS.get(supplier)
+        if not layout:
+            return None
+        return [region for region in layout["regions"] if region["page"] == page_number]
+
+    def escalate_ocr_request(self, request):
+        """
+        Siguiente intento de OCR de una página: primero la página completa si solo se leyeron
+        zonas y después el siguiente perfil de preprocesado. None si no quedan intentos.
+        """
+        if request.regions is not None:
+            return OcrRequest(request.pix, request.profile, None, "")
+        profile = self.next_profile(request.profile)
+        return OcrRequest(request.pix, profile, None, "") if profile else None
+
+    def probe_image_quality(self, image):
+        """
+        Estima el ruido (sigma, método de Immerkær con mediana para ignorar los bordes del texto) y
+        el contraste (desviación típica) de una página. Se calcula sobre una submuestra de la imagen
+        para que cueste unos pocos milisegundos.
+        """
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        sample = np.ascontiguousarray(image[::2, ::2], dtype=np.float32)
+        height, width = sample.shape
+        if height < 3 or width < 3:
+            return 0.0, float(sample.std())
+
+        laplacian = cv2.filter2D(sample, -1, NOISE_KERNEL)[1:-1, 1:-1]
+        # Para ruido gaussiano la respuesta del núcleo tiene desviación 6·sigma; mediana(|x|) = 0.6745·desviación
+        noise = float(np.median(np.abs(laplacian))) / (0.6745 * 6)
+        return noise, float(sample.std())
+
+    def select_profile(self, image):
+        """
+        Elige el perfil de preprocesado más barato que la calidad de la página permite.
+        """
+        noise, contrast = self.probe_image_quality(image)
+        if noise <= settings.INVOICE_PREPROCESS_FAST_MAX_NOISE and contrast >= settings.INVOICE_PREPROCESS_FAST_MIN_CONTRAST:
+            profile = "fast"
+        elif noise >= settings.INVOICE_PREPROCESS_HEAVY_MIN_NOISE:
+            profile = "heavy"
+        else:
+            profile = "standard"
+        logger.info(f"Perfil de preprocesado '{profile}' (ruido {noise:.2f}, contraste {contrast:.1f}).")
+        return profile
+
+    def next_profile(self, profile):
+        """
+        Devuelve el siguiente perfil más pesado, o None si ya es el más pesado.
+        """
+        index = PREPROCESSING_PROFILES.index(profile)
+        return PREPROCESSING_PROFILES[index + 1] if index + 1 < len(PREPROCESSING_PROFILES) else None
+
+    def missing_required_fields(self, parsed_data):
+        """
+        Retorna los campos obligatorios que la extracción dejó vacíos (todos si hubo error).
+        """
+        if "error" in parsed_data:
+            return [".".join(path) for path in REQUIRED_FIELDS]
+
+        missing = []
+        for path in REQUIRED_FIELDS:
+            value = parsed_data
+            for key in path:
+                value = value.get(key) if isinstance(value, dict) else None
+            if value in (None, ""):
+                missing.append(".".join(path))
+        return missing
+
+    def upload_page_image(self, pix):
+        """
+        Sube la imagen de una página a Cloudinary y retorna su URL.
+        Es el único punto del pipeline donde se codifica PNG.
+        """
+        return upload_image_bytes(
+            pix.tobytes("png"), folder="invoices", filename="processed_image.png", timeout=settings.INVOICE_PUBLISH_TIMEOUT
+        )
+
+    def iter_page_images(self, pdf_document, page_numbers, should_render=None, color_pages=()):
+        """
+        Genera pares (número de página, pixmap) renderizando cada página solo cuando se consume.
+        Si `should_render` devuelve False para una página, se entrega None en lugar del pixmap.
+        Las páginas se renderizan en escala de grises salvo las indicadas en `color_pages`.
+        """
+        for page_number in page_numbers:
+            if should_render and not should_render(page_number):
+                yield page_number, None
+                continue
+            with self.metrics.stage("render"):
+                pix = self.render_page(pdf_document[page_number], grayscale=page_number not in color_pages)
+            yield page_number, pix
+
+    def pixmap_to_array(self, pix):
+        """
+        Devuelve una vista numpy (sin copia) sobre las muestras del pixmap: (alto, ancho) en
+        escala de grises o (alto, ancho, canales) en color. El pixmap debe seguir vivo mientras se use.
+        """
+        samples = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.stride)
+        samples = samples[:, :pix.width * pix.n]
+        if pix.n == 1:
+            return samples
+        return samples.reshape(pix.height, pix.width, pix.n)
+
+    def render_page(self, page, grayscale=True):
+        """
+        Renderiza una página a 2x como pixmap (en escala de grises por defecto), reduciendo la
+        escala si la imagen superaría el presupuesto de píxeles INVOICE_RENDER_MAX_PIXELS.
+        """
+        zoom = 2.0  # 2x scaling for higher DPI
+        page_area = page.rect.width * page.rect.height
+        if page_area * zoom * zoom > settings.INVOICE_RENDER_MAX_PIXELS:
+            zoom = math.sqrt(settings.INVOICE_RENDER_MAX_PIXELS / page_area)
+            # PyMuPDF redondea cada dimensión hacia arriba: ajustar para no exceder el presupuesto
+            while math.ceil(page.rect.width * zoom) * math.ceil(page.rect.height * zoom) > settings.INVOICE_RENDER_MAX_PIXELS:
+                zoom *= 0.995
+
+        colorspace = fitz.csGRAY if grayscale else fitz.csRGB
+        return page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=colorspace, alpha=False)
+
+    def extract_text_layers(self, pdf_document, page_numbers):
+        """
+        Devuelve, por número de página, su capa de texto embebida o None
+        si la página no tiene texto utilizable (PDF escaneado) y requiere OCR.
+        """
+        text_layers = {}
+        for page_number in page_numbers:
+            try:
+                text_layers[page_number] = self.extract_text_layer(pdf_document[page_number])
+            except Exception as e:
+                logger.error(f"Error al leer la capa de texto de la página {page_number}: {str(e)}")
+                text_layers[page_number] = None
+        return text_layers
+
+    def extract_text_layer(self, page):
+        """
+        Extrae el texto y la posición de cada palabra directamente del PDF con PyMuPDF.
+        Retorna None si la página no tiene suficiente texto embebido.
+        """
+        words = page.get_text("words", sort=True)
+        alnum_chars = sum(1 for word in words for char in word[4] if char.isalnum())
+        if alnum_chars < settings.INVOICE_TEXT_LAYER_MIN_CHARS:
+            return None
+
+        return {
+            "text": self.words_to_ocr_layout(words),
+            # (x0, y0, x1, y1, palabra) en puntos PDF
+            "words": [(x0, y0, x1, y1, text) for x0, y0, x1, y1, text, *_ in words],
+        }
+
+    def words_to_ocr_layout(self, words):
+        """
+        Reconstruye el texto con el mismo formato que produce Tesseract con `--psm 11`
+        (una línea por bloque separada por una línea en blanco), de modo que los
+        extractores de cada comercializadora funcionen igual con texto embebido u OCR.
+        """
+        lines = {}
+        for x0, y0, x1, y1, text, block_no, line_no, word_no in words:
+            lines.setdefault((block_no, line_no), []).append(text)
+        return "\n\n".join(" ".join(line_words) for line_words in lines.values())
+
+    def process_image(self, image, profile=None):
+        """
+        Prepara para OCR una página (array numpy en escala de grises o RGB) usando OpenCV.
+        Perfiles: "fast" (umbral de Otsu), "standard" (CLAHE + eliminación de ruido + enfoque) y
+        "heavy" (eliminación de ruido más agresiva + umbral adaptativo). Sin perfil se elige con
+        `select_profile`.
+        """
+        try:
+            if image.ndim == 3:
+                grayscale_image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+            else:
+                grayscale_image = image
+
+            profile = profile or self.select_profile(grayscale_image)
+
+            if profile == "fast":
+                # Render limpio: basta con binarizar
+                _, binary_image = cv2.threshold(grayscale_image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+                return binary_image
+
+            # Aumentar contraste usando CLAHE
+            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+            contrast_image = clahe.apply(grayscale_image)
+
+            if profile == "heavy":
+                # Escaneos muy ruidosos o con iluminación irregular
+                denoised_image = cv2.fastNlMeansDenoising(contrast_image, None, 40, 7, 35)
+                return cv2.adaptiveThreshold(
+                    denoised_image, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 15
+                )
+
+            # Eliminar ruido
+            denoised_image = cv2.fastNlMeansDenoising(contrast_image, None, 30, 7, 21)
+
+            # Afilar la imagen
+            kernel = np.array([[0, -1, 0],
+                               [-1, 5, -1],
+                               [0, -1, 0]])
+            sharpened_image = cv2.filter2D(denoised_image, -1, kernel)
+
+            return sharpened_image
+        except Exception as e:
+            logger.error(f"Error durante el procesamiento de la imagen: {str(e)}")
+            return None
+
+    def perform_ocr(self, image, timeout=0, psm=OCR_PSM, whitelist=None):
+        """
+        Realiza OCR en una imagen con el motor de Tesseract del worker y retorna el texto extraído.
+        La confianza media de las palabras se registra en las métricas de la página en curso.
+        Con `timeout` (segundos) el OCR se aborta si el motor lo permite. Lanza PipelineError si el
+        motor falla: una página sin leer no se confunde con una página sin texto.
+        """
+        try:
+            result = get_ocr_backend().image_to_data(image, timeout=timeout, psm=psm, whitelist=whitelist)
+        except Exception as e:
+            logger.exception(f"Error al realizar OCR: {str(e)}")
+            raise PipelineError(f"Error al realizar OCR: {str(e)}")
+
+        self.metrics.add_confidence(result.confidence)
+        return result.text
+
+    def convert_ocr_to_json(self, ocr_text, source="ocr", supplier=None):
+        """
+        Convierte el texto extraído a un JSON con el extractor de la comercializadora `supplier` (ya
+        identificada) o, si no se indica, la que se detecte en el texto.
+        `source` indica si el texto viene del OCR o de la capa de texto del PDF ("text_layer").
+        """
+        logger.info(f"Convirtiendo a JSON texto obtenido por '{source}'.")
+        return extract_invoice_data(ocr_text, supplier=supplier)
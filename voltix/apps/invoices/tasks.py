@@ -0,0 +1,43 @@
+import logging
+from celery import shared_task
+from django.conf import settings
+from apps.general.models import InvoiceProcessingJob
+from .checkpoints import discard_checkpoint
+from .processing import InvoiceProcessor, PipelineError
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def process_invoice_job(job_id):
+    """
+    Ejecuta el pipeline de OCR de una factura en un worker de Celery.
+    """
+    job = InvoiceProcessingJob.objects.select_related("user").filter(pk=job_id).first()
+    if not job:
+        logger.warning(f"Trabajo de factura {job_id} no encontrado.")
+        return
+
+    if InvoiceProcessor().process_job(job):
+        publish_invoice_image.delay(str(job.id))
+
+
+@shared_task(bind=True)
+def publish_invoice_image(self, job_id):
+    """
+    Publica en Cloudinary la imagen de la primera página de una factura ya guardada. Ante errores
+    de Cloudinary reintenta con espera exponencial; si se agotan los reintentos la factura se queda
+    sin imagen. Al terminar se elimina el PDF conservado.
+    """
+    job = InvoiceProcessingJob.objects.select_related("invoice").filter(pk=job_id).first()
+    if not job:
+        logger.warning(f"Trabajo de factura {job_id} no encontrado.")
+        return
+
+    try:
+        InvoiceProcessor().publish(job)
+    except PipelineError as e:
+        if e.resumable and self.request.retries < settings.INVOICE_PUBLISH_MAX_RETRIES:
+            raise self.retry(countdown=settings.INVOICE_PUBLISH_RETRY_DELAY * 2 ** self.request.retries)
+        logger.error(f"No se pudo publicar la imagen del trabajo {job.id}: {str(e)}")
+    discard_checkpoint(job)
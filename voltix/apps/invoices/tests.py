@@ -171,3 +171,1190 @@
 #         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 #         final_files = set(os.listdir(self.temp_folder)) if os.path.exists(self.temp_folder) else set()
 #         self.assertEqual(initial_files, final_files)  # Verifica que no hay nuevos archivos temporales
+
+
+import os
+from unittest import mock
+from django.test import TestCase
+from django.urls import reverse
+from django.core.files.uploadedfile import SimpleUploadedFile
+from rest_framework.test import APIClient
+from rest_framework import status
+from apps.general.models import User, InvoiceProcessingJob
+
+
+class InvoiceProcessingJobTests(TestCase):
+    """
+    Pruebas del flujo asíncrono de subida de facturas (202 + estado del trabajo).
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            dni="123456789", fullname="Test User", email="testuser@example.com", password="password123"
+        )
+        self.client.force_authenticate(user=self.user)
+        self.upload_url = reverse("invoice-upload")
+
+    def upload(self):
+        file = SimpleUploadedFile("factura.pdf", b"%PDF-1.4 test invoice pdf content", content_type="application/pdf")
+        return self.client.post(self.upload_url, {"file": file}, format="multipart")
+
+    @mock.patch("apps.invoices.views.process_invoice_job")
+    def test_upload_returns_job_id(self, mock_task):
+        response = self.upload()
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job = InvoiceProcessingJob.objects.get(pk=response.data["job_id"])
+        self.assertEqual(job.status, "pending")
+        self.assertTrue(os.path.exists(job.file_path))
+        mock_task.delay.assert_called_once_with(str(job.id))
+        os.remove(job.file_path)
+
+    def test_job_status_reports_result(self):
+        with mock.patch("apps.invoices.processing.InvoiceProcessor.process_job") as mock_process:
+            mock_process.side_effect = lambda job: job.mark_done({"nombre_cliente": "Test"}, "texto")
+            response = self.upload()
+
+        status_response = self.client.get(response.data["status_url"])
+
+        self.assertEqual(status_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(status_response.data["status"], "success")
+        self.assertEqual(status_response.data["progress"], 100)
+        self.assertEqual(status_response.data["parsed_data"], {"nombre_cliente": "Test"})
+        os.remove(InvoiceProcessingJob.objects.get(pk=response.data["job_id"]).file_path)
+
+    def test_job_of_other_user_is_not_visible(self):
+        other = User.objects.create_user(dni="987654321", fullname="Other", email="other@example.com", password="x")
+        job = InvoiceProcessingJob.objects.create(user=other, file_name="factura.pdf")
+
+        response = self.client.get(reverse("invoice-job-status", args=[job.id]))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+import shutil
+import tempfile
+import fitz
+from django.conf import settings
+from apps.invoices.processing import InvoiceProcessor
+from apps.invoices.tasks import process_invoice_job
+
+FACTURAS_DIR = os.path.join(settings.BASE_DIR.parent, "facturas")
+
+
+class InvoiceTextLayerTests(TestCase):
+    """
+    Pruebas de la extracción de texto embebido en PDF digitales (sin OCR).
+    """
+
+    def setUp(self):
+        self.processor = InvoiceProcessor()
+
+    def test_digital_pdf_uses_text_layer(self):
+        with fitz.open(os.path.join(FACTURAS_DIR, "endesa4.pdf")) as pdf_document:
+            text_layer = self.processor.extract_text_layer(pdf_document[1])
+
+        self.assertIsNotNone(text_layer)
+        self.assertIn("Titular del contrato", text_layer["text"])
+        self.assertTrue(all(len(word) == 5 for word in text_layer["words"]))
+
+    def test_scanned_pdf_falls_back_to_ocr(self):
+        with fitz.open(os.path.join(FACTURAS_DIR, "factura2.pdf")) as pdf_document:
+            self.assertIsNone(self.processor.extract_text_layer(pdf_document[0]))
+
+    def test_text_layer_feeds_supplier_extractors(self):
+        with fitz.open(os.path.join(FACTURAS_DIR, "endesa4.pdf")) as pdf_document:
+            text_layers = self.processor.extract_text_layers(pdf_document, range(2))
+        text = "\n".join(layer["text"] for layer in text_layers.values() if layer)
+
+        parsed_data = self.processor.convert_ocr_to_json(text, source="text_layer")
+
+        self.assertEqual(parsed_data["numero_referencia"], "012300620608/0015")
+        self.assertEqual(parsed_data["periodo_facturacion"]["inicio"], "2020-12-01")
+        self.assertEqual(parsed_data["desglose_cargos"]["total_a_pagar"], 436.36)
+
+    def test_pages_are_rendered_on_demand_within_budget(self):
+        with fitz.open(os.path.join(FACTURAS_DIR, "factura2.pdf")) as pdf_document:
+            pages = self.processor.iter_page_images(pdf_document, range(5), should_render=lambda n: n == 0)
+            page_number, pix = next(pages)
+            remaining = [page for _, page in pages]
+
+        self.assertEqual(page_number, 0)
+        self.assertLessEqual(pix.width * pix.height, settings.INVOICE_RENDER_MAX_PIXELS)
+        self.assertEqual(remaining, [None] * 4)
+
+    def test_pixmap_is_handed_to_opencv_without_png_round_trip(self):
+        with fitz.open(os.path.join(FACTURAS_DIR, "endesa4.pdf")) as pdf_document:
+            gray_pix = self.processor.render_page(pdf_document[0])
+            color_pix = self.processor.render_page(pdf_document[0], grayscale=False)
+
+        gray = self.processor.pixmap_to_array(gray_pix)
+        color = self.processor.pixmap_to_array(color_pix)
+
+        self.assertEqual(gray.shape, (gray_pix.height, gray_pix.width))
+        self.assertEqual(color.shape, (color_pix.height, color_pix.width, 3))
+        self.assertFalse(gray.flags.owndata)
+        self.assertEqual(self.processor.process_image(color).shape, gray.shape)
+
+    @mock.patch.object(InvoiceProcessor, "perform_ocr")
+    @mock.patch.object(InvoiceProcessor, "upload_page_image", return_value="https://example.com/factura.png")
+    def test_digital_invoice_job_skips_ocr(self, mock_upload, mock_ocr):
+        user = User.objects.create_user(dni="123456789", fullname="Test User", email="testuser@example.com", password="x")
+        file_path = os.path.join(tempfile.mkdtemp(), "endesa4.pdf")
+        shutil.copy(os.path.join(FACTURAS_DIR, "endesa4.pdf"), file_path)
+        job = InvoiceProcessingJob.objects.create(user=user, file_name="endesa4.pdf", file_path=file_path)
+
+        process_invoice_job(str(job.id))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, "success")
+        self.assertEqual(job.invoice.image_url, "https://example.com/factura.png")
+        self.assertEqual(job.result["numero_referencia"], "012300620608/0015")
+        mock_ocr.assert_not_called()
+        self.assertFalse(os.path.exists(file_path))
+
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.test import override_settings
+
+
+class InvoiceParallelOcrTests(TestCase):
+    def setUp(self):
+        self.processor = InvoiceProcessor()
+        self.job = mock.Mock()
+
+    def test_ocr_pages_are_reassembled_in_page_order(self):
+        def slow_ocr(image, timeout=0):
+            # La primera página termina la última
+            time.sleep(0.2 if image.sum() == 0 else 0)
+            return "pagina vacia" if image.sum() == 0 else "pagina con contenido"
+
+        pixmaps = [fitz.Pixmap(fitz.csGRAY, fitz.IRect(0, 0, 8, 8), False) for _ in range(2)]
+        pixmaps[0].clear_with(0)
+        pixmaps[1].clear_with(255)
+
+        with mock.patch.object(InvoiceProcessor, "process_image", side_effect=lambda image, profile=None: image), \
+                mock.patch.object(InvoiceProcessor, "perform_ocr", side_effect=slow_ocr):
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                futures = {n: executor.submit(self.processor.ocr_page, pix) for n, pix in enumerate(pixmaps)}
+                texts = self.processor.collect_page_texts(
+                    self.job, range(2), {0: None, 1: None}, futures, time.monotonic() + 5
+                )
+
+        self.assertEqual(texts, ["pagina vacia", "pagina con contenido"])
+
+    @override_settings(INVOICE_OCR_TIMEOUT=0, INVOICE_REJECT_UNKNOWN_SUPPLIER=False)
+    def test_ocr_timeout_fails_the_job(self):
+        user = User.objects.create_user(dni="123456789", fullname="Test User", email="testuser@example.com", password="x")
+        file_path = os.path.join(tempfile.mkdtemp(), "factura2.pdf")
+        shutil.copy(os.path.join(FACTURAS_DIR, "factura2.pdf"), file_path)
+        job = InvoiceProcessingJob.objects.create(user=user, file_name="factura2.pdf", file_path=file_path)
+
+        with mock.patch.object(InvoiceProcessor, "ocr_page", side_effect=lambda *args: time.sleep(0.5) or ""), \
+                mock.patch.object(InvoiceProcessor, "ocr_region", return_value=""), \
+                mock.patch.object(InvoiceProcessor, "upload_page_image", return_value=None):
+            self.processor.process_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, "error")
+        self.assertIn("tiempo máximo", job.error)
+
+
+import threading
+import numpy as np
+from apps.invoices import ocr
+from apps.invoices.processing import PipelineError
+
+
+class OcrBackendTests(TestCase):
+    def setUp(self):
+        ocr._backend = None
+        self.addCleanup(setattr, ocr, "_backend", None)
+
+    @override_settings(INVOICE_OCR_BACKEND="auto")
+    def test_auto_falls_back_to_pytesseract(self):
+        with mock.patch.object(ocr, "tesserocr", None):
+            backend = ocr.get_ocr_backend()
+
+        self.assertIsInstance(backend, ocr.PytesseractBackend)
+        self.assertIs(ocr.get_ocr_backend(), backend)
+
+    @override_settings(INVOICE_OCR_BACKEND="auto")
+    def test_tesserocr_init_failure_falls_back_to_pytesseract(self):
+        fake_tesserocr = mock.Mock()
+        fake_tesserocr.PyTessBaseAPI.side_effect = RuntimeError("Failed to init API, possibly an invalid tessdata path")
+
+        with mock.patch.object(ocr, "tesserocr", fake_tesserocr):
+            backend = ocr.get_ocr_backend()
+
+        self.assertIsInstance(backend, ocr.PytesseractBackend)
+
+    def test_ocr_failure_is_not_an_empty_page(self):
+        backend = mock.Mock()
+        backend.image_to_data.side_effect = RuntimeError("tesseract is not installed")
+
+        with mock.patch("apps.invoices.processing.get_ocr_backend", return_value=backend), \
+                self.assertLogs("apps.invoices.processing", level="ERROR"), \
+                self.assertRaises(PipelineError):
+            InvoiceProcessor().perform_ocr(np.zeros((4, 6), dtype=np.uint8))
+
+    @override_settings(INVOICE_OCR_BACKEND="auto")
+    def test_tesserocr_engines_outlive_the_threads_that_use_them(self):
+        fake_tesserocr = mock.Mock()
+        fake_tesserocr.PyTessBaseAPI.side_effect = lambda **kwargs: mock.Mock(
+            GetUTF8Text=mock.Mock(return_value="Endesa"), AllWordConfidences=mock.Mock(return_value=[90, 80])
+        )
+        image = np.zeros((4, 6), dtype=np.uint8)
+
+        with mock.patch.object(ocr, "tesserocr", fake_tesserocr):
+            backend = ocr.get_ocr_backend()
+            texts = [backend.image_to_string(image) for _ in range(3)]
+            # Los hilos de cada factura son nuevos, pero el motor sale del pool del proceso
+            for _ in range(2):
+                worker = threading.Thread(target=backend.image_to_string, args=(image,))
+                worker.start()
+                worker.join()
+            self.assertEqual(fake_tesserocr.PyTessBaseAPI.call_count, 1)
+            # Dos OCR simultáneos necesitan dos motores, que luego quedan en el pool
+            engines = [backend.checkout(), backend.checkout()]
+            for engine in engines:
+                backend.checkin(engine)
+            backend.image_to_string(image)
+
+        self.assertIsInstance(backend, ocr.TesserocrBackend)
+        self.assertEqual(texts, ["Endesa"] * 3)
+        self.assertEqual(fake_tesserocr.PyTessBaseAPI.call_count, 2)
+        fake_tesserocr.PyTessBaseAPI.assert_called_with(lang="spa", psm=11, oem=3)
+
+
+import hashlib
+from django.core.management import call_command
+from django.utils.timezone import now, timedelta
+from apps.general.models import Invoice, InvoiceExtractionCache
+from apps.invoices import cache
+
+
+class InvoiceExtractionCacheTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(dni="123456789", fullname="Test User", email="testuser@example.com", password="x")
+        self.client.force_authenticate(user=self.user)
+        self.pdf_bytes = b"%PDF-1.4 cached invoice pdf content"
+        self.parsed = {"nombre_cliente": "Test", "periodo_facturacion": {"inicio": "2024-01-01", "fin": "2024-01-31"}}
+
+    def upload(self):
+        file = SimpleUploadedFile("factura.pdf", self.pdf_bytes, content_type="application/pdf")
+        return self.client.post(reverse("invoice-upload"), {"file": file}, format="multipart")
+
+    @mock.patch("apps.invoices.views.process_invoice_job")
+    def test_reupload_is_served_from_cache(self, mock_task):
+        cache.store_result(hashlib.sha256(self.pdf_bytes).hexdigest(), self.parsed, "texto", "https://example.com/f.png")
+
+        response = self.upload()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["data"], self.parsed)
+        self.assertEqual(response.data["image_url"], "https://example.com/f.png")
+        invoice = Invoice.objects.get(pk=response.data["invoice_id"])
+        self.assertEqual(invoice.user, self.user)
+        job = InvoiceProcessingJob.objects.get(pk=response.data["job_id"])
+        self.assertEqual(job.status, "success")
+        self.assertFalse(os.path.exists(job.file_path))
+        mock_task.delay.assert_not_called()
+        self.assertEqual(InvoiceExtractionCache.objects.get().hits, 1)
+
+    @mock.patch("apps.invoices.views.process_invoice_job")
+    def test_other_pipeline_version_is_a_miss(self, mock_task):
+        cache.store_result(hashlib.sha256(self.pdf_bytes).hexdigest(), self.parsed, "texto", None)
+
+        with mock.patch.object(cache, "PIPELINE_VERSION", "999"):
+            response = self.upload()
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        os.remove(InvoiceProcessingJob.objects.get(pk=response.data["job_id"]).file_path)
+
+    @mock.patch("apps.invoices.views.process_invoice_job")
+    def test_entry_without_published_image_is_a_miss(self, mock_task):
+        cache.store_result(hashlib.sha256(self.pdf_bytes).hexdigest(), self.parsed, "texto", None)
+
+        response = self.upload()
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        mock_task.delay.assert_called_once()
+        self.assertEqual(InvoiceExtractionCache.objects.get().hits, 0)
+        os.remove(InvoiceProcessingJob.objects.get(pk=response.data["job_id"]).file_path)
+
+    @override_settings(INVOICE_CACHE_TTL_DAYS=30, INVOICE_CACHE_MAX_ENTRIES=2)
+    def test_janitor_applies_ttl_and_lru(self):
+        for index in range(4):
+            cache.store_result(f"{index:064d}", self.parsed, "", None)
+        InvoiceExtractionCache.objects.filter(content_hash=f"{0:064d}").update(last_used_at=now() - timedelta(days=31))
+        InvoiceExtractionCache.objects.filter(content_hash=f"{1:064d}").update(last_used_at=now() - timedelta(days=1))
+
+        call_command("clean_invoice_cache", stdout=open(os.devnull, "w"))
+
+        self.assertEqual(
+            sorted(InvoiceExtractionCache.objects.values_list("content_hash", flat=True)),
+            [f"{2:064d}", f"{3:064d}"],
+        )
+
+
+class PreprocessingProfileTests(TestCase):
+    def setUp(self):
+        self.processor = InvoiceProcessor()
+        # Página sintética: fondo blanco con bloques de "texto" negro
+        self.page = np.full((400, 300), 255, dtype=np.uint8)
+        self.page[40:360:20, 30:270] = 0
+
+    def test_clean_page_uses_fast_profile(self):
+        self.assertEqual(self.processor.select_profile(self.page), "fast")
+
+    def test_noisy_page_uses_heavy_profile(self):
+        noise = np.random.default_rng(0).normal(0, 25, self.page.shape)
+        noisy_page = np.clip(self.page + noise, 0, 255).astype(np.uint8)
+
+        self.assertEqual(self.processor.select_profile(noisy_page), "heavy")
+
+    def test_profiles_return_grayscale_images(self):
+        for profile in ("fast", "standard", "heavy"):
+            processed = self.processor.process_image(self.page, profile=profile)
+            self.assertEqual(processed.shape, self.page.shape)
+
+    @override_settings(INVOICE_REJECT_UNKNOWN_SUPPLIER=False)
+    def test_missing_required_fields_escalate_profile(self):
+        user = User.objects.create_user(dni="123456789", fullname="Test User", email="testuser@example.com", password="x")
+        file_path = os.path.join(tempfile.mkdtemp(), "factura2.pdf")
+        shutil.copy(os.path.join(FACTURAS_DIR, "factura2.pdf"), file_path)
+        job = InvoiceProcessingJob.objects.create(user=user, file_name="factura2.pdf", file_path=file_path)
+        complete = {"periodo_facturacion": {"inicio": "2024-01-01", "fin": "2024-01-31"}, "desglose_cargos": {"total_a_pagar": 50.0}}
+        incomplete = {"periodo_facturacion": {"inicio": None, "fin": None}, "desglose_cargos": {"total_a_pagar": None}}
+        profiles_used = []
+
+        def fake_ocr(pix, profile=None, regions=None, prefix=""):
+            profiles_used.append(profile)
+            return profile
+
+        with mock.patch.object(InvoiceProcessor, "select_profile", return_value="fast"), \
+                mock.patch.object(InvoiceProcessor, "ocr_region", return_value=""), \
+                mock.patch.object(InvoiceProcessor, "ocr_page", side_effect=fake_ocr), \
+                mock.patch.object(InvoiceProcessor, "upload_page_image", return_value=None), \
+                mock.patch.object(InvoiceProcessor, "convert_ocr_to_json",
+                                  side_effect=lambda text, source="ocr", supplier=None: complete if "standard" in text else incomplete):
+            self.processor.process_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, "success")
+        self.assertEqual(profiles_used, ["fast", "fast", "standard", "standard"])
+
+    def test_unusable_text_layer_falls_back_to_ocr(self):
+        user = User.objects.create_user(dni="123456789", fullname="Test User", email="testuser@example.com", password="x")
+        file_path = os.path.join(tempfile.mkdtemp(), "factura3.pdf")
+        shutil.copy(os.path.join(FACTURAS_DIR, "factura3.pdf"), file_path)
+        job = InvoiceProcessingJob.objects.create(user=user, file_name="factura3.pdf", file_path=file_path)
+        complete = {"periodo_facturacion": {"inicio": "2018-05-08", "fin": "2018-06-10"}, "desglose_cargos": {"total_a_pagar": 80.95}}
+        incomplete = {"periodo_facturacion": {"inicio": None, "fin": None}, "desglose_cargos": {"total_a_pagar": 80.95}}
+        ocr_pages = []
+
+        def fake_ocr(page_number, request):
+            ocr_pages.append(page_number)
+            return "ocr"
+
+        with mock.patch.object(InvoiceProcessor, "run_ocr_request", side_effect=fake_ocr), \
+                mock.patch.object(InvoiceProcessor, "convert_ocr_to_json",
+                                  side_effect=lambda text, source="ocr", supplier=None: complete if source == "ocr" else incomplete):
+            self.processor.process_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, "success")
+        self.assertEqual(job.invoice.billing_period_start.isoformat(), "2018-05-08")
+        self.assertEqual(sorted(ocr_pages), [0, 1])
+
+    def test_missing_billing_period_fails_the_job(self):
+        user = User.objects.create_user(dni="123456789", fullname="Test User", email="testuser@example.com", password="x")
+        file_path = os.path.join(tempfile.mkdtemp(), "factura3.pdf")
+        shutil.copy(os.path.join(FACTURAS_DIR, "factura3.pdf"), file_path)
+        job = InvoiceProcessingJob.objects.create(user=user, file_name="factura3.pdf", file_path=file_path)
+        incomplete = {"periodo_facturacion": {"inicio": None, "fin": None}, "desglose_cargos": {"total_a_pagar": 80.95}}
+
+        with mock.patch.object(InvoiceProcessor, "run_ocr_request", return_value=""), \
+                mock.patch.object(InvoiceProcessor, "convert_ocr_to_json", return_value=incomplete):
+            self.processor.process_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, "error")
+        self.assertIn("periodo de facturación", job.error)
+        self.assertFalse(Invoice.objects.exists())
+
+
+
+from apps.invoices.extractors import detect_supplier
+from apps.invoices.layouts import SUPPLIER_LAYOUTS, HEADER_REGION
+
+
+class RegionOcrTests(TestCase):
+    """
+    Comprueba que las zonas de cada plantilla contienen los campos que leen los extractores, usando
+    la capa de texto de los PDF de ejemplo como si fuera el resultado del OCR de cada zona.
+    """
+
+    def setUp(self):
+        self.processor = InvoiceProcessor()
+
+    def region_text_from_layer(self, page, region):
+        x0, y0, x1, y1 = region["bbox"]
+        width, height = page.rect.width, page.rect.height
+        words = [
+            word for word in page.get_text("words", sort=True)
+            if x0 * width <= (word[0] + word[2]) / 2 <= x1 * width and y0 * height <= (word[1] + word[3]) / 2 <= y1 * height
+        ]
+        return self.processor.words_to_ocr_layout(words)
+
+    def extract_with_layout(self, file_name):
+        with fitz.open(os.path.join(FACTURAS_DIR, file_name)) as pdf_document:
+            header = self.region_text_from_layer(pdf_document[0], HEADER_REGION)
+            supplier = detect_supplier(header)
+            texts = [header]
+            for page_number in range(2):
+                for region in self.processor.layout_regions(supplier, page_number):
+                    texts.append(self.region_text_from_layer(pdf_document[page_number], region))
+        return supplier, self.processor.convert_ocr_to_json("\n\n".join(texts))
+
+    def test_endesa_regions_cover_required_fields(self):
+        supplier, parsed = self.extract_with_layout("endesa4.pdf")
+
+        self.assertEqual(supplier, "endesa")
+        self.assertFalse(self.processor.missing_required_fields(parsed))
+        self.assertEqual(parsed["numero_referencia"], "012300620608/0015")
+        self.assertEqual(parsed["desglose_cargos"]["total_a_pagar"], 436.36)
+
+    def test_iberdrola_regions_cover_charges(self):
+        supplier, parsed = self.extract_with_layout("factura3.pdf")
+
+        self.assertEqual(supplier, "iberdrola")
+        self.assertEqual(parsed["desglose_cargos"]["total_a_pagar"], 80.95)
+
+    def test_regions_are_a_fraction_of_the_page(self):
+        for layout in SUPPLIER_LAYOUTS.values():
+            area = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in (region["bbox"] for region in layout["regions"]))
+            self.assertLess(area, 0.5 * 2)  # Menos de la mitad de las dos páginas leídas
+
+    def test_page_without_regions_is_skipped(self):
+        pix = fitz.Pixmap(fitz.csGRAY, fitz.IRect(0, 0, 8, 8), False)
+
+        with mock.patch.object(InvoiceProcessor, "perform_ocr") as mock_ocr:
+            text = self.processor.ocr_page(pix, "fast", regions=[], prefix="")
+
+        self.assertEqual(text, "")
+        mock_ocr.assert_not_called()
+
+
+from apps.invoices.extractors import detect_supplier as detect_extractor_supplier, extract_invoice_data, get_extractor
+from apps.invoices.extractors.normalizers import parse_es_number, spanish_date, to_iso_date
+
+
+class ExtractorRegistryTests(TestCase):
+    def test_detection_follows_registration_order(self):
+        self.assertEqual(detect_extractor_supplier("ENDESA ... Distribuidora: E-DISTRIBUCIÓN"), "endesa")
+        self.assertEqual(detect_extractor_supplier("Lidera Comercializadora Energia S.L."), "lidera")
+        self.assertIsNone(detect_extractor_supplier("factura sin comercializadora"))
+
+    def test_unknown_supplier_returns_error(self):
+        self.assertEqual(extract_invoice_data("nada"), {"error": "No se reconoció ninguna comercializadora en el OCR."})
+
+    def test_endesa_consumo_total_is_read_from_the_invoice(self):
+        with fitz.open(os.path.join(FACTURAS_DIR, "endesa4.pdf")) as pdf_document:
+            text = InvoiceProcessor().extract_text_layer(pdf_document[0])["text"]
+
+        parsed = get_extractor("endesa").extract(text)
+
+        self.assertEqual(parsed["detalles_consumo"]["consumo_total"], 213.0)
+        self.assertEqual(parsed["periodo_facturacion"], {"inicio": "2020-12-01", "fin": "2020-12-22", "dias": 21})
+
+    def test_iberdrola_previous_layout(self):
+        with fitz.open(os.path.join(FACTURAS_DIR, "factura3.pdf")) as pdf_document:
+            text = InvoiceProcessor().extract_text_layer(pdf_document[0])["text"]
+
+        parsed = get_extractor("iberdrola").extract(text)
+
+        self.assertEqual(parsed["periodo_facturacion"]["inicio"], "2018-05-08")
+        self.assertEqual(parsed["periodo_facturacion"]["fin"], "2018-06-10")
+        self.assertEqual(parsed["numero_referencia"], "443598368")
+        self.assertEqual(parsed["desglose_cargos"]["total_a_pagar"], 80.95)
+
+    def test_normalizers(self):
+        self.assertEqual(parse_es_number("1.112,537"), 1112.537)
+        self.assertEqual(parse_es_number("1,112,537"), 1112.537)
+        self.assertEqual(parse_es_number("436,36"), 436.36)
+        self.assertEqual(to_iso_date("04/01/2021"), "2021-01-04")
+        self.assertIsNone(to_iso_date("31/02/2021"))
+        self.assertEqual(spanish_date("4", "Enero", "2021"), "2021-01-04")
+
+
+from apps.invoices import fingerprints
+
+
+class SupplierFingerprintTests(TestCase):
+    def setUp(self):
+        self.processor = InvoiceProcessor()
+
+    def first_page(self, file_name, zoom=None):
+        with fitz.open(os.path.join(FACTURAS_DIR, file_name)) as pdf_document:
+            page = pdf_document[0]
+            if zoom:
+                pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY)
+            else:
+                pix = self.processor.render_page(page, grayscale=False)
+        return self.processor.pixmap_to_array(pix).copy()
+
+    def test_known_layouts_are_matched_at_any_resolution(self):
+        self.assertEqual(fingerprints.match_supplier(self.first_page("endesa4.pdf"))[0], "endesa")
+        self.assertEqual(fingerprints.match_supplier(self.first_page("endesa4.pdf", zoom=1))[0], "endesa")
+        self.assertEqual(fingerprints.match_supplier(self.first_page("factura3.pdf", zoom=1))[0], "iberdrola")
+
+    def test_unknown_layout_is_not_matched(self):
+        self.assertEqual(fingerprints.match_supplier(self.first_page("factura2.pdf", zoom=0.25)), (None, None))
+
+    def test_text_layer_is_the_fallback(self):
+        blank = np.full((200, 100), 255, dtype=np.uint8)
+        text_layers = {0: {"text": "Lidera Comercializadora Energia S.L.", "words": []}}
+
+        self.assertEqual(self.processor.identify_supplier(blank, text_layers), "lidera")
+        self.assertIsNone(self.processor.identify_supplier(blank, {0: None}))
+
+    def scanned_job(self):
+        user = User.objects.create_user(dni="123456789", fullname="Test User", email="testuser@example.com", password="x")
+        file_path = os.path.join(tempfile.mkdtemp(), "factura2.pdf")
+        shutil.copy(os.path.join(FACTURAS_DIR, "factura2.pdf"), file_path)
+        return InvoiceProcessingJob.objects.create(user=user, file_name="factura2.pdf", file_path=file_path)
+
+    @override_settings(INVOICE_REJECT_UNKNOWN_SUPPLIER=True)
+    def test_unsupported_invoice_is_rejected_after_the_first_page(self):
+        job = self.scanned_job()
+
+        # Ni la cabecera ni la primera página escaneadas nombran una comercializadora soportada
+        with mock.patch.object(InvoiceProcessor, "ocr_page", return_value="factura") as mock_ocr_page, \
+                mock.patch.object(InvoiceProcessor, "ocr_region", return_value=""), \
+                mock.patch.object(InvoiceProcessor, "upload_page_image") as mock_upload:
+            self.processor.process_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, "error")
+        self.assertIn("comercializadora", job.error)
+        mock_ocr_page.assert_called_once()
+        mock_upload.assert_not_called()
+
+    @override_settings(INVOICE_REJECT_UNKNOWN_SUPPLIER=True)
+    def test_supplier_outside_the_header_is_not_rejected(self):
+        job = self.scanned_job()
+        parsed = {"periodo_facturacion": {"inicio": "2024-01-01", "fin": "2024-01-31"}, "desglose_cargos": {"total_a_pagar": 50.0}}
+
+        with mock.patch.object(InvoiceProcessor, "ocr_page", return_value="Lidera Comercializadora Energia S.L.") as mock_ocr_page, \
+                mock.patch.object(InvoiceProcessor, "ocr_region", return_value=""), \
+                mock.patch.object(InvoiceProcessor, "convert_ocr_to_json", return_value=parsed) as mock_extract, \
+                mock.patch.object(InvoiceProcessor, "upload_page_image", return_value=None):
+            self.processor.process_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, "success")
+        self.assertEqual(mock_extract.call_args.kwargs["supplier"], "lidera")
+        # El OCR de la primera página que identificó la comercializadora no se repite
+        self.assertEqual(mock_ocr_page.call_count, settings.INVOICE_MAX_PAGES)
+
+
+from apps.invoices import benchmark
+
+
+class InvoiceBenchmarkTests(TestCase):
+    def test_report_has_stage_metrics_and_accuracy(self):
+        report = benchmark.run_benchmark([os.path.join(FACTURAS_DIR, "2.0TD ENDESA.pdf")])
+
+        document = report["documents"]["2.0TD ENDESA.pdf"]
+        self.assertEqual(document["supplier"], "endesa")
+        self.assertEqual(set(document["stages"]), set(benchmark.STAGES))
+        self.assertGreater(document["stages"]["render"]["wall_ms"], 0)
+        self.assertEqual(document["accuracy"]["matched"], document["accuracy"]["total"])
+        self.assertEqual(report["summary"]["accuracy"], 1.0)
+
+    def test_field_accuracy_tolerates_rounding(self):
+        expected = {"numero_referencia": "123", "desglose_cargos": {"total_a_pagar": 10.0, "impuestos": 2.0}}
+        actual = {"numero_referencia": "123", "desglose_cargos": {"total_a_pagar": 10.004, "impuestos": None}}
+
+        score = benchmark.field_accuracy(expected, actual)
+
+        self.assertEqual((score["matched"], score["total"]), (2, 3))
+        self.assertEqual(score["mismatches"][0]["field"], "desglose_cargos.impuestos")
+
+    def test_compare_flags_slowdowns_and_accuracy_drops(self):
+        def report(ocr_ms, accuracy):
+            stages = {stage: {"wall_ms": 100.0, "cpu_ms": 100.0, "peak_rss_mb": 50.0} for stage in benchmark.STAGES}
+            stages["ocr"]["wall_ms"] = ocr_ms
+            return {"documents": {}, "summary": {"stages": stages, "accuracy": accuracy}}
+
+        rows = benchmark.compare_reports(report(100.0, 0.9), report(150.0, 0.8), max_slowdown=0.10)
+        regressions = {(name, metric) for name, metric, _, _, regression in rows if regression}
+
+        self.assertEqual(regressions, {("ocr", "wall_ms"), ("total", "accuracy")})
+
+
+from apps.invoices.metrics import stage_histograms
+
+
+class InvoiceMetricsTests(TestCase):
+    def setUp(self):
+        self.processor = InvoiceProcessor()
+        self.user = User.objects.create_user(dni="123456789", fullname="Test User", email="testuser@example.com", password="x")
+
+    @mock.patch.object(InvoiceProcessor, "upload_page_image", return_value="https://example.com/factura.png")
+    def test_stage_timings_are_stored_with_the_invoice(self, mock_upload):
+        file_path = os.path.join(tempfile.mkdtemp(), "endesa4.pdf")
+        shutil.copy(os.path.join(FACTURAS_DIR, "endesa4.pdf"), file_path)
+        job = InvoiceProcessingJob.objects.create(
+            user=self.user, file_name="endesa4.pdf", file_path=file_path, metrics={"stages_ms": {"save": 1.5}}
+        )
+
+        process_invoice_job(str(job.id))
+
+        invoice = Invoice.objects.get(user=self.user)
+        self.assertEqual(invoice.processing_metrics["supplier"], "endesa")
+        self.assertEqual(invoice.processing_metrics["pages"], 3)
+        self.assertEqual(invoice.processing_metrics["stages_ms"]["save"], 1.5)
+        self.assertTrue(
+            {"text_layer", "render", "identify", "extract", "publish", "persist"} <= set(invoice.processing_metrics["stages_ms"])
+        )
+        self.assertIsNone(invoice.ocr_confidence)  # PDF digital: sin OCR
+
+    def test_ocr_confidence_is_recorded_per_page(self):
+        backend = mock.Mock()
+        backend.image_to_data.side_effect = [ocr.OcrResult("uno", 90.0), ocr.OcrResult("dos", 60.0)]
+        pix = fitz.Pixmap(fitz.csGRAY, fitz.IRect(0, 0, 8, 8), False)
+
+        with mock.patch("apps.invoices.processing.get_ocr_backend", return_value=backend), \
+                mock.patch.object(InvoiceProcessor, "process_image", side_effect=lambda image, profile=None: image):
+            texts = [self.processor.run_ocr_request(n, (pix, "fast", None, "")) for n in (0, 1)]
+
+        self.assertEqual(texts, ["uno", "dos"])
+        self.assertEqual(self.processor.metrics.as_dict()["ocr_confidence"], {"0": 90.0, "1": 60.0})
+        self.assertEqual(self.processor.metrics.mean_confidence(), 75.0)
+
+    def test_pytesseract_data_keeps_the_text_layout(self):
+        data = {
+            "block_num": [1, 1, 1, 2, 2], "par_num": [1, 1, 1, 1, 1], "line_num": [1, 1, 1, 1, 1],
+            "text": ["", "Total", "80,95", "", "Endesa"], "conf": ["-1", "91", "85", "-1", "70"],
+        }
+
+        self.assertEqual(ocr.PytesseractBackend.tsv_to_text(None, data), "Total 80,95\n\nEndesa\n\n")
+        self.assertAlmostEqual(ocr.mean_confidence(data["conf"]), 82.0)
+
+    def test_histograms_are_labelled_by_supplier_and_pages(self):
+        for elapsed_ms in (40, 900):
+            Invoice.objects.create(
+                user=self.user, billing_period_start="2024-01-01", billing_period_end="2024-01-31", data={},
+                processing_metrics={"supplier": "endesa", "pages": 3, "stages_ms": {"ocr": elapsed_ms}},
+            )
+
+        histogram = stage_histograms(Invoice.objects.all())[("ocr", "endesa", 3)]
+
+        self.assertEqual(histogram["count"], 2)
+        self.assertEqual(histogram["sum_ms"], 940)
+        self.assertEqual(histogram["buckets"][:7], [0, 0, 1, 1, 1, 1, 2])
+
+    def test_metrics_endpoint_is_admin_only(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        self.assertEqual(client.get(reverse("invoice-metrics")).status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        response = client.get(reverse("invoice-metrics"), {"output": "prometheus"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("voltix_invoice_stage_duration_seconds", response.content.decode())
+
+
+from apps.invoices import admission
+
+
+@override_settings(INVOICE_ADMISSION_MAX_JOBS=3, INVOICE_ADMISSION_MAX_JOBS_PER_USER=1, INVOICE_ADMISSION_RETRY_AFTER=15)
+class AdmissionControlTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(dni="123456789", fullname="Test User", email="testuser@example.com", password="x")
+        self.client.force_authenticate(user=self.user)
+        self.other = User.objects.create_user(dni="987654321", fullname="Other", email="other@example.com", password="x")
+
+    def upload(self):
+        file = SimpleUploadedFile("factura.pdf", b"%PDF-1.4 test invoice pdf content", content_type="application/pdf")
+        return self.client.post(reverse("invoice-upload"), {"file": file}, format="multipart")
+
+    @mock.patch("apps.invoices.views.process_invoice_job")
+    def test_user_limit_fails_fast_with_retry_after(self, mock_task):
+        InvoiceProcessingJob.objects.create(user=self.user, file_name="otra.pdf", status="processing")
+
+        response = self.upload()
+
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response["Retry-After"], "15")
+        self.assertEqual(response.data["queue_depth"], 1)
+        self.assertEqual(InvoiceProcessingJob.objects.filter(user=self.user).count(), 1)  # No se crea el trabajo
+        mock_task.delay.assert_not_called()
+
+    @mock.patch("apps.invoices.views.process_invoice_job")
+    def test_global_limit_counts_every_user(self, mock_task):
+        for _ in range(3):
+            InvoiceProcessingJob.objects.create(user=self.other, file_name="otra.pdf", status="pending")
+
+        response = self.upload()
+
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response.data["queue_depth"], 3)
+
+    @mock.patch("apps.invoices.views.process_invoice_job")
+    def test_admitted_upload_reports_queue_depth(self, mock_task):
+        InvoiceProcessingJob.objects.create(user=self.other, file_name="otra.pdf", status="pending")
+
+        response = self.upload()
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data["queue_depth"], 2)
+        os.remove(InvoiceProcessingJob.objects.get(pk=response.data["job_id"]).file_path)
+
+        queue = self.client.get(reverse("invoice-queue"))
+        self.assertEqual((queue.data["queue_depth"], queue.data["user_in_flight"]), (2, 1))
+
+    def test_redis_slots_are_reserved_atomically_and_released(self):
+        client = mock.Mock()
+        client.eval.return_value = [-1, 5, 1]
+        job = InvoiceProcessingJob.objects.create(user=self.user, file_name="factura.pdf")
+
+        with mock.patch.object(admission, "get_redis", return_value=client):
+            result = admission.acquire(job)
+            InvoiceProcessor().process_job(job)  # Sin archivo: falla, pero libera la plaza
+
+        self.assertEqual(result, admission.Admission(False, "user", 5, 1, 15))
+        self.assertEqual(client.eval.call_args.args[2:4], (admission.GLOBAL_KEY, f"voltix:invoices:ocr:inflight:user:{self.user.pk}"))
+        client.pipeline.return_value.zrem.assert_any_call(admission.GLOBAL_KEY, str(job.id))
+
+    def test_worker_renews_the_slot_when_it_starts_the_job(self):
+        client = mock.Mock()
+        job = InvoiceProcessingJob.objects.create(user=self.user, file_name="factura.pdf")
+
+        with mock.patch.object(admission, "get_redis", return_value=client), mock.patch.object(admission.time, "time", return_value=1000.0):
+            InvoiceProcessor().process_job(job)
+
+        pipeline = client.pipeline.return_value
+        pipeline.zadd.assert_any_call(admission.GLOBAL_KEY, {str(job.id): 1000.0})
+        pipeline.zadd.assert_any_call(f"voltix:invoices:ocr:inflight:user:{self.user.pk}", {str(job.id): 1000.0})
+        # La renovación va antes que la liberación
+        calls = [call[0] for call in pipeline.mock_calls]
+        self.assertLess(calls.index("zadd"), calls.index("zrem"))
+
+    def test_redis_failure_admits_the_upload(self):
+        client = mock.Mock()
+        client.eval.side_effect = ConnectionError("redis caído")
+        job = InvoiceProcessingJob.objects.create(user=self.user, file_name="factura.pdf")
+
+        with mock.patch.object(admission, "get_redis", return_value=client):
+            self.assertTrue(admission.acquire(job).admitted)
+
+
+from apps.invoices.checkpoints import expire_checkpoints
+
+
+class PipelineCheckpointTests(TestCase):
+    def setUp(self):
+        self.processor = InvoiceProcessor()
+        self.user = User.objects.create_user(dni="123456789", fullname="Test User", email="testuser@example.com", password="x")
+        self.file_path = os.path.join(tempfile.mkdtemp(), "endesa4.pdf")
+        shutil.copy(os.path.join(FACTURAS_DIR, "endesa4.pdf"), self.file_path)
+        self.job = InvoiceProcessingJob.objects.create(user=self.user, file_name="endesa4.pdf", file_path=self.file_path)
+
+    def test_persist_retry_reuses_every_checkpoint(self):
+        self.job.save_checkpoint(
+            ocr={"text": "texto", "source": "text_layer", "supplier": "endesa", "page_count": 3},
+            extract={"parsed_data": {"numero_factura": "X1"}},
+        )
+
+        with mock.patch.object(InvoiceProcessor, "persist_invoice", return_value=True) as mock_persist, \
+                mock.patch.object(InvoiceProcessor, "extract_text_layers") as mock_text_layers, \
+                mock.patch.object(InvoiceProcessor, "convert_ocr_to_json") as mock_extract:
+            self.assertTrue(self.processor.process_job(self.job))
+
+        mock_text_layers.assert_not_called()
+        mock_extract.assert_not_called()
+        self.assertEqual(mock_persist.call_args.args[1:4], ({"numero_factura": "X1"}, "texto", None))
+
+    def test_extraction_retry_reuses_the_ocr_checkpoint(self):
+        self.job.save_checkpoint(ocr={"text": "texto", "source": "ocr", "supplier": "endesa", "page_count": 3})
+        parsed = {"numero_factura": "X1"}
+
+        with mock.patch.object(InvoiceProcessor, "persist_invoice", return_value=True) as mock_persist, \
+                mock.patch.object(InvoiceProcessor, "extract_text_layers") as mock_text_layers, \
+                mock.patch.object(InvoiceProcessor, "convert_ocr_to_json", return_value=parsed) as mock_extract:
+            self.assertTrue(self.processor.process_job(self.job))
+
+        mock_text_layers.assert_not_called()
+        mock_extract.assert_called_once_with("texto", source="ocr", supplier="endesa")
+        self.assertEqual(mock_persist.call_args.args[1:4], (parsed, "texto", None))
+
+    def test_unsupported_invoice_is_not_resumable(self):
+        with override_settings(INVOICE_REJECT_UNKNOWN_SUPPLIER=True), \
+                mock.patch.object(InvoiceProcessor, "identify_supplier", return_value=None):
+            self.processor.process_job(self.job)
+
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, "error")
+        self.assertFalse(os.path.exists(self.file_path))
+
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        response = client.post(reverse("invoice-job-retry", args=[self.job.id]))
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    @mock.patch("apps.invoices.views.process_invoice_job")
+    def test_retry_endpoint_requeues_the_job(self, mock_task):
+        self.job.mark_failed("Error al subir la imagen: Cloudinary caído")
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+
+        response = client.post(reverse("invoice-job-retry", args=[self.job.id]))
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        mock_task.delay.assert_called_once_with(str(self.job.id))
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.error), ("pending", ""))
+
+    def test_expired_checkpoints_and_orphan_files_are_removed(self):
+        self.job.mark_failed("Error al subir la imagen: Cloudinary caído")
+        self.job.save_checkpoint(ocr={"text": "texto"})
+        temp_folder = tempfile.mkdtemp()
+        orphan = os.path.join(temp_folder, "huerfano.pdf")
+        open(orphan, "wb").close()
+        old = time.time() - 48 * 3600
+        os.utime(orphan, (old, old))
+        InvoiceProcessingJob.objects.filter(pk=self.job.pk).update(updated_at=now() - timedelta(hours=48))
+
+        with override_settings(FILE_UPLOAD_TEMP_DIR=temp_folder, INVOICE_CHECKPOINT_TTL_HOURS=24):
+            self.assertEqual(expire_checkpoints(), 2)
+
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.checkpoint, {})
+        self.assertFalse(os.path.exists(self.file_path))
+        self.assertFalse(os.path.exists(orphan))
+
+    def test_discarded_jobs_are_not_expired_again(self):
+        self.job.mark_failed("Error al subir la imagen: Cloudinary caído")
+        self.job.save_checkpoint(ocr={"text": "texto"})
+        InvoiceProcessingJob.objects.filter(pk=self.job.pk).update(updated_at=now() - timedelta(hours=48))
+
+        with override_settings(FILE_UPLOAD_TEMP_DIR=tempfile.mkdtemp(), INVOICE_CHECKPOINT_TTL_HOURS=24):
+            self.assertEqual(expire_checkpoints(), 1)
+            # Aunque vuelva a estar fuera de plazo, el trabajo ya no tiene PDF ni checkpoints
+            InvoiceProcessingJob.objects.filter(pk=self.job.pk).update(updated_at=now() - timedelta(hours=48))
+            self.assertEqual(expire_checkpoints(), 0)
+
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.file_path, self.job.checkpoint), ("", {}))
+
+
+import re
+from functools import partial
+from apps.invoices import extractor_benchmark
+from apps.invoices.extractors import iberdrola
+
+
+class ExtractorBenchmarkTests(TestCase):
+    def test_golden_corpus_matches_expected_json(self):
+        corpus = extractor_benchmark.load_corpus(extractor_benchmark.default_corpus_dir())
+        documents, suppliers = extractor_benchmark.run_throughput(corpus, repeat=3)
+
+        self.assertTrue({"endesa", "iberdrola", "lidera", "naturgy", "edistribucion"} <= set(suppliers))
+        # Los textos de las facturas de ejemplo se comparan con los mismos JSON esperados que el benchmark del pipeline
+        scored = {name for name, document in documents.items() if document["accuracy"]}
+        self.assertTrue({"2.0TD ENDESA", "endesa4", "factura3", "lidera_sintetica"} <= scored)
+        for name in scored:
+            self.assertEqual(documents[name]["accuracy"]["mismatches"], [], name)
+        self.assertGreater(suppliers["endesa"]["parses_per_second"], 0)
+        self.assertGreaterEqual(suppliers["endesa"]["p99_ms"], suppliers["endesa"]["p50_ms"])
+
+    def test_catastrophic_pattern_is_timed_out(self):
+        pattern = re.compile(r"(a+)+$")
+
+        timings_ms = extractor_benchmark.time_calls(
+            partial(extractor_benchmark.scan_pattern, pattern), ["a" * 10 + "b", "a" * 40 + "b"], timeout=0.5
+        )
+
+        self.assertIsNotNone(timings_ms[0])
+        self.assertEqual(extractor_benchmark.classify(timings_ms), (None, "timeout"))
+
+    def test_iberdrola_client_name_pattern_is_linear(self):
+        texts = [extractor_benchmark.uppercase_lines("", size) for size in (20000, 80000)]
+
+        timings_ms = extractor_benchmark.time_calls(
+            partial(extractor_benchmark.scan_pattern, iberdrola.NOMBRE_CLIENTE_RE), texts, timeout=2.0
+        )
+
+        self.assertIsNone(extractor_benchmark.classify(timings_ms)[1])
+
+
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from apps.invoices.checkpoints import store_upload
+
+
+class UploadStorageTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(dni="123456789", fullname="Test User", email="testuser@example.com", password="x")
+        self.client.force_authenticate(user=self.user)
+        self.temp_folder = tempfile.mkdtemp()
+        self.pdf_bytes = b"%PDF-1.4 test invoice pdf content"
+
+    def upload(self, pdf_bytes=None):
+        file = SimpleUploadedFile("factura.pdf", pdf_bytes or self.pdf_bytes, content_type="application/pdf")
+        with override_settings(FILE_UPLOAD_TEMP_DIR=self.temp_folder):
+            return self.client.post(reverse("invoice-upload"), {"file": file}, format="multipart")
+
+    @mock.patch("apps.invoices.views.process_invoice_job")
+    def test_cache_hits_and_rejections_never_touch_the_disk(self, mock_task):
+        parsed = {"nombre_cliente": "Test", "periodo_facturacion": {"inicio": "2024-01-01", "fin": "2024-01-31"}}
+        cache.store_result(hashlib.sha256(self.pdf_bytes).hexdigest(), parsed, "texto", "https://example.com/f.png")
+        self.assertEqual(self.upload().status_code, status.HTTP_200_OK)
+
+        InvoiceExtractionCache.objects.all().delete()
+        Invoice.objects.all().delete()
+        with override_settings(INVOICE_ADMISSION_MAX_JOBS=0):
+            self.assertEqual(self.upload().status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+        self.assertEqual(os.listdir(self.temp_folder), [])
+
+    @mock.patch("apps.invoices.views.process_invoice_job")
+    def test_same_file_name_gets_a_file_per_job(self, mock_task):
+        first, second = self.upload(), self.upload(b"%PDF-1.4 another invoice pdf content")
+
+        paths = {InvoiceProcessingJob.objects.get(pk=response.data["job_id"]).file_path for response in (first, second)}
+        self.assertEqual(len(paths), 2)
+        self.assertEqual(sorted(os.listdir(self.temp_folder)), sorted(os.path.basename(path) for path in paths))
+
+    def test_spooled_upload_is_moved_not_copied(self):
+        job = InvoiceProcessingJob.objects.create(user=self.user, file_name="factura.pdf")
+        uploaded_file = TemporaryUploadedFile("factura.pdf", "application/pdf", len(self.pdf_bytes), None)
+        uploaded_file.write(self.pdf_bytes)
+        uploaded_file.flush()
+        spooled_path = uploaded_file.temporary_file_path()
+
+        with override_settings(FILE_UPLOAD_TEMP_DIR=self.temp_folder):
+            file_path = store_upload(job, uploaded_file)
+            uploaded_file.close()  # Django tolera que el temporal ya no exista
+
+            self.assertFalse(os.path.exists(spooled_path))
+            with open(file_path, "rb") as stored:
+                self.assertEqual(stored.read(), self.pdf_bytes)
+            with self.assertRaises(FileExistsError):
+                store_upload(job, SimpleUploadedFile("factura.pdf", b"otro"))
+
+
+from apps.invoices.tasks import publish_invoice_image
+
+
+class ImagePublishingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(dni="123456789", fullname="Test User", email="testuser@example.com", password="x")
+        self.file_path = os.path.join(tempfile.mkdtemp(), "endesa4.pdf")
+        shutil.copy(os.path.join(FACTURAS_DIR, "endesa4.pdf"), self.file_path)
+        self.job = InvoiceProcessingJob.objects.create(
+            user=self.user, file_name="endesa4.pdf", file_path=self.file_path, content_hash="a" * 64
+        )
+
+    def test_invoice_is_saved_before_the_image_is_published(self):
+        with mock.patch.object(InvoiceProcessor, "upload_page_image") as mock_upload:
+            self.assertTrue(InvoiceProcessor().process_job(self.job))
+
+        mock_upload.assert_not_called()
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, "success")
+        self.assertIsNone(self.job.invoice.image_url)
+        self.assertTrue(os.path.exists(self.file_path))  # Se conserva hasta publicar la imagen
+
+        with mock.patch.object(InvoiceProcessor, "upload_page_image", return_value="https://example.com/factura.png"):
+            publish_invoice_image.apply(args=[str(self.job.id)])
+
+        self.job.invoice.refresh_from_db()
+        self.assertEqual(self.job.invoice.image_url, "https://example.com/factura.png")
+        self.assertIn("publish", self.job.invoice.processing_metrics["stages_ms"])
+        self.assertEqual(InvoiceExtractionCache.objects.get().image_url, "https://example.com/factura.png")
+        self.assertFalse(os.path.exists(self.file_path))
+
+    @override_settings(INVOICE_PUBLISH_MAX_RETRIES=2)
+    def test_cloudinary_outage_is_retried_and_never_fails_the_invoice(self):
+        InvoiceProcessor().process_job(self.job)
+        self.job.refresh_from_db()
+
+        with mock.patch.object(InvoiceProcessor, "upload_page_image", side_effect=RuntimeError("Cloudinary caído")) as mock_upload:
+            publish_invoice_image.apply(args=[str(self.job.id)])
+
+        self.assertEqual(mock_upload.call_count, 3)
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, "success")
+        self.assertIsNone(self.job.invoice.image_url)
+        self.assertEqual(self.job.checkpoint, {})
+        self.assertFalse(os.path.exists(self.file_path))
+
+
+from apps.general.utils.renditions import cloudinary_renditions
+
+
+class InvoiceImageRenditionTests(TestCase):
+    CLOUDINARY_URL = "https://res.cloudinary.com/demo/image/upload/v1/facturas/factura.png"
+
+    @override_settings(IMAGE_RENDITION_FORMAT="WEBP", IMAGE_RENDITION_QUALITY=75, IMAGE_THUMBNAIL_SIZE=200, IMAGE_MEDIUM_SIZE=800)
+    def test_cloudinary_renditions_are_url_transformations(self):
+        renditions = cloudinary_renditions(self.CLOUDINARY_URL)
+
+        self.assertEqual(renditions["original"], self.CLOUDINARY_URL)
+        self.assertEqual(
+            renditions["thumbnail"],
+            "https://res.cloudinary.com/demo/image/upload/c_limit,w_200,h_200,q_75,f_webp/v1/facturas/factura.png",
+        )
+        self.assertIn("/c_limit,w_800,h_800,q_75,f_webp/", renditions["medium"])
+        self.assertIsNone(cloudinary_renditions(None))
+        self.assertEqual(set(cloudinary_renditions("https://example.com/a.png").values()), {"https://example.com/a.png"})
+
+    def test_invoice_image_endpoint_returns_renditions(self):
+        user = User.objects.create_user(dni="123456789", fullname="Test User", email="testuser@example.com", password="x")
+        invoice = Invoice.objects.create(
+            user=user, billing_period_start="2024-01-01", billing_period_end="2024-01-31", data={},
+            image_url=self.CLOUDINARY_URL,
+        )
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        response = client.get(reverse("invoice-image", args=[invoice.id]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["renditions"], cloudinary_renditions(self.CLOUDINARY_URL))
+
+
+from apps.invoices import dedupe
+
+
+@override_settings(INVOICE_IDEMPOTENCY_TTL_HOURS=24)
+class InvoiceDeduplicationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(dni="123456789", fullname="Test User", email="testuser@example.com", password="x")
+        self.client.force_authenticate(user=self.user)
+        self.temp_folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_folder, ignore_errors=True)
+
+    def upload(self, pdf_bytes, key=None):
+        file = SimpleUploadedFile("factura.pdf", pdf_bytes, content_type="application/pdf")
+        headers = {"HTTP_IDEMPOTENCY_KEY": key} if key else {}
+        with override_settings(FILE_UPLOAD_TEMP_DIR=self.temp_folder):
+            return self.client.post(reverse("invoice-upload"), {"file": file}, format="multipart", **headers)
+
+    @mock.patch("apps.invoices.views.process_invoice_job")
+    def test_retry_with_the_same_idempotency_key_returns_the_original_job(self, mock_task):
+        first = self.upload(b"%PDF-1.4 first", key="upload-1")
+        # El archivo del reintento ni siquiera se lee
+        second = self.upload(b"%PDF-1.4 truncated", key="upload-1")
+
+        self.assertEqual(first.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(second.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(second.data["job_id"], first.data["job_id"])
+        self.assertTrue(second.data["duplicate"])
+        self.assertEqual(InvoiceProcessingJob.objects.count(), 1)
+        mock_task.delay.assert_called_once()
+
+    @mock.patch("apps.invoices.views.process_invoice_job")
+    def test_failed_or_expired_keys_are_released(self, mock_task):
+        failed = InvoiceProcessingJob.objects.create(user=self.user, file_name="f.pdf", idempotency_key="k", status="error")
+
+        response = self.upload(b"%PDF-1.4 first", key="k")
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertNotEqual(response.data["job_id"], str(failed.id))
+        failed.refresh_from_db()
+        self.assertEqual(failed.idempotency_key, "")
+
+        InvoiceProcessingJob.objects.filter(pk=response.data["job_id"]).update(created_at=now() - timedelta(hours=25))
+        self.assertIsNone(dedupe.find_idempotent_job(self.user, "k"))
+
+    def test_idempotency_key_is_bounded(self):
+        response = self.upload(b"%PDF-1.4 first", key="k" * 300)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @mock.patch("apps.invoices.views.process_invoice_job")
+    def test_same_pdf_returns_the_job_in_flight_and_then_the_invoice(self, mock_task):
+        first = self.upload(b"%PDF-1.4 same")
+        second = self.upload(b"%PDF-1.4 same")
+
+        self.assertEqual(second.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(second.data["job_id"], first.data["job_id"])
+        self.assertEqual(InvoiceProcessingJob.objects.count(), 1)
+
+        invoice = Invoice.objects.create(
+            user=self.user, billing_period_start="2024-01-01", billing_period_end="2024-01-31", data={"a": 1},
+            content_hash=hashlib.sha256(b"%PDF-1.4 same").hexdigest(),
+        )
+        InvoiceProcessingJob.objects.filter(pk=first.data["job_id"]).update(status="success", invoice=invoice)
+
+        third = self.upload(b"%PDF-1.4 same")
+
+        self.assertEqual(third.status_code, status.HTTP_200_OK)
+        self.assertEqual(third.data["invoice_id"], invoice.id)
+        self.assertTrue(third.data["duplicate"])
+        self.assertEqual(Invoice.objects.count(), 1)
+        mock_task.delay.assert_called_once()
+
+    def test_same_reference_and_period_links_the_existing_invoice(self):
+        jobs = []
+        for index in range(2):
+            file_path = os.path.join(self.temp_folder, f"{index}.pdf")
+            shutil.copy(os.path.join(FACTURAS_DIR, "endesa4.pdf"), file_path)
+            jobs.append(InvoiceProcessingJob.objects.create(
+                user=self.user, file_name="endesa4.pdf", file_path=file_path, content_hash=f"{index:064d}"
+            ))
+
+        self.assertTrue(InvoiceProcessor().process_job(jobs[0]))
+        # El duplicado no crea factura ni publica otra imagen, y su PDF se elimina
+        self.assertFalse(InvoiceProcessor().process_job(jobs[1]))
+
+        invoice = Invoice.objects.get()
+        self.assertEqual(invoice.reference_number, "012300620608/0015")
+        jobs[1].refresh_from_db()
+        self.assertEqual((jobs[1].status, jobs[1].invoice, jobs[1].duplicate), ("success", invoice, True))
+        self.assertFalse(os.path.exists(jobs[1].file_path))
+        self.assertTrue(os.path.exists(jobs[0].file_path))
+
+    def test_same_reference_in_another_period_creates_an_invoice(self):
+        # El número de referencia es el del contrato: se repite en la factura del mes anterior
+        previous = Invoice.objects.create(
+            user=self.user, billing_period_start="2020-11-01", billing_period_end="2020-11-30", data={},
+            reference_number="012300620608/0015",
+        )
+        file_path = os.path.join(self.temp_folder, "endesa4.pdf")
+        shutil.copy(os.path.join(FACTURAS_DIR, "endesa4.pdf"), file_path)
+        job = InvoiceProcessingJob.objects.create(
+            user=self.user, file_name="endesa4.pdf", file_path=file_path, content_hash="1" * 64
+        )
+
+        self.assertTrue(InvoiceProcessor().process_job(job))
+
+        job.refresh_from_db()
+        self.assertFalse(job.duplicate)
+        self.assertNotEqual(job.invoice, previous)
+        self.assertEqual(job.invoice.billing_period_start.isoformat(), "2020-12-01")
+        self.assertEqual(Invoice.objects.filter(reference_number="012300620608/0015").count(), 2)
+
+    def test_placeholder_references_are_ignored(self):
+        parsed = {"numero_referencia": "XXXXXXXXX", "periodo_facturacion": {"inicio": "1990-01-01", "fin": "1990-01-01"}}
+        Invoice.objects.create(
+            user=self.user, billing_period_start="1990-01-01", billing_period_end="1990-01-01", data=parsed,
+            reference_number="XXXXXXXXX",
+        )
+
+        self.assertEqual(dedupe.reference_number(parsed), "")
+        self.assertIsNone(dedupe.find_duplicate_invoice(self.user, parsed))
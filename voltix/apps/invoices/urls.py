@@ -1,7 +1,7 @@
 from django.urls import path
 
 from . import views
-from .views import InvoiceProcessView, InvoiceDetailView, InvoiceImageView
+from .views import InvoiceProcessView, InvoiceDetailView, InvoiceImageView, InvoiceJobStatusView, InvoiceMetricsView, InvoiceQueueView, InvoiceJobRetryView
 from .userInvoiceListview import UserInvoiceListView
 
 urlpatterns = [
@@ -9,6 +9,10 @@ urlpatterns = [
     path('<int:invoice_id>/', InvoiceDetailView.as_view(), name='invoice_detail'),
     path("", UserInvoiceListView.as_view(), name="invoice_list"),
     path('<int:invoice_id>/image/', InvoiceImageView.as_view(), name='invoice-image'),
+    path('jobs/<uuid:job_id>/', InvoiceJobStatusView.as_view(), name='invoice-job-status'),
+    path('jobs/<uuid:job_id>/retry/', InvoiceJobRetryView.as_view(), name='invoice-job-retry'),
+    path('metrics/', InvoiceMetricsView.as_view(), name='invoice-metrics'),
+    path('queue/', InvoiceQueueView.as_view(), name='invoice-queue'),
 ]
 
 
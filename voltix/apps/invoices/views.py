@@ -3,25 +3,32 @@
 ################################################################################################################################
 
 import os
-import cv2
-import pytesseract
+import time
+import hashlib
 import logging
-import fitz  # PyMuPDF
-from PIL import Image
-import numpy as np
 from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Avg
+from django.http import HttpResponse
+from django.urls import reverse
+from django.utils.timezone import now, timedelta
 from rest_framework.views import APIView
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 from .serializers import InvoiceUploadSerializer
-from apps.general.models import Invoice
-from apps.general.utils.upload_cloudinary import process_and_upload_image
-from io import BytesIO
-from django.core.files.uploadedfile import InMemoryUploadedFile
+from .tasks import process_invoice_job
+from . import admission
+from .cache import get_cached_result
+from .checkpoints import is_resumable, store_upload
+from .dedupe import IDEMPOTENCY_HEADER, IDEMPOTENCY_KEY_MAX_LENGTH, find_duplicate_upload, find_idempotent_job, idempotency_key
+from .metrics import BUCKETS_MS, render_prometheus, stage_histograms
+from .processing import InvoiceProcessor
+from apps.general.models import Invoice, InvoiceProcessingJob
+from apps.general.utils.renditions import cloudinary_renditions
 
 
 
@@ -32,10 +39,14 @@ class InvoiceProcessView(APIView):
     parser_classes = (MultiPartParser, FormParser)
 
     @swagger_auto_schema(
-        operation_summary="Subir y procesar facturas en PDF (OCR incluido)",
+        operation_summary="Subir facturas en PDF para su procesamiento asíncrono (OCR incluido)",
         operation_description=(
-            "Permite a un usuario autenticado subir un archivo PDF, "
-            "convertirlo en imágenes, procesarlas (escalado a grises) y ejecutar OCR para extraer texto."
+            "Permite a un usuario autenticado subir un archivo PDF. El archivo se encola para "
+            "convertirlo en imágenes, procesarlas (escalado a grises) y ejecutar OCR en segundo plano. "
+            "El avance se consulta en el endpoint de estado del trabajo devuelto. Las subidas repetidas no crean "
+            "otra factura: con la misma cabecera `Idempotency-Key`, con un PDF que el usuario ya subió o, tras "
+            "el OCR, con el mismo número de referencia y periodo de facturación, se devuelve la factura o el trabajo original "
+            "(`duplicate: true`)."
         ),
         manual_parameters=[
             openapi.Parameter(
@@ -44,15 +55,44 @@ class InvoiceProcessView(APIView):
                 type=openapi.TYPE_FILE,
                 description="El archivo PDF a subir y procesar.",
             ),
+            openapi.Parameter(
+                name=IDEMPOTENCY_HEADER,
+                in_=openapi.IN_HEADER,
+                type=openapi.TYPE_STRING,
+                required=False,
+                description=(
+                    "Identificador único de la subida generado por el cliente (por ejemplo, un UUID). Los "
+                    "reintentos con la misma clave devuelven el trabajo original sin procesar el archivo."
+                ),
+            ),
         ],
         responses={
-            201: openapi.Response(
-                description="Archivo procesado y texto extraído exitosamente.",
+            200: openapi.Response(
+                description=(
+                    "El mismo PDF ya se había procesado: la factura se crea con el resultado en caché. Si la "
+                    "factura ya era del usuario, se devuelve la existente con `duplicate: true`."
+                ),
                 examples={
                     "application/json": {
                         "status": "success",
-                        "message": "Archivo procesado y texto extraído exitosamente.",
-                        "ocr_text": "Texto extraído del archivo...",
+                        "message": "Factura procesada previamente. Resultado recuperado de la caché.",
+                        "job_id": "3f6c1e0a-7d2b-4c52-9a51-2b1f0c9d8e77",
+                        "status_url": "/api/invoices/jobs/3f6c1e0a-7d2b-4c52-9a51-2b1f0c9d8e77/",
+                        "invoice_id": 123,
+                        "data": {"nombre_cliente": "Ejemplo Cliente"},
+                        "image_url": "https://example.com/images/factura123.png",
+                    }
+                },
+            ),
+            202: openapi.Response(
+                description="Archivo recibido y encolado para su procesamiento.",
+                examples={
+                    "application/json": {
+                        "status": "accepted",
+                        "message": "Archivo recibido. El procesamiento continúa en segundo plano.",
+                        "job_id": "3f6c1e0a-7d2b-4c52-9a51-2b1f0c9d8e77",
+                        "status_url": "/api/invoices/jobs/3f6c1e0a-7d2b-4c52-9a51-2b1f0c9d8e77/",
+                        "queue_depth": 4,
                     }
                 },
             ),
@@ -73,12 +113,26 @@ class InvoiceProcessView(APIView):
                     }
                 },
             ),
+            429: openapi.Response(
+                description=(
+                    "Sin capacidad de OCR (límite total o por usuario). La cabecera Retry-After indica "
+                    "en cuántos segundos reintentar."
+                ),
+                examples={
+                    "application/json": {
+                        "status": "error",
+                        "message": "Hay demasiadas facturas en proceso. Inténtalo de nuevo en unos segundos.",
+                        "queue_depth": 20,
+                        "retry_after": 15,
+                    }
+                },
+            ),
             500: openapi.Response(
-                description="Error durante el procesamiento.",
+                description="Error al encolar el procesamiento.",
                 examples={
                     "application/json": {
                         "status": "error",
-                        "message": "Error durante el procesamiento.",
+                        "message": "Error al encolar el procesamiento.",
                         "details": "Detalles del error...",
                     }
                 },
@@ -86,116 +140,125 @@ class InvoiceProcessView(APIView):
         },
     )
     def post(self, request, *args, **kwargs):
+        # Reintento de una subida ya recibida: se devuelve el trabajo original sin leer el archivo
+        key = idempotency_key(request)
+        if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            return Response(
+                {"status": "error", "message": f"La cabecera {IDEMPOTENCY_HEADER} admite como máximo {IDEMPOTENCY_KEY_MAX_LENGTH} caracteres."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        replayed = find_idempotent_job(request.user, key)
+        if replayed:
+            return self.existing_job_response(replayed, "Subida repetida: se devuelve el trabajo original.")
+
         serializer = InvoiceUploadSerializer(data=request.data)
         if serializer.is_valid():
+            uploaded_file = serializer.validated_data["file"]
             try:
-                uploaded_file = serializer.validated_data["file"]
-
-                # Crear carpeta temporal si no existe
-                temp_folder = settings.FILE_UPLOAD_TEMP_DIR or os.path.join(settings.BASE_DIR, "media", "temp")
-                os.makedirs(temp_folder, exist_ok=True)
-
-                # Guardar archivo temporalmente
-                file_path = os.path.join(temp_folder, uploaded_file.name)
-                with open(file_path, "wb+") as destination:
-                    for chunk in uploaded_file.chunks():
-                        destination.write(chunk)
-
-                logger.info(f"Archivo '{uploaded_file.name}' subido exitosamente a {file_path}.")
-
-                # Convertir PDF a imágenes
-                images = self.pdf_to_images(file_path)
-                
-                # Subir la primera página a Cloudinary
-                if images:
-                    first_page_image = images[0]  # Usar solo la primera página
-                   
-
-                    # Convertir la imagen original (sin procesar) a un formato compatible con Cloudinary
-                    original_image = Image.open(BytesIO(first_page_image))  # Convertir bytes a PIL Image
-                    image_io = BytesIO()
-                    original_image.save(image_io, format='PNG')  # Guardar como PNG en un flujo en memoria
-                    image_io.seek(0)
-
-                    # Crear un InMemoryUploadedFile para subir a Cloudinary
-                    processed_photo = InMemoryUploadedFile(
-                        image_io,  # Archivo en memoria
-                        field_name='ImageField',  # Nombre del campo
-                        name='processed_image.png',  # Nombre del archivo
-                        content_type='image/png',  # Tipo MIME
-                        size=image_io.tell(),  # Tamaño del archivo
-                        charset=None  # Charset, None para imágenes
+                with transaction.atomic():
+                    job = InvoiceProcessingJob.objects.create(
+                        user=request.user, file_name=uploaded_file.name, idempotency_key=key
                     )
-
-                    try:
-                        photo_url = process_and_upload_image(processed_photo, folder="invoices")
-                    except Exception as cloudinary_error:
-                        logger.error(f"Error al subir la imagen a Cloudinary: {str(cloudinary_error)}")
+            except IntegrityError:
+                # Otra petición con la misma clave se adelantó
+                replayed = InvoiceProcessingJob.objects.select_related("invoice").get(user=request.user, idempotency_key=key)
+                return self.existing_job_response(replayed, "Subida repetida: se devuelve el trabajo original.")
+            try:
+                # Calcular el SHA-256 de la subida, que sigue en memoria (hasta FILE_UPLOAD_MAX_MEMORY_SIZE):
+                # las subidas servidas desde la caché o rechazadas por capacidad no llegan a escribirse en disco
+                started = time.perf_counter()
+                sha256 = hashlib.sha256()
+                for chunk in uploaded_file.chunks():
+                    sha256.update(chunk)
+                save_ms = (time.perf_counter() - started) * 1000
+
+                job.content_hash = sha256.hexdigest()
+                job.metrics = {"stages_ms": {"save": round(save_ms, 2)}}
+                job.save(update_fields=["content_hash", "metrics", "updated_at"])
+
+                # El usuario ya subió este PDF: se devuelve su factura o el trabajo que lo está procesando
+                invoice, in_flight = find_duplicate_upload(job)
+                if invoice:
+                    job.mark_done(invoice.data, "", invoice, duplicate=True)
+                    return self.existing_job_response(job, "Esta factura ya se había subido. Se devuelve la existente.")
+                if in_flight:
+                    job.delete()
+                    return self.existing_job_response(in_flight, "Esta factura ya se está procesando.")
+
+                # Si el mismo PDF ya se procesó, se responde desde la caché sin OCR ni Cloudinary
+                cached = get_cached_result(job.content_hash)
+                if cached:
+                    invoice = InvoiceProcessor().complete_from_cache(job, cached)
+                    if not invoice:
                         return Response(
-                            {"status": "error", "message": "Error al subir la imagen.", "details": str(cloudinary_error)},
+                            {"status": "error", "message": "Error al guardar la factura.", "details": job.error},
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR,
                         )
-                else:
-                    photo_url = None  # Si no hay imágenes, no habrá URL asociada
-
-                # Procesar las dos primeras páginas (si existen)
-                processed_images = []
-                ocr_text_combined = ""
-                for idx, img_data in enumerate(images[:2]):  # Tomar solo la primera y segunda página
-                    grayscale_image = self.process_image(img_data)
-                    processed_images.append(grayscale_image)
-
-                    # Realizar OCR en la imagen procesada
-                    ocr_text = self.perform_ocr(grayscale_image)
-                    ocr_text_combined += ocr_text + "\n"  # Combinar texto de todas las páginas
-
-                # Convertir OCR a JSON
-                parsed_data = self.convert_ocr_to_json(ocr_text_combined)
+                    return Response(
+                        {
+                            "status": "success",
+                            "message": "Factura procesada previamente. Resultado recuperado de la caché.",
+                            "job_id": str(job.id),
+                            "status_url": reverse("invoice-job-status", args=[job.id]),
+                            "invoice_id": invoice.id,
+                            "data": invoice.data,
+                            "image_url": invoice.image_url,
+                            "duplicate": job.duplicate,
+                        },
+                        status=status.HTTP_200_OK,
+                    )
 
-                # Guardar los datos en la base de datos
-                if "error" not in parsed_data:
-                    try:
-                        Invoice.objects.create(
-                            user=request.user,  # Relacionar la factura con el usuario autenticado
-                            billing_period_start=parsed_data["periodo_facturacion"].get("inicio"),
-                            billing_period_end=parsed_data["periodo_facturacion"].get("fin"),
-                            data=parsed_data,  # Guardar todo el JSON en el campo 'data'
-                            image_url=photo_url,  # Guardar la URL de la primera página en el modelo
-                        )
+                # Control de admisión: si no hay plaza de OCR (total o del usuario) se rechaza sin encolar
+                admitted = admission.acquire(job)
+                if not admitted.admitted:
+                    logger.warning(f"Subida rechazada por capacidad de OCR ({admitted.reason}), cola: {admitted.queue_depth}.")
+                    job.delete()
+                    response = Response(
+                        {
+                            "status": "error",
+                            "message": (
+                                "Hay demasiadas facturas en proceso. Inténtalo de nuevo en unos segundos."
+                                if admitted.reason == "global" else
+                                "Ya tienes facturas en proceso. Espera a que terminen antes de subir más."
+                            ),
+                            "queue_depth": admitted.queue_depth,
+                            "retry_after": admitted.retry_after,
+                        },
+                        status=status.HTTP_429_TOO_MANY_REQUESTS,
+                    )
+                    response["Retry-After"] = str(admitted.retry_after)
+                    return response
 
-                        logger.info("Factura guardada exitosamente en la base de datos.")
-                    except Exception as db_error:
-                        logger.error(f"Error al guardar en la base de datos: {str(db_error)}")
-                        return Response(
-                            {
-                                "status": "error",
-                                "message": "Error al guardar los datos en la base de datos.",
-                                "details": str(db_error),
-                            },
-                            status=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                        )
+                # El PDF se guarda en disco solo para entregarlo al worker (y conservarlo para los reintentos)
+                started = time.perf_counter()
+                job.file_path = store_upload(job, uploaded_file)
+                job.metrics["stages_ms"]["save"] = round(save_ms + (time.perf_counter() - started) * 1000, 2)
+                job.save(update_fields=["file_path", "metrics", "updated_at"])
+                logger.info(f"Archivo '{uploaded_file.name}' subido exitosamente a {job.file_path}.")
 
-                # Eliminar el archivo PDF subido
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                    logger.info(f"Archivo PDF '{uploaded_file.name}' eliminado.")
+                # Encolar el procesamiento en los workers de Celery
+                process_invoice_job.delay(str(job.id))
 
-                # Devolver el texto crudo del OCR y el JSON procesado
                 return Response(
                     {
-                        "status": "success",
-                        "message": "Archivo procesado y texto extraído exitosamente.",
-                        "ocr_text": ocr_text_combined,  # Texto crudo capturado por OCR
-                        "parsed_data": parsed_data,  # JSON estructurado a partir del texto OCR
+                        "status": "accepted",
+                        "message": "Archivo recibido. El procesamiento continúa en segundo plano.",
+                        "job_id": str(job.id),
+                        "status_url": reverse("invoice-job-status", args=[job.id]),
+                        "queue_depth": admitted.queue_depth,
                     },
-                    status=status.HTTP_201_CREATED,
+                    status=status.HTTP_202_ACCEPTED,
                 )
             except Exception as e:
-                logger.error(f"Error durante el procesamiento: {str(e)}")
+                logger.error(f"Error al encolar el procesamiento: {str(e)}")
+                admission.release(job)
+                job.mark_failed(str(e))
+                if job.file_path and os.path.exists(job.file_path):
+                    os.remove(job.file_path)
                 return Response(
                     {
                         "status": "error",
-                        "message": "Error durante el procesamiento.",
+                        "message": "Error al encolar el procesamiento.",
                         "details": str(e),
                     },
                     status=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -204,1031 +267,327 @@ class InvoiceProcessView(APIView):
         logger.warning(f"Validación fallida: {serializer.errors}")
         return Response({"status": "error", "details": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
 
-    def pdf_to_images(self, pdf_path):
-        """
-        Convierte un archivo PDF en imágenes (una por página).
-        """
-        images = []
-        try:
-            pdf_document = fitz.open(pdf_path)
-            for page_number in range(len(pdf_document)):
-                page = pdf_document[page_number]
-                zoom_x, zoom_y = 2.0, 2.0  # 2x scaling for higher DPI
-                matrix = fitz.Matrix(zoom_x, zoom_y)
-                pix = page.get_pixmap(matrix=matrix)
-                image_data = pix.tobytes("png")
-                images.append(image_data)
-            pdf_document.close()
-            return images
-        except Exception as e:
-            logger.error(f"Error al convertir PDF a imágenes: {str(e)}")
-            return []
-
-    def process_image(self, image_data):
+    def existing_job_response(self, job, message):
         """
-        Convierte una imagen a escala de grises usando OpenCV.
+        Respuesta a una subida repetida: la factura del trabajo original si ya terminó o su estado si sigue en curso.
         """
-        try:
-            np_array = np.frombuffer(image_data, np.uint8)
-            image = cv2.imdecode(np_array, cv2.IMREAD_COLOR)
-            grayscale_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-
-            # Aumentar contraste usando CLAHE
-            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-            contrast_image = clahe.apply(grayscale_image)
-
-            # Eliminar ruido
-            denoised_image = cv2.fastNlMeansDenoising(contrast_image, None, 30, 7, 21)
-
-            # Afilar la imagen
-            kernel = np.array([[0, -1, 0],
-                               [-1, 5, -1],
-                               [0, -1, 0]])
-            sharpened_image = cv2.filter2D(denoised_image, -1, kernel)
-
-            return sharpened_image
-        except Exception as e:
-            logger.error(f"Error durante el procesamiento de la imagen: {str(e)}")
-            return None
-
-    def perform_ocr(self, image):
-        """
-        Realiza OCR en una imagen usando Tesseract y retorna el texto extraído.
-        """
-        try:
-            custom_oem_psm_config = r"--oem 3 --psm 11"
-            pytesseract.pytesseract.tesseract_cmd = r"/usr/bin/tesseract"
-
-            pil_image = Image.fromarray(image)
-
-            ocr_result = pytesseract.image_to_string(pil_image, lang="spa", config=custom_oem_psm_config)
-
-            return ocr_result
-
-        except Exception as e:
-            logger.error(f"Error al realizar OCR: {str(e)}")
-            return ""
-
-    def convert_ocr_to_json(self, ocr_text):
-        """
-        Convierte el texto OCR extraído a un JSON según la comercializadora detectada.
-        """
-        try:
-            if "endesa" in ocr_text.lower():
-                return self.extract_endesa_data(ocr_text)
-            elif "iberdrola" in ocr_text.lower():
-                return self.extract_iberdrola_data(ocr_text)
-            elif "lidera comercializadora energia" in ocr_text.lower():
-                return self.extract_lidera_data(ocr_text)
-            elif "naturgy iberia" in ocr_text.lower():
-                return self.extract_naturgy_data(ocr_text)
-            elif "e-distribución" in ocr_text.lower():
-                return self.extract_edistribucion_data(ocr_text)
-            else:
-                return {"error": "No se reconoció ninguna comercializadora en el OCR."}
-
-        except Exception as e:
-            logger.error(f"Error al convertir OCR a JSON: {str(e)}")
-            return {"error": "Error al convertir OCR a JSON."}
-
-    def extract_endesa_data(self, ocr_text):
-        """
-        Extrae los datos específicos de las facturas de Endesa a partir del texto OCR.
-        """
-        try:
-            import re
-            from datetime import datetime
-
-            # Normalizar el texto para facilitar la búsqueda
-            normalized_text = re.sub(r"\s+", " ", ocr_text)  # Reemplazar múltiples espacios o saltos de línea con un solo espacio
-
-            # Función auxiliar para convertir fechas al formato YYYY-MM-DD
-            def format_date_to_yyyy_mm_dd(date_str):
-                try:
-                    return datetime.strptime(date_str, "%d/%m/%Y").strftime("%Y-%m-%d")
-                except ValueError:
-                    return None
-
-            # Función auxiliar para convertir fechas con nombres de meses
-            def format_date_with_month_name(date_match):
-                meses = {
-                    "enero": "01", "febrero": "02", "marzo": "03", "abril": "04",
-                    "mayo": "05", "junio": "06", "julio": "07", "agosto": "08",
-                    "septiembre": "09", "octubre": "10", "noviembre": "11", "diciembre": "12"
-                }
-                try:
-                    dia, mes_texto, anio = date_match.groups()
-                    mes = meses.get(mes_texto.lower())
-                    if mes:
-                        return f"{anio}-{mes}-{dia.zfill(2)}"
-                except (ValueError, AttributeError):
-                    pass
-                return None
-
-            # Extraer "nombre_cliente"
-            nombre_cliente_match = re.search(r"Titular del contrato:\s*(.*?)\s*\n\nCUPS:", ocr_text, re.IGNORECASE)
-            nombre_cliente = nombre_cliente_match.group(1).strip() if nombre_cliente_match else None
-
-            # Extraer "numero_referencia"
-            numero_referencia_match = re.search(r"Referencia:\s*([\w\/-]+)", normalized_text)
-            numero_referencia = numero_referencia_match.group(1).strip() if numero_referencia_match else None
-
-            # Extraer "fecha_emision"
-            fecha_emision_match = re.search(r"Fecha emisión factur[a|:]*\s*(\d{2}/\d{2}/\d{4})", normalized_text, re.IGNORECASE)
-            fecha_emision = format_date_to_yyyy_mm_dd(fecha_emision_match.group(1)) if fecha_emision_match else None
-
-
-            # Extraer "periodo_inicio"
-            periodo_inicio_match = re.search(r"Periodo de facturación: del\s*(\d{2}/\d{2}/\d{4})", normalized_text)
-            periodo_inicio = format_date_to_yyyy_mm_dd(periodo_inicio_match.group(1)) if periodo_inicio_match else None
-
-            # Extraer "periodo_fin"
-            periodo_fin_match = re.search(r"a\s*(\d{2}/\d{2}/\d{4})", normalized_text)
-            periodo_fin = format_date_to_yyyy_mm_dd(periodo_fin_match.group(1)) if periodo_fin_match else None
-
-            # Extraer "dias"
-            dias_match = re.search(r"\((\d+)\s*días\)", normalized_text)
-            dias = int(dias_match.group(1)) if dias_match else None
-
-            # Extraer "fecha_cargo"
-            fecha_cargo_match = re.search(r"Fecha de cargo:\s*(\d{2})\s*de\s*(\w+)\s*de\s*(\d{4})", normalized_text)
-            fecha_cargo = format_date_with_month_name(fecha_cargo_match) if fecha_cargo_match else None
-
-            # Extraer "mandato"
-            mandato_match = re.search(r"Cod\.?Mandato:\s*(\w+)", normalized_text)
-            mandato = mandato_match.group(1).strip() if mandato_match else None
-
-            # Extraer "costo_potencia"
-            costo_potencia_match = re.search(r"Potencia.*? (\d{1,3}(?:\.\d{3})*,\d{2}) €", normalized_text)
-            costo_potencia = float(costo_potencia_match.group(1).replace(".", "").replace(",", ".")) if costo_potencia_match else None
-
-            # Extraer "costo_energia"
-            costo_energia_match = re.search(r"Energía\s+(\d{1,3}(?:\.\d{3})*,\d{2})", normalized_text)
-            costo_energia = float(costo_energia_match.group(1).replace(".", "").replace(",", ".")) if costo_energia_match else None
-
-            # Extraer "descuentos"
-            descuentos_match = re.search(r"Descuentos.*? (-?\d{1,3}(?:\.\d{3})*,\d{2}) €", normalized_text)
-            descuentos = float(descuentos_match.group(1).replace(".", "").replace(",", ".")) if descuentos_match else None
-
-            # Extraer "impuestos"
-            impuestos_match = re.search(r"Impuestos.*? (\d{1,3}(?:\.\d{3})*,\d{2}) €", normalized_text)
-            impuestos = float(impuestos_match.group(1).replace(".", "").replace(",", ".")) if impuestos_match else None
-
-            # Extraer "total_a_pagar"
-            total_a_pagar_match = re.search(r"Total.*? (\d{1,3}(?:\.\d{3})*,\d{2}) €", normalized_text)
-            total_a_pagar = float(total_a_pagar_match.group(1).replace(".", "").replace(",", ".")) if total_a_pagar_match else None
-
-            # Extraer "consumo_punta"
-            try:
-                llano_position = normalized_text.lower().find("llano")
-                if llano_position != -1:
-                    text_before_llano = normalized_text[:llano_position]
-                    numeros_antes_de_llano = re.findall(r"(\d{1,3}(?:\.\d{3})*,\d{2})", text_before_llano)
-                    consumo_punta = float(numeros_antes_de_llano[-1].replace(".", "").replace(",", ".")) if numeros_antes_de_llano else None
-                else:
-                    consumo_punta = None
-            except Exception as e:
-                logger.error(f"Error al extraer consumo_punta: {str(e)}")
-                consumo_punta = None
-
-            # Extraer "consumo_valle"
-            try:
-                potencia_positions = [m.start() for m in re.finditer(r"potencia", normalized_text.lower())]
-                if len(potencia_positions) >= 6:
-                    text_before_sixth_potencia = normalized_text[:potencia_positions[5]]
-                    numeros_antes_de_potencia = re.findall(r"(\d{1,3}(?:\.\d{3})*,\d{2})", text_before_sixth_potencia)
-                    consumo_valle = float(numeros_antes_de_potencia[-3].replace(".", "").replace(",", ".")) if len(numeros_antes_de_potencia) >= 3 else None
-                else:
-                    consumo_valle = None
-            except Exception as e:
-                logger.error(f"Error al extraer consumo_valle: {str(e)}")
-                consumo_valle = None
-
-            # Extraer "consumo_total"
-            import re
-
-            ocr_text = """
-            Consumo Total
-
-            1,112,537 kWh
-            """
-
-            # Buscar el valor después de "Consumo Total"
-            consumo_total_match = re.search(r"Consumo Total\s*\n\n\s*(\d{1,3}(?:,\d{3})+)", ocr_text)
-
-            # Procesar el valor encontrado
-            if consumo_total_match:
-                consumo_total = consumo_total_match.group(1).replace(",", "")  # Quitar comas
-                consumo_total = float(consumo_total[:-3] + '.' + consumo_total[-3:])  # Insertar el punto y convertir a float
-            else:
-                consumo_total = None  # Si no se encuentra el valor
-
-            # Resultado para el JSON
-            resultado_json = {
-                "consumo_total": consumo_total
-            }
-
-            print(resultado_json)
-
-            # Extraer "precio_efectivo_energia"
-            precio_efectivo_energia_match = re.search(r"ha salido a\s*([\d,\.]+) €/kWh", normalized_text)
-            precio_efectivo_energia = float(precio_efectivo_energia_match.group(1).replace(",", ".")) if precio_efectivo_energia_match else None
-
-            # Extraer "forma de pago"
-            forma_pago_match = re.search(r"Forma de pago:\s*([^\d\n]*)", normalized_text, re.IGNORECASE)
-            forma_pago = forma_pago_match.group(1).strip() if forma_pago_match else None
-
-            # Construir JSON
-            parsed_data = {
-                "nombre_cliente": nombre_cliente,
-                "numero_referencia": numero_referencia,
-                "fecha_emision": fecha_emision,
-                "periodo_facturacion": {
-                    "inicio": periodo_inicio,
-                    "fin": periodo_fin,
-                    "dias": dias,
+        if job.status == "success" and job.invoice:
+            return Response(
+                {
+                    "status": "success",
+                    "message": message,
+                    "job_id": str(job.id),
+                    "status_url": reverse("invoice-job-status", args=[job.id]),
+                    "invoice_id": job.invoice.id,
+                    "data": job.invoice.data,
+                    "image_url": job.invoice.image_url,
+                    "duplicate": True,
                 },
-                "forma_pago": forma_pago,
-                "fecha_cargo": fecha_cargo,
-                "mandato": mandato,
-                "desglose_cargos": {
-                    "costo_potencia": costo_potencia,
-                    "costo_energia": costo_energia,
-                    "descuentos": descuentos,
-                    "impuestos": impuestos,
-                    "total_a_pagar": total_a_pagar,
+                status=status.HTTP_200_OK,
+            )
+        return Response(
+            {
+                "status": "accepted",
+                "message": message,
+                "job_id": str(job.id),
+                "status_url": reverse("invoice-job-status", args=[job.id]),
+                "duplicate": True,
+            },
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+
+class InvoiceJobStatusView(APIView):
+    """
+    Endpoint para consultar el estado de un trabajo de procesamiento de factura.
+    """
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        operation_summary="Consultar el estado del procesamiento de una factura",
+        operation_description=(
+            "Devuelve la etapa, el progreso y, cuando termina, el resultado del procesamiento "
+            "de una factura subida por el usuario autenticado. Si la factura ya existía (mismo número de "
+            "referencia), `duplicate` es true e `invoice_id` es la factura original."
+        ),
+        responses={
+            200: openapi.Response(
+                description="Estado del trabajo obtenido exitosamente.",
+                examples={
+                    "application/json": {
+                        "job_id": "3f6c1e0a-7d2b-4c52-9a51-2b1f0c9d8e77",
+                        "status": "success",
+                        "stage": "done",
+                        "progress": 100,
+                        "invoice_id": 123,
+                        "duplicate": False,
+                        "error": None,
+                        "ocr_text": "Texto extraído del archivo...",
+                        "parsed_data": {"nombre_cliente": "Ejemplo Cliente"},
+                    }
                 },
-                "detalles_consumo": {
-                    "consumo_punta": consumo_punta,
-                    "consumo_valle": consumo_valle,
-                    "consumo_total": consumo_total,
-                    "precio_efectivo_energia": precio_efectivo_energia,
+            ),
+            404: openapi.Response(
+                description="Trabajo no encontrado o no pertenece al usuario autenticado.",
+                examples={
+                    "application/json": {
+                        "status": "error",
+                        "message": "No se encontró el trabajo 3f6c1e0a-7d2b-4c52-9a51-2b1f0c9d8e77."
+                    }
                 },
-            }
-
-            return parsed_data
-
-        except Exception as e:
-            logger.error(f"Error al convertir OCR a JSON para Endesa: {str(e)}")
-            return {"error": "Error al convertir OCR a JSON para Endesa."}
-
-    def extract_iberdrola_data(self, ocr_text):
-        """
-        Extrae los datos específicos de las facturas de Iberdrola a partir del texto OCR.
-        """
-        try:
-            import re
-            from datetime import datetime
-
-            # Mapeo de meses en español a números
-            meses = {
-                "enero": "01", "febrero": "02", "marzo": "03", "abril": "04",
-                "mayo": "05", "junio": "06", "julio": "07", "agosto": "08",
-                "septiembre": "09", "octubre": "10", "noviembre": "11", "diciembre": "12"
-            }
-
-            # Inicializar valores por defecto
-            nombre_cliente = None
-            numero_referencia = None
-            fecha_emision = None
-            periodo_inicio = None
-            periodo_fin = None
-            dias = None
-            forma_pago = None
-            fecha_cargo = None
-            mandato = None
-            costo_potencia = None
-            costo_energia = None
-            descuentos = None
-            impuestos = None
-            total_a_pagar = None
-            consumo_punta = None
-            consumo_valle = None
-            consumo_total = None
-            precio_efectivo_energia = None
-
-            # Extraer "nombre_cliente"
-            nombre_cliente_match = re.search(r"(?:\n)([A-Z\s]+)\n.*Potencia punta", ocr_text)
-            nombre_cliente = nombre_cliente_match.group(1).strip() if nombre_cliente_match else None
-
-            # Extraer "numero_referencia"
-            numero_referencia_match = re.search(r"N\* DE CONTRATO:\s*([\d]+)", ocr_text)
-            numero_referencia = numero_referencia_match.group(1).strip() if numero_referencia_match else None
-
-            # Extraer "fecha_emision"
-            fecha_emision_match = re.search(
-                r"FECHA DE EMISIÓN:.*?\n\n.*?\n\n(\d{1,2})\s+de\s+(\w+)\s+de\s+(\d{4})", ocr_text, re.DOTALL
+            ),
+        },
+        manual_parameters=[
+            openapi.Parameter(
+                name="job_id",
+                in_=openapi.IN_PATH,
+                description="ID del trabajo devuelto al subir la factura.",
+                type=openapi.TYPE_STRING,
+                format=openapi.FORMAT_UUID,
+                required=True,
             )
-            if fecha_emision_match:
-                dia, mes_texto, anio = fecha_emision_match.groups()
-                mes_numero = meses.get(mes_texto.lower())
-                if mes_numero:
-                    fecha_emision = f"{anio}-{mes_numero}-{dia.zfill(2)}"
-
-
-            # Extraer "periodo_facturacion"
-            periodo_match = re.search(
-                r"PERIODO DE FACTURACIÓN.*?\n\n(\d{1,2}/\d{1,2}/\d{4})\s+(\d{1,2}/\d{1,2}/\d{4})", ocr_text, re.DOTALL
+        ]
+    )
+    def get(self, request, job_id):
+        job = InvoiceProcessingJob.objects.filter(pk=job_id, user=request.user).first()
+        if not job:
+            return Response(
+                {"status": "error", "message": f"No se encontró el trabajo {job_id}."},
+                status=status.HTTP_404_NOT_FOUND,
             )
-            if periodo_match:
-                try:
-                    # Convertir las fechas al formato YYYY-MM-DD
-                    periodo_inicio = datetime.strptime(periodo_match.group(1), "%d/%m/%Y").strftime("%Y-%m-%d")
-                    periodo_fin = datetime.strptime(periodo_match.group(2), "%d/%m/%Y").strftime("%Y-%m-%d")
-                except ValueError:
-                    periodo_inicio, periodo_fin = None, None
-
-
-            # Extraer "dias"
-            dias_match = re.search(r"FECHA DE EMISIÓN:.*?\n\n.*?\n\n(\d+)", ocr_text, re.DOTALL)
-            dias = int(dias_match.group(1)) if dias_match else None
-
-
-            # Extraer "forma_pago"
-            forma_pago_match = re.search(r"Forma de pago\s*([^\n]+)", ocr_text)
-            forma_pago = forma_pago_match.group(1).strip() if forma_pago_match else None
-
-            # Extraer "fecha_cargo"
-            fecha_cargo_match = re.search(r"FECHA PREVISTA DE COBRO:\s*(\d{2}/\d{2}/\d{4})", ocr_text)
-            if fecha_cargo_match:
-                try:
-                    fecha_cargo = datetime.strptime(fecha_cargo_match.group(1), "%d/%m/%Y").strftime("%Y-%m-%d")
-                except ValueError:
-                    fecha_cargo = None
-
-            # Extraer "mandato"
-            mandato_match = re.search(r"Codigo de mandato\s*([\d]+)", ocr_text)
-            mandato = mandato_match.group(1).strip() if mandato_match else None
-
-            # Extraer el valor de "costo_punta" (antes de "€\n\nValle")
-            costo_punta_match = re.search(r"([\d,\.]+)\s*€\s*\n\n\s*Valle", ocr_text)
-            if costo_punta_match:
-                try:
-                    costo_punta_raw = costo_punta_match.group(1)
-                    costo_punta = float(costo_punta_raw.replace(",", ".")) / 100  # Mover el punto 2 posiciones a la izquierda
-                except ValueError:
-                    costo_punta = 0.0  # Valor por defecto si el formato no es válido
-            else:
-                costo_punta = 0.0  # Valor por defecto si no se encuentra el patrón
-
-            # Extraer el valor de "costo_valle" (antes de " €\n\nTotal importe potencia")
-            costo_valle_match = re.search(r"([\d,\.]+)\s*€\s*\n\n\s*Total importe potencia", ocr_text)
-            if costo_valle_match:
-                try:
-                    costo_valle_raw = costo_valle_match.group(1)
-                    costo_valle = float(costo_valle_raw.replace(",", ".")) / 100  # Mover el punto 2 posiciones a la izquierda
-                except ValueError:
-                    costo_valle = 0.0  # Valor por defecto si el formato no es válido
-            else:
-                costo_valle = 0.0  # Valor por defecto si no se encuentra el patrón
-
-            # Calcular el valor total de "costo_potencia" y limitar a 2 decimales
-            costo_potencia = round(costo_punta + costo_valle, 2)
-
-
-
-            # Extraer valor de "costo_energia" (antes de " €\n\nEnergia consumida")
-            costo_energia_match = re.search(r"([\d,\.]+)\s*€\s*\n\n\s*Energia consumida", ocr_text)
-            if costo_energia_match:
-                try:
-                    costo_energia_raw = costo_energia_match.group(1)
-                    costo_energia = float(costo_energia_raw.replace(",", "."))
-                except ValueError:
-                    costo_energia = 0.0  # Valor por defecto si el formato no es válido
-            else:
-                costo_energia = 0.0  # Valor por defecto si no se encuentra el patrón
-
-
-            # Extraer "descuentos"
-            descuentos_match = re.search(r"Descuentos.*?(-?\d{1,3},\d{2}) €", ocr_text)
-            descuentos = float(descuentos_match.group(1).replace(",", ".")) if descuentos_match else None
-
-            # Extraer "impuestos"
-            # Extraer primer valor de "impuestos" (antes de " €\n\nTOTAL ENERGÍA")
-            impuestos_valor1_match = re.search(r"([\d,\.]+)\s*€\s*\n\n\s*TOTAL ENERGÍA", ocr_text)
-            if impuestos_valor1_match:
-                try:
-                    impuestos_valor1_raw = impuestos_valor1_match.group(1)
-                    impuestos_valor1 = float(impuestos_valor1_raw.replace(",", "."))
-                except ValueError:
-                    impuestos_valor1 = 0.0  # Valor por defecto si el formato no es válido
-            else:
-                impuestos_valor1 = 0.0  # Valor por defecto si no se encuentra el patrón
-
-
-            # Extraer segundo valor de "impuestos" (antes de "TOTAL IMPORTE FACTURA")
-            impuestos_valor2_match = re.search(r"([\d,\.]+)\s*€\s*\n\n\s*TOTAL IMPORTE FACTURA", ocr_text)
-            if impuestos_valor2_match:
-                try:
-                    impuestos_valor2_raw = impuestos_valor2_match.group(1)
-                    impuestos_valor2 = float(impuestos_valor2_raw.replace(",", "."))
-                except ValueError:
-                    impuestos_valor2 = 0.0  # Valor por defecto si el formato no es válido
-            else:
-                impuestos_valor2 = 0.0  # Valor por defecto si no se encuentra el patrón
-
-            # Calcular el valor total de "impuestos"
-            impuestos = impuestos_valor1 + impuestos_valor2
 
+        return Response(
+            {
+                "job_id": str(job.id),
+                "status": job.status,
+                "stage": job.stage,
+                "progress": job.progress,
+                "invoice_id": job.invoice_id,
+                "duplicate": job.duplicate,
+                "error": job.error or None,
+                "ocr_text": job.ocr_text,
+                "parsed_data": job.result,
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+class InvoiceJobRetryView(APIView):
+    """
+    Endpoint para reintentar un trabajo fallido desde la etapa en la que falló.
+    """
+    permission_classes = [IsAuthenticated]
 
-
-            # Extraer "total_a_pagar"
-            total_a_pagar_match = re.search(r"TOTAL IMPORTE FACTURA\s*\n\n\s*([\d,\.]+)\s*€", ocr_text)
-            if total_a_pagar_match:
-                try:
-                    total_a_pagar_raw = total_a_pagar_match.group(1)
-                    total_a_pagar = float(total_a_pagar_raw.replace(",", "."))
-                except ValueError:
-                    total_a_pagar = 0.0  # Valor por defecto si el formato no es válido
-            else:
-                total_a_pagar = 0.0  # Valor por defecto si no se encuentra el patrón
-
-
-            # Extraer "consumo_punta"
-            try:
-                # Buscar el valor después de "desagregados han sido punta:"
-                consumo_punta_match = re.search(r"desagregados han sido punta:\s*([\d,\.]+)\s*kWh", ocr_text, re.IGNORECASE)
-                
-                if consumo_punta_match:
-                    # Extraer el valor y convertirlo en float
-                    consumo_punta = float(consumo_punta_match.group(1).replace(",", "").replace(".", "."))
-                    consumo_punta = round(consumo_punta, 2)  # Asegurar dos decimales
-                else:
-                    consumo_punta = 0.00  # Valor por defecto si no se encuentra el patrón
-            except Exception as e:
-                logger.error(f"Error al extraer 'consumo_punta': {str(e)}")
-                consumo_punta = 0.00  # Valor por defecto en caso de error
-
-
-            # Extraer "consumo_valle"
-            try:
-                # Buscar el contexto específico de "Las potencias máximas demandadas"
-                consumo_valle_match = re.search(
-                    r"([\d,\.]+)\s*kWh,\s*\n=4\s*\nLas potencias máximas demandadas", ocr_text, re.IGNORECASE
-                )
-
-                if consumo_valle_match:
-                    # Extraer el valor encontrado y convertirlo en formato decimal
-                    consumo_valle = float(consumo_valle_match.group(1).replace(",", "."))
-                else:
-                    consumo_valle = 0.00  # Valor predeterminado si no se encuentra
-            except Exception as e:
-                logger.error(f"Error al extraer 'consumo_valle': {str(e)}")
-                consumo_valle = 0.00  # Valor predeterminado en caso de error
-
-            # Extraer "consumo_total"
-            consumo_total_match = re.search(r"(\d{1,3},\d{2})\s*kWh", ocr_text)
-            if consumo_total_match:
-                consumo_total = float(consumo_total_match.group(1).replace(",", "."))
-            else:
-                consumo_total = 0
-
-            # Extraer "precio_efectivo_energia"
-            precio_efectivo_energia_match = re.search(r"([\d,\.]+)\s*€/kWh", ocr_text)
-            if precio_efectivo_energia_match:
-                precio_efectivo_energia_raw = precio_efectivo_energia_match.group(1)
-                # Normalizar el valor reemplazando posibles errores como comas y puntos
-                try:
-                    precio_efectivo_energia = float(precio_efectivo_energia_raw.replace(",", "."))
-                except ValueError:
-                    # Si el formato no es válido, asignamos 0 como predeterminado
-                    precio_efectivo_energia = 0
-            else:
-                precio_efectivo_energia = 0
-
-            # Construir JSON con los valores extraídos
-            parsed_data = {
-                "nombre_cliente": nombre_cliente,
-                "numero_referencia": numero_referencia,
-                "fecha_emision": fecha_emision,
-                "periodo_facturacion": {
-                    "inicio": periodo_inicio,
-                    "fin": periodo_fin,
-                    "dias": dias,
-                },
-                "forma_pago": forma_pago,
-                "fecha_cargo": fecha_cargo,
-                "mandato": mandato,
-                "desglose_cargos": {
-                    "costo_potencia": costo_potencia,
-                    "costo_energia": costo_energia,
-                    "descuentos": descuentos if descuentos else 0,
-                    "impuestos": impuestos,
-                    "total_a_pagar": total_a_pagar,
-                },
-                "detalles_consumo": {
-                    "consumo_punta": consumo_punta,
-                    "consumo_valle": consumo_valle,
-                    "consumo_total": consumo_total,
-                    "precio_efectivo_energia": precio_efectivo_energia,
+    @swagger_auto_schema(
+        operation_summary="Reintentar el procesamiento de una factura",
+        operation_description=(
+            "Vuelve a encolar un trabajo fallido. El pipeline continúa desde la primera etapa que no terminó "
+            "(store → render → preprocess → OCR → extract → persist): si el OCR ya se hizo, no se repite."
+        ),
+        responses={
+            202: openapi.Response(
+                description="Trabajo encolado de nuevo.",
+                examples={
+                    "application/json": {
+                        "status": "accepted",
+                        "message": "Reintentando el procesamiento desde la etapa 'persist'.",
+                        "job_id": "3f6c1e0a-7d2b-4c52-9a51-2b1f0c9d8e77",
+                        "status_url": "/api/invoices/jobs/3f6c1e0a-7d2b-4c52-9a51-2b1f0c9d8e77/",
+                    }
                 },
-            }
-
-            return parsed_data
-
-        except Exception as e:
-            logger.error(f"Error al convertir OCR a JSON para Iberdrola: {str(e)}")
-            return {
-                "error": "Error al convertir OCR a JSON para Iberdrola."
-            }
-
-    def extract_lidera_data(self, ocr_text):
-        """
-        Extrae los datos específicos de las facturas de Lidera Energia a partir del texto OCR.
-        """
-        try:
-            import re
-            from datetime import datetime
-
-            # Mapeo de meses en español a números
-            meses = {
-                "enero": "01", "febrero": "02", "marzo": "03", "abril": "04",
-                "mayo": "05", "junio": "06", "julio": "07", "agosto": "08",
-                "septiembre": "09", "octubre": "10", "noviembre": "11", "diciembre": "12"
-            }
-
-            # Inicializar valores por defecto
-            nombre_cliente = None
-            numero_referencia = None
-            fecha_emision = None
-            periodo_inicio = None
-            periodo_fin = None
-            dias = None
-            forma_pago = None
-            fecha_cargo = None
-            mandato = None
-            costo_potencia = None
-            costo_energia = None
-            descuentos = None
-            impuestos = None
-            total_a_pagar = None
-            consumo_punta = None
-            consumo_valle = None
-            consumo_total = None
-            precio_efectivo_energia = None
-
-            # Extraer "nombre_cliente"
-            nombre_cliente_match = re.search(r"Titular del contrato:\s*(.*?)\n", ocr_text)
-            nombre_cliente = nombre_cliente_match.group(1).strip() if nombre_cliente_match else None
-
-            # Extraer "numero_referencia"
-            try:
-                numero_referencia_match = re.search(
-                    r"Referencia del contrato de sumi\n\ntro \(LIDERA COMERCIALIZADORA ENERGIA\):\s*(.+)",
-                    ocr_text
-                )
-                numero_referencia = numero_referencia_match.group(1).strip() if numero_referencia_match else None
-            except Exception as e:
-                logger.error(f"Error al extraer 'numero_referencia': {str(e)}")
-                numero_referencia = None
-
-            # Extraer "fecha_emision"
-            try:
-                fecha_emision_match = re.search(
-                    r"Fecha emi\n\nn factura:\s*(.+)",
-                    ocr_text
-                )
-                if fecha_emision_match:
-                    raw_fecha_emision = fecha_emision_match.group(1).strip()
-                    # Utilizar la función de mapeo de meses
-                    match = re.match(r"(\d{1,2})\s+de\s+(\w+)\s+de\s+(\d{4})", raw_fecha_emision)
-                    if match:
-                        dia, mes_texto, anio = match.groups()
-                        mes = meses.get(mes_texto.lower())
-                        if mes:
-                            fecha_emision = f"{anio}-{mes}-{dia.zfill(2)}"
-                        else:
-                            fecha_emision = None
-                    else:
-                        fecha_emision = None
-                else:
-                    fecha_emision = None
-            except Exception as e:
-                logger.error(f"Error al extraer 'fecha_emision': {str(e)}")
-                fecha_emision = None
+            ),
+            404: openapi.Response(
+                description="Trabajo no encontrado o no pertenece al usuario autenticado.",
+                examples={"application/json": {"status": "error", "message": "No se encontró el trabajo 3f6c1e0a-7d2b-4c52-9a51-2b1f0c9d8e77."}},
+            ),
+            409: openapi.Response(
+                description="El trabajo no ha fallado o ya no conserva sus datos para reintentarlo.",
+                examples={"application/json": {"status": "error", "message": "El trabajo no se puede reintentar. Sube de nuevo la factura."}},
+            ),
+            429: openapi.Response(
+                description="Sin capacidad de OCR. La cabecera Retry-After indica en cuántos segundos reintentar.",
+                examples={"application/json": {"status": "error", "message": "Hay demasiadas facturas en proceso. Inténtalo de nuevo en unos segundos.", "queue_depth": 20, "retry_after": 15}},
+            ),
+        },
+    )
+    def post(self, request, job_id):
+        job = InvoiceProcessingJob.objects.filter(pk=job_id, user=request.user).first()
+        if not job:
+            return Response(
+                {"status": "error", "message": f"No se encontró el trabajo {job_id}."},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        if not is_resumable(job):
+            return Response(
+                {"status": "error", "message": "El trabajo no se puede reintentar. Sube de nuevo la factura."},
+                status=status.HTTP_409_CONFLICT,
+            )
 
-            # Extraer "periodo_facturacion"
-            try:
-                periodo_match = re.search(
-                    r"Periodo de consumo:\n\nDe\s*(\d{1,2}/\d{1,2}/\d{4})\s*al\s*(\d{1,2}/\d{1,2}/\d{4})",
-                    ocr_text
+        # Si el OCR ya terminó, el reintento no ocupa plaza de OCR
+        if "extract" not in job.checkpoint:
+            admitted = admission.acquire(job)
+            if not admitted.admitted:
+                response = Response(
+                    {
+                        "status": "error",
+                        "message": "Hay demasiadas facturas en proceso. Inténtalo de nuevo en unos segundos.",
+                        "queue_depth": admitted.queue_depth,
+                        "retry_after": admitted.retry_after,
+                    },
+                    status=status.HTTP_429_TOO_MANY_REQUESTS,
                 )
-                if periodo_match:
-                    raw_inicio = periodo_match.group(1).strip()
-                    raw_fin = periodo_match.group(2).strip()
-                    
-                    # Convertir las fechas al formato YYYY-MM-DD
-                    def convertir_fecha(fecha_raw):
-                        try:
-                            return datetime.strptime(fecha_raw, "%d/%m/%Y").strftime("%Y-%m-%d")
-                        except ValueError:
-                            logger.error(f"Error al convertir fecha: {fecha_raw}")
-                            return None
-
-                    inicio = convertir_fecha(raw_inicio)
-                    fin = convertir_fecha(raw_fin)
-                else:
-                    inicio = None
-                    fin = None
-            except Exception as e:
-                logger.error(f"Error al extraer 'periodo_facturacion': {str(e)}")
-                inicio = None
-                fin = None
-
-            # Extraer "días"
-            try:
-                dias_match = re.search(r"(\d+)\s+Días", ocr_text)
-                dias = int(dias_match.group(1).strip()) if dias_match else None
-            except Exception as e:
-                logger.error(f"Error al extraer 'días': {str(e)}")
-                dias = None
-
-            # Extraer "forma_pago"
-            try:
-                forma_pago_match = re.search(r"Forma de pago:\s*(.+)", ocr_text)
-                forma_pago = forma_pago_match.group(1).strip() if forma_pago_match else None
-            except Exception as e:
-                logger.error(f"Error al extraer 'forma_pago': {str(e)}")
-                forma_pago = None
-
-            # Extraer "fecha_cargo"
-            try:
-                fecha_cargo_match = re.search(r"Fecha de cargo:\n\n(\d{2}/\d{2}/\d{4})", ocr_text)
-                if fecha_cargo_match:
-                    fecha_cargo_raw = fecha_cargo_match.group(1)
-                    fecha_cargo = datetime.strptime(fecha_cargo_raw, "%d/%m/%Y").strftime("%Y-%m-%d")
-                else:
-                    fecha_cargo = None
-            except Exception as e:
-                logger.error(f"Error al extraer 'fecha_cargo': {str(e)}")
-                fecha_cargo = None
-
-            # Extraer "mandato"
-
-
-            # Extraer "costo_potencia"
-            def extract_costo_potencia(ocr_text):
-                """
-                Extrae y calcula el costo de potencia sumando los valores flotantes encontrados después de "Días"
-                y antes del siguiente "€/KW día" o variantes como "E/KW día".
-                """
-                import re
-
-                try:
-                    # Localizar la sección en el OCR donde aparece "DETALLE DE LA FACTURA"
-                    potencia_section_match = re.search(r"DETALLE DE LA FACTURA", ocr_text, re.IGNORECASE)
-                    if not potencia_section_match:
-                        print("No se encontró la sección 'DETALLE DE LA FACTURA' en el OCR.")
-                        return 0.0  # Retornar 0 si no se encuentra la sección
-
-                    # Limitar el análisis del OCR al texto después de "DETALLE DE LA FACTURA"
-                    ocr_text_after_potencia = ocr_text[potencia_section_match.end():]
-
-                    # Inicializar lista para valores encontrados
-                    valores = []
-
-                    # Buscar todas las ocurrencias relevantes en formato "Días ... €/KW día\n\n<valor>"
-                    # Ahora también acepta "E/KW día" en lugar de "€/KW día"
-                    dias_matches = re.finditer(
-                        r"Días.*?[€E]/KW día\n\n([\d,\.]+)",  # Modificado para aceptar € o E
-                        ocr_text_after_potencia,
-                        re.IGNORECASE
-                    )
-                    for match in dias_matches:
-                        valor_raw = match.group(1)  # Capturar el valor después de "€/KW día\n\n" o "E/KW día\n\n"
-                        try:
-                            valor = float(valor_raw.replace(",", "."))  # Convertir a float
-                            valores.append(valor)  # Guardar el valor en la lista
-                        except ValueError:
-                            print(f"Valor inválido encontrado: {valor_raw}")
-
-                    # Sumar todos los valores capturados
-                    costo_potencia = round(sum(valores), 2)
-                    return costo_potencia
-
-                except Exception as e:
-                    print(f"Error al calcular 'costo_potencia': {str(e)}")
-                    return 0.0  # Valor predeterminado en caso de error
-
-
-            # Extraer "costo_potencia"
-
-
-            # Extraer "descuentos"
-                
-
-            # Extraer "impuestos"
-
-            match = re.search(r"Impuesto Electricidad\n\n([\d.,]+)", ocr_text, re.IGNORECASE)
-            impuestos = float(match.group(1).replace(",", ".")) if match else 0.0
-
-            # Extraer "total_a_pagar"
-
-            match = re.search(r"TOTAL IMPORTE FACTURA\n\n([\d.,]+)", ocr_text, re.IGNORECASE)
-            if match:
-                total_a_pagar_raw = match.group(1)
-                total_a_pagar = float(total_a_pagar_raw.replace(".", "").replace(",", ".") if "," in total_a_pagar_raw else total_a_pagar_raw.replace(",", ""))
-            else:
-                total_a_pagar = 0.0
-
-
-            # Extraer "consumo_punta"
-
-
-            # Extraer "consumo_valle"
-                
-
-            # Extraer "consumo_total"
-                
-
-            # Extraer "precio_efectivo_energia"
-                
+                response["Retry-After"] = str(admitted.retry_after)
+                return response
+
+        resume_stage = job.stage
+        job.status, job.error = "pending", ""
+        job.save(update_fields=["status", "error", "updated_at"])
+        process_invoice_job.delay(str(job.id))
+
+        return Response(
+            {
+                "status": "accepted",
+                "message": f"Reintentando el procesamiento desde la etapa '{resume_stage}'.",
+                "job_id": str(job.id),
+                "status_url": reverse("invoice-job-status", args=[job.id]),
+            },
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+
+class InvoiceQueueView(APIView):
+    """
+    Endpoint para consultar la ocupación de la cola de OCR de facturas.
+    """
+    permission_classes = [IsAuthenticated]
 
-            # Construir JSON
-            parsed_data = {
-                "nombre_cliente": nombre_cliente,
-                "numero_referencia": numero_referencia,
-                "fecha_emision": fecha_emision,
-                "periodo_facturacion": {
-                    "inicio": inicio,
-                    "fin": fin,
-                    "dias": dias,
-                },
-                "forma_pago": forma_pago,
-                "fecha_cargo": fecha_cargo,
-                "mandato": "SIN CODIGO DE MANDATO",
-                "desglose_cargos": {
-                    "costo_potencia": extract_costo_potencia(ocr_text),
-                    "costo_energia": costo_energia,
-                    "descuentos": 000,
-                    "impuestos": impuestos,
-                    "total_a_pagar": total_a_pagar,
-                },
-                "detalles_consumo": {
-                    "consumo_punta": 000,
-                    "consumo_valle": 000,
-                    "consumo_total": 000,
-                    "precio_efectivo_energia": 000,
+    @swagger_auto_schema(
+        operation_summary="Consultar la cola de procesamiento de facturas",
+        operation_description=(
+            "Devuelve cuántas facturas se están procesando (en total y del usuario autenticado) y la "
+            "capacidad máxima. Si la cola está llena, las subidas reciben 429."
+        ),
+        responses={
+            200: openapi.Response(
+                description="Estado de la cola obtenido exitosamente.",
+                examples={
+                    "application/json": {
+                        "status": "success",
+                        "queue_depth": 4,
+                        "capacity": 20,
+                        "user_in_flight": 1,
+                        "user_capacity": 2,
+                    }
                 },
-            }
-
-            return parsed_data
-
-        except Exception as e:
-            logger.error(f"Error al convertir OCR a JSON para Lidera Energia: {str(e)}")
-            return {
-                "error": "Error al convertir OCR a JSON para Lidera Energia."
-            }
-
-    def extract_naturgy_data(self, ocr_text):
-        """
-        Extrae los datos específicos de las facturas de Naturgy a partir del texto OCR.
-        """
-        try:
-            import re
-            from datetime import datetime
-
-            # Mapeo de meses en español a números
-            meses = {
-                "enero": "01", "febrero": "02", "marzo": "03", "abril": "04",
-                "mayo": "05", "junio": "06", "julio": "07", "agosto": "08",
-                "septiembre": "09", "octubre": "10", "noviembre": "11", "diciembre": "12"
-            }
-
-            # Inicializar valores por defecto
-            nombre_cliente = None
-            numero_referencia = None
-            fecha_emision = None
-            periodo_inicio = None
-            periodo_fin = None
-            dias = None
-            forma_pago = None
-            fecha_cargo = None
-            mandato = None
-            costo_potencia = None
-            costo_energia = None
-            descuentos = None
-            impuestos = None
-            total_a_pagar = None
-            consumo_punta = None
-            consumo_valle = None
-            consumo_total = None
-            precio_efectivo_energia = None
-
-            # Extraer "nombre_cliente"
-                
-
-            # Extraer "numero_referencia"
-                
-
-            # Extraer "fecha_emision"
-                
-
-            # Extraer "periodo_facturacion"
-                
-
-            # Extraer "dias"
-
-
-            # Extraer "forma_pago"
-                
-
-            # Extraer "fecha_cargo"
-                
-
-            # Extraer "mandato"
-
-
-            # Extraer valor de "costo_energia" (antes de " €\n\nEnergia consumida")
-
-
-            # Extraer "descuentos"
-                
-
-            # Extraer "impuestos"
-
-
-            # Extraer segundo valor de "impuestos" (antes de "TOTAL IMPORTE FACTURA")
-                
-
-            # Calcular el valor total de "impuestos"
-
-
-            # Extraer "total_a_pagar"
-
-
-            # Extraer "consumo_punta"
-
-
-            # Extraer "consumo_valle"
-                
-
-            # Extraer "consumo_total"
-                
-
-            # Extraer "precio_efectivo_energia"
-                
+            ),
+        },
+    )
+    def get(self, request):
+        queue_depth, user_in_flight = admission.current_load(user=request.user)
+        return Response(
+            {
+                "status": "success",
+                "queue_depth": queue_depth,
+                "capacity": settings.INVOICE_ADMISSION_MAX_JOBS,
+                "user_in_flight": user_in_flight,
+                "user_capacity": settings.INVOICE_ADMISSION_MAX_JOBS_PER_USER,
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+class InvoiceMetricsView(APIView):
+    """
+    Endpoint (solo administradores) con los histogramas de tiempo por etapa del procesamiento de facturas.
+    """
+    permission_classes = [IsAdminUser]
 
-            # Construir JSON
-            parsed_data = {
-                "nombre_cliente": "NATURGY TESTE",
-                "numero_referencia": "XXXXXXXXX",
-                "fecha_emision": "1990-01-01",
-                "periodo_facturacion": {
-                    "inicio": "1990-01-01",
-                    "fin": "1990-01-01",
-                    "dias": "00",
-                },
-                "forma_pago": "teste forma de pago",
-                "fecha_cargo": "1990-01-01",
-                "mandato": "XXXXXXXXX",
-                "desglose_cargos": {
-                    "costo_potencia": 000,
-                    "costo_energia": 000,
-                    "descuentos": 000,
-                    "impuestos": 000,
-                    "total_a_pagar": 000,
-                },
-                "detalles_consumo": {
-                    "consumo_punta": 000,
-                    "consumo_valle": 000,
-                    "consumo_total": 000,
-                    "precio_efectivo_energia": 000,
+    @swagger_auto_schema(
+        operation_summary="Histogramas de tiempo por etapa del procesamiento de facturas",
+        operation_description=(
+            "Devuelve, para las facturas procesadas en los últimos `days` días, histogramas del tiempo de cada "
+            "etapa (guardado, render, preprocesado, OCR, extracción, escritura en base de datos y subida a Cloudinary) "
+            "etiquetados por comercializadora y número de páginas, y la confianza media del OCR por comercializadora. "
+            "Con `output=prometheus` se devuelven en el formato de texto de Prometheus."
+        ),
+        manual_parameters=[
+            openapi.Parameter(
+                name="days",
+                in_=openapi.IN_QUERY,
+                description="Días hacia atrás que se incluyen (por defecto 7).",
+                type=openapi.TYPE_INTEGER,
+            ),
+            openapi.Parameter(
+                name="output",
+                in_=openapi.IN_QUERY,
+                description="'json' (por defecto) o 'prometheus'.",
+                type=openapi.TYPE_STRING,
+            ),
+        ],
+        responses={
+            200: openapi.Response(
+                description="Histogramas obtenidos exitosamente.",
+                examples={
+                    "application/json": {
+                        "status": "success",
+                        "buckets_ms": [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000],
+                        "histograms": [
+                            {
+                                "stage": "ocr",
+                                "supplier": "endesa",
+                                "pages": 3,
+                                "buckets": [0, 0, 0, 0, 0, 0, 1, 4, 5, 5, 5, 5],
+                                "count": 5,
+                                "sum_ms": 12840.5,
+                            }
+                        ],
+                        "ocr_confidence": {"endesa": 87.4},
+                    }
                 },
-            }
-
-            return parsed_data
-
-        except Exception as e:
-            logger.error(f"Error al convertir OCR a JSON para Naturgy: {str(e)}")
-            return {
-                "error": "Error al convertir OCR a JSON para Naturgy."
-            }
-    
-    def extract_edistribucion_data(self, ocr_text):
-        """
-        Extrae los datos específicos de las facturas de E-Distribución a partir del texto OCR.
-        """
+            ),
+            400: openapi.Response(
+                description="Parámetro `days` no válido.",
+                examples={"application/json": {"status": "error", "message": "El parámetro 'days' debe ser un entero positivo."}},
+            ),
+        },
+    )
+    def get(self, request):
         try:
-            import re
-            from datetime import datetime
-
-            # Mapeo de meses en español a números
-            meses = {
-                "enero": "01", "febrero": "02", "marzo": "03", "abril": "04",
-                "mayo": "05", "junio": "06", "julio": "07", "agosto": "08",
-                "septiembre": "09", "octubre": "10", "noviembre": "11", "diciembre": "12"
-            }
-
-            # Inicializar valores por defecto
-            nombre_cliente = None
-            numero_referencia = None
-            fecha_emision = None
-            periodo_inicio = None
-            periodo_fin = None
-            dias = None
-            forma_pago = None
-            fecha_cargo = None
-            mandato = None
-            costo_potencia = None
-            costo_energia = None
-            descuentos = None
-            impuestos = None
-            total_a_pagar = None
-            consumo_punta = None
-            consumo_valle = None
-            consumo_total = None
-            precio_efectivo_energia = None
-
-            # Extraer "nombre_cliente"
-                
-
-            # Extraer "numero_referencia"
-                
-
-            # Extraer "fecha_emision"
-                
-
-            # Extraer "periodo_facturacion"
-                
-
-            # Extraer "dias"
-
-
-            # Extraer "forma_pago"
-                
-
-            # Extraer "fecha_cargo"
-                
-
-            # Extraer "mandato"
-
-
-            # Extraer valor de "costo_energia" (antes de " €\n\nEnergia consumida")
-
-
-            # Extraer "descuentos"
-                
-
-            # Extraer "impuestos"
-
-
-            # Extraer segundo valor de "impuestos" (antes de "TOTAL IMPORTE FACTURA")
-                
-
-            # Calcular el valor total de "impuestos"
-
-
-            # Extraer "total_a_pagar"
-
-
-            # Extraer "consumo_punta"
-
-
-            # Extraer "consumo_valle"
-                
-
-            # Extraer "consumo_total"
-                
-
-            # Extraer "precio_efectivo_energia"
-                
+            days = int(request.query_params.get("days", 7))
+            if days <= 0:
+                raise ValueError
+        except ValueError:
+            return Response(
+                {"status": "error", "message": "El parámetro 'days' debe ser un entero positivo."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
 
-            # Construir JSON
-            parsed_data = {
-                "nombre_cliente": "E-DISTRIBUCIÓN TESTE",
-                "numero_referencia": "XXXXXXXXX",
-                "fecha_emision": "1990-01-01",
-                "periodo_facturacion": {
-                    "inicio": "1990-01-01",
-                    "fin": "1990-01-01",
-                    "dias": "00",
-                },
-                "forma_pago": "teste forma de pago",
-                "fecha_cargo": "1990-01-01",
-                "mandato": "XXXXXXXXX",
-                "desglose_cargos": {
-                    "costo_potencia": 000,
-                    "costo_energia": 000,
-                    "descuentos": 000,
-                    "impuestos": 000,
-                    "total_a_pagar": 000,
-                },
-                "detalles_consumo": {
-                    "consumo_punta": 000,
-                    "consumo_valle": 000,
-                    "consumo_total": 000,
-                    "precio_efectivo_energia": 000,
+        invoices = Invoice.objects.filter(created_at__gte=now() - timedelta(days=days))
+        histograms = stage_histograms(invoices)
+
+        if request.query_params.get("output") == "prometheus":
+            return HttpResponse(render_prometheus(histograms), content_type="text/plain; version=0.0.4")
+
+        ocr_confidence = (
+            invoices.exclude(ocr_confidence=None)
+            .values("processing_metrics__supplier")
+            .annotate(mean=Avg("ocr_confidence"))
+        )
+        return Response(
+            {
+                "status": "success",
+                "buckets_ms": list(BUCKETS_MS),
+                "histograms": [
+                    {"stage": stage, "supplier": supplier, "pages": pages, **histogram}
+                    for (stage, supplier, pages), histogram in sorted(histograms.items())
+                ],
+                "ocr_confidence": {
+                    row["processing_metrics__supplier"] or "unknown": round(row["mean"], 2) for row in ocr_confidence
                 },
-            }
+            },
+            status=status.HTTP_200_OK,
+        )
 
-            return parsed_data
-
-        except Exception as e:
-            logger.error(f"Error al convertir OCR a JSON para E-Distribución: {str(e)}")
-            return {
-                "error": "Error al convertir OCR a JSON para E-Distribución."
-            }
 
 ################################################################################################################################
 ############################################ GET - VISUALIZAR FATURA POR ID ####################################################
@@ -1342,7 +701,10 @@ class InvoiceImageView(APIView):
         operation_summary="Obtener la URL de la imagen de una factura",
         operation_description=(
             "Permite a un usuario autenticado obtener la URL de la imagen asociada a una factura específica. "
-            "La factura debe pertenecer al usuario autenticado."
+            "La factura debe pertenecer al usuario autenticado. La imagen se publica en segundo plano después "
+            "de guardar la factura: mientras tanto (o si Cloudinary no está disponible) `image_url` y `renditions` son null. "
+            "`renditions` contiene la miniatura, la vista previa y el original; las dos primeras se entregan "
+            "redimensionadas y comprimidas (WebP o JPEG) por la CDN de Cloudinary."
         ),
         responses={
             200: openapi.Response(
@@ -1350,7 +712,12 @@ class InvoiceImageView(APIView):
                 examples={
                     "application/json": {
                         "status": "success",
-                        "image_url": "https://example.com/images/factura123.jpg"
+                        "image_url": "https://res.cloudinary.com/demo/image/upload/v1/facturas/factura123.jpg",
+                        "renditions": {
+                            "thumbnail": "https://res.cloudinary.com/demo/image/upload/c_limit,w_200,h_200,q_80,f_webp/v1/facturas/factura123.jpg",
+                            "medium": "https://res.cloudinary.com/demo/image/upload/c_limit,w_800,h_800,q_80,f_webp/v1/facturas/factura123.jpg",
+                            "original": "https://res.cloudinary.com/demo/image/upload/v1/facturas/factura123.jpg"
+                        }
                     }
                 },
             ),
@@ -1393,9 +760,13 @@ class InvoiceImageView(APIView):
                     status=status.HTTP_404_NOT_FOUND,
                 )
 
-            # Devolver la URL de la imagen
+            # Devolver la URL de la imagen y de sus variantes
             return Response(
-                {"status": "success", "image_url": invoice.image_url},
+                {
+                    "status": "success",
+                    "image_url": invoice.image_url,
+                    "renditions": cloudinary_renditions(invoice.image_url),
+                },
                 status=status.HTTP_200_OK,
             )
 
@@ -0,0 +1,310 @@
+################################################################################################################################
+############################################ INGESTA MASIVA DE MEDICIONES ######################################################
+################################################################################################################################
+
+# Carga exportaciones de contadores (NDJSON o CSV) leyéndolas como un flujo, fila a fila, sin cargar el archivo
+# en memoria. Cada fila se valida con el esquema compilado una sola vez al importar el módulo; las filas válidas
+# se acumulan en lotes de MEASUREMENT_INGEST_BATCH_SIZE, cuyos DNI se resuelven con una sola consulta (con caché
+# entre lotes) y se escriben con bulk_create. Los errores se informan por línea sin detener la carga.
+
+import csv
+import json
+import logging
+from datetime import date, datetime
+from django.conf import settings
+from django.db import transaction
+from django.utils.timezone import is_naive, make_aware
+from apps.general.models import Measurement, User
+
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("ndjson", "csv")
+
+# Tipos de contenido aceptados por el endpoint para cada formato
+CONTENT_TYPES = {
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+    "text/csv": "csv",
+}
+
+# Campos de `Measurement.data`: (tipo, obligatorio). En CSV cada campo es una columna con su ruta separada
+# por puntos ("consumo_por_franja_horaria.punta"). Los campos que no están en el esquema se descartan
+MEASUREMENT_DATA_SCHEMA = {
+    "consumo_total": ("number", True),
+    "periodo_medicion": {"inicio": ("date", False), "fin": ("date", False)},
+    "tension_promedio": ("number", False),
+    "corriente_promedio": {"punta": ("number", False), "valle": ("number", False)},
+    "eventos_registrados": {"interrupciones": ("integer", False), "caidas_de_tension": ("integer", False)},
+    "potencia_maxima_demandada": {"punta": ("number", False), "valle": ("number", False)},
+    "consumo_por_franja_horaria": {"punta": ("number", False), "valle": ("number", False)},
+    "factor_de_potencia_promedio": ("number", False),
+}
+
+
+class RowError(ValueError):
+    """
+    Fila que no cumple el esquema o no se puede guardar.
+    """
+
+
+def to_number(value):
+    if isinstance(value, bool):
+        raise RowError("se esperaba un número")
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(str(value).replace(",", "."))
+    except ValueError:
+        raise RowError("se esperaba un número")
+
+
+def to_integer(value):
+    number = to_number(value)
+    if number != int(number):
+        raise RowError("se esperaba un número entero")
+    return int(number)
+
+
+def to_date(value):
+    # Se guarda como texto ISO (YYYY-MM-DD), igual que las mediciones existentes
+    try:
+        return date.fromisoformat(str(value)[:10]).isoformat()
+    except ValueError:
+        raise RowError("se esperaba una fecha YYYY-MM-DD")
+
+
+def to_datetime(value):
+    try:
+        parsed = datetime.fromisoformat(str(value))
+    except ValueError:
+        raise RowError("se esperaba una fecha YYYY-MM-DD")
+    return make_aware(parsed) if is_naive(parsed) else parsed
+
+
+CONVERTERS = {"number": to_number, "integer": to_integer, "date": to_date}
+
+
+def compile_schema(schema, path=()):
+    """
+    Convierte el esquema anidado en una lista plana de (ruta, nombre con puntos, conversor, obligatorio),
+    para validar cada fila sin volver a recorrer el esquema.
+    """
+    fields = []
+    for name, spec in schema.items():
+        if isinstance(spec, dict):
+            fields += compile_schema(spec, path + (name,))
+        else:
+            kind, required = spec
+            fields.append((path + (name,), ".".join(path + (name,)), CONVERTERS[kind], required))
+    return fields
+
+
+DATA_FIELDS = compile_schema(MEASUREMENT_DATA_SCHEMA)
+
+
+def validate_record(record):
+    """
+    Valida una fila ({"user_dni", "measurement_start", "measurement_end", "data": {...}}) y retorna
+    (dni, inicio, fin, data) con los valores convertidos. Lanza RowError con el campo que falla.
+    """
+    if not isinstance(record, dict):
+        raise RowError("la fila debe ser un objeto")
+
+    dni = str(record.get("user_dni") or "").strip()
+    if not dni:
+        raise RowError("user_dni: campo obligatorio")
+
+    period = []
+    for name in ("measurement_start", "measurement_end"):
+        if record.get(name) in (None, ""):
+            raise RowError(f"{name}: campo obligatorio")
+        try:
+            period.append(to_datetime(record[name]))
+        except RowError as e:
+            raise RowError(f"{name}: {e}")
+    if period[0] > period[1]:
+        raise RowError("measurement_start: posterior a measurement_end")
+
+    source = record.get("data")
+    if not isinstance(source, dict):
+        raise RowError("data: campo obligatorio")
+
+    data = {}
+    for path, dotted, convert, required in DATA_FIELDS:
+        value = source
+        for key in path:
+            value = value.get(key) if isinstance(value, dict) else None
+        if value in (None, ""):
+            if required:
+                raise RowError(f"data.{dotted}: campo obligatorio")
+            continue
+        try:
+            value = convert(value)
+        except RowError as e:
+            raise RowError(f"data.{dotted}: {e}")
+        target = data
+        for key in path[:-1]:
+            target = target.setdefault(key, {})
+        target[path[-1]] = value
+    return dni, period[0], period[1], data
+
+
+################################################################################################################################
+############################################ LECTURA DE LOS FORMATOS ###########################################################
+################################################################################################################################
+
+# Cada lector produce (número de línea, fila, error): la fila es un dict con la forma de validate_record o None
+# si la línea no se pudo leer (el error explica por qué).
+
+def decode_lines(lines):
+    # Los bytes que no son UTF-8 se sustituyen: la fila afectada fallará al validarla, no toda la carga
+    for line in lines:
+        yield line.decode("utf-8", errors="replace") if isinstance(line, bytes) else line
+
+
+def read_ndjson(lines):
+    for line_number, line in enumerate(lines, start=1):
+        try:
+            if isinstance(line, bytes):
+                line = line.decode("utf-8")
+            if not line.strip():
+                continue
+            yield line_number, json.loads(line), None
+        except ValueError as e:
+            yield line_number, None, f"JSON no válido: {str(e)}"
+
+
+def read_csv(lines):
+    """
+    Las columnas de `data` se indican con su ruta ("consumo_total", "consumo_por_franja_horaria.punta"),
+    con o sin el prefijo "data.".
+    """
+    reader = csv.DictReader(decode_lines(lines))
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            # Línea mal formada (por ejemplo, un campo demasiado largo): se rechaza solo esa fila. El lector
+            # no cuenta la línea que falló, que es la siguiente a la última leída
+            yield reader.line_num + 1, None, f"CSV no válido: {str(e)}"
+            continue
+        record = {"data": {}}
+        for column, value in row.items():
+            if column is None:
+                continue
+            column = column.strip()
+            if column in ("user_dni", "measurement_start", "measurement_end"):
+                record[column] = value
+                continue
+            path = column.removeprefix("data.").split(".")
+            target = record["data"]
+            for key in path[:-1]:
+                target = target.setdefault(key, {})
+            target[path[-1]] = value
+        yield reader.line_num, record, None
+
+
+READERS = {"ndjson": read_ndjson, "csv": read_csv}
+
+
+################################################################################################################################
+############################################ ESCRITURA POR LOTES ###############################################################
+################################################################################################################################
+
+class MeasurementIngestion:
+    """
+    Valida y guarda las filas de un flujo en lotes. Si `only_dni` no es None solo se admiten filas de ese
+    usuario (los usuarios que no son administradores solo pueden cargar sus propias mediciones).
+    """
+
+    def __init__(self, batch_size=None, only_dni=None, max_errors=None):
+        self.batch_size = batch_size or settings.MEASUREMENT_INGEST_BATCH_SIZE
+        self.max_errors = settings.MEASUREMENT_INGEST_MAX_ERRORS if max_errors is None else max_errors
+        self.only_dni = only_dni
+        self.user_ids = {}  # DNI -> user_id (None si no existe), compartido entre lotes
+        self.rows = 0
+        self.created = 0
+        self.error_count = 0
+        self.errors = []
+
+    def add_error(self, line_number, message):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line_number, "error": message})
+
+    def run(self, records, on_batch=None):
+        """
+        Procesa las filas de un lector y retorna el informe. `on_batch` se llama tras guardar cada lote.
+        """
+        batch = []
+        for line_number, record, error in records:
+            self.rows += 1
+            if error:
+                self.add_error(line_number, error)
+                continue
+            try:
+                batch.append((line_number, validate_record(record)))
+            except RowError as e:
+                self.add_error(line_number, str(e))
+                continue
+            if len(batch) >= self.batch_size:
+                self.write_batch(batch)
+                batch = []
+                if on_batch:
+                    on_batch(self.report())
+        if batch:
+            self.write_batch(batch)
+        return self.report()
+
+    def resolve_users(self, dnis):
+        """
+        Resuelve con una sola consulta los DNI que aún no están en la caché.
+        """
+        missing = [dni for dni in dnis if dni not in self.user_ids]
+        if missing:
+            self.user_ids.update(dict.fromkeys(missing))
+            self.user_ids.update(User.objects.filter(dni__in=missing).values_list("dni", "user_id"))
+
+    def write_batch(self, batch):
+        self.resolve_users({row[0] for _, row in batch})
+        measurements, lines = [], []
+        for line_number, (dni, start, end, data) in batch:
+            if self.only_dni is not None and dni != self.only_dni:
+                self.add_error(line_number, "user_dni: solo puedes cargar tus propias mediciones")
+            elif self.user_ids[dni] is None:
+                self.add_error(line_number, f"user_dni: usuario con DNI {dni} no encontrado")
+            else:
+                measurements.append(
+                    Measurement(user_id=self.user_ids[dni], measurement_start=start, measurement_end=end, data=data)
+                )
+                lines.append(line_number)
+
+        try:
+            with transaction.atomic():
+                Measurement.objects.bulk_create(measurements, batch_size=self.batch_size)
+        except Exception as e:
+            logger.error(f"Error al guardar un lote de {len(measurements)} mediciones: {str(e)}")
+            for line_number in lines:
+                self.add_error(line_number, f"Error al guardar el lote: {str(e)}")
+            return
+        self.created += len(measurements)
+
+    def report(self):
+        return {
+            "rows": self.rows,
+            "created": self.created,
+            "errors": self.error_count,
+            "error_details": self.errors,
+            "errors_truncated": self.error_count > len(self.errors),
+        }
+
+
+def ingest_measurements(lines, file_format, batch_size=None, only_dni=None, on_batch=None):
+    """
+    Carga las mediciones de un flujo de líneas (str o bytes) en formato `file_format` ("ndjson" o "csv").
+    """
+    return MeasurementIngestion(batch_size=batch_size, only_dni=only_dni).run(READERS[file_format](lines), on_batch=on_batch)
@@ -0,0 +1,223 @@
+################################################################################################################################
+############################################ CURVAS DE CARGA (LECTURAS HORARIAS Y CUARTOHORARIAS) ###############################
+################################################################################################################################
+
+# Los contadores inteligentes entregan el consumo de cada hora o cuarto de hora. Se guarda un IntervalReading por
+# usuario y día con los kWh de cada intervalo en un array de ancho fijo (24 o 96 float32), y los agregados se
+# calculan con NumPy sobre la matriz días x intervalos, sin recorrer las lecturas una a una. Los agregados tienen
+# la forma de `Measurement.data` (consumo_total, punta/valle...) para que las comparaciones sigan funcionando, más
+# el consumo de cada periodo de la 2.0TD (tariff_periods.py).
+
+import logging
+import numpy as np
+from datetime import datetime, time, timedelta
+from django.utils.timezone import make_aware, now
+from apps.general.models import IntervalReading, Measurement
+from .tariff_periods import PERIODS, PeriodCalendar
+
+
+logger = logging.getLogger(__name__)
+
+SLOTS_PER_DAY = {60: 24, 15: 96}
+
+# Todas las curvas se agregan en cuartos de hora: las horarias se reparten en cuatro cuartos iguales
+QUARTER_HOURS = 96
+
+DTYPE = "<f4"
+
+
+def encode_values(values):
+    return np.asarray(values, dtype=DTYPE).tobytes()
+
+
+def decode_values(raw):
+    return np.frombuffer(bytes(raw), dtype=DTYPE)
+
+
+def store_readings(user_id, timestamps, kwh, resolution_minutes):
+    """
+    Guarda lecturas de un usuario: `timestamps` (inicio de cada intervalo, hora local) y `kwh` son arrays
+    del mismo tamaño. Se agrupan por día con NumPy y se combinan con las lecturas ya guardadas de esos días,
+    de modo que un día puede llegar en varios bloques. Las lecturas de un mismo intervalo se suman (la hora
+    repetida del cambio de hora de octubre). Retorna el número de días escritos.
+    """
+    if resolution_minutes not in SLOTS_PER_DAY:
+        raise ValueError(f"Resolución no soportada: {resolution_minutes} minutos.")
+    slots = SLOTS_PER_DAY[resolution_minutes]
+    minutes = np.asarray(timestamps, dtype="datetime64[m]")
+    kwh = np.asarray(kwh, dtype=np.float64)
+    if minutes.shape != kwh.shape:
+        raise ValueError("Las marcas de tiempo y los consumos deben tener el mismo tamaño.")
+    if not len(minutes):
+        return 0
+
+    days = minutes.astype("datetime64[D]")
+    slot_index = (minutes - days).astype(np.int64) // resolution_minutes
+    unique_days, day_index = np.unique(days, return_inverse=True)
+
+    totals = np.zeros((len(unique_days), slots))
+    counts = np.zeros((len(unique_days), slots), dtype=np.int64)
+    np.add.at(totals, (day_index, slot_index), kwh)
+    np.add.at(counts, (day_index, slot_index), 1)
+    matrix = np.where(counts > 0, totals, np.nan)
+
+    # Los intervalos sin lectura nueva conservan el valor guardado
+    day_list = unique_days.tolist()
+    stored = IntervalReading.objects.filter(user_id=user_id, day__in=day_list).values_list("day", "resolution_minutes", "values")
+    position = {day: index for index, day in enumerate(day_list)}
+    for day, stored_resolution, raw in stored:
+        if stored_resolution != resolution_minutes:
+            raise ValueError(f"El día {day} ya tiene lecturas con resolución de {stored_resolution} minutos.")
+        row = matrix[position[day]]
+        np.copyto(row, decode_values(raw), where=np.isnan(row))
+
+    IntervalReading.objects.bulk_create(
+        [
+            IntervalReading(user_id=user_id, day=day, resolution_minutes=resolution_minutes, values=encode_values(row))
+            for day, row in zip(day_list, matrix)
+        ],
+        update_conflicts=True,
+        unique_fields=["user", "day"],
+        update_fields=["resolution_minutes", "values", "updated_at"],
+    )
+    return len(day_list)
+
+
+def load_curves(user_ids, start, end):
+    """
+    Retorna (usuarios, días, matriz) de las lecturas de `user_ids` entre `start` y `end` (incluidos), con una
+    fila por usuario y día ordenadas por usuario y día: `días` es un array datetime64[D] y cada fila de la
+    matriz tiene los 96 cuartos de hora del día (kWh, NaN sin lectura).
+    """
+    rows = list(
+        IntervalReading.objects.filter(user_id__in=user_ids, day__range=(start, end))
+        .order_by("user_id", "day")
+        .values_list("user_id", "day", "resolution_minutes", "values")
+    )
+    users = np.array([row[0] for row in rows], dtype=np.int64)
+    days = np.array([row[1] for row in rows], dtype="datetime64[D]")
+    resolutions = np.array([row[2] for row in rows], dtype=np.int64)
+    matrix = np.empty((len(rows), QUARTER_HOURS))
+    # Las filas de cada resolución se decodifican de una vez
+    for resolution_minutes, slots in SLOTS_PER_DAY.items():
+        selected = np.flatnonzero(resolutions == resolution_minutes)
+        if len(selected):
+            values = np.frombuffer(b"".join(bytes(rows[index][3]) for index in selected), dtype=DTYPE).reshape(-1, slots)
+            factor = QUARTER_HOURS // slots
+            matrix[selected] = np.repeat(values / factor, factor, axis=1)
+    return users, days, matrix
+
+
+def load_curve(user_id, start, end):
+    """
+    Retorna (días, matriz) de las lecturas de un usuario entre `start` y `end` (incluidos).
+    """
+    _, days, matrix = load_curves([user_id], start, end)
+    return days, matrix
+
+
+def summarize(days, matrix, calendar):
+    """
+    Agrega una curva con la forma de `Measurement.data`, clasificando cada cuarto de hora en los periodos de
+    la 2.0TD con `calendar`. Punta son P1 y P2 y valle es P3 (los periodos de potencia de la 2.0TD). La
+    potencia máxima demandada es la media (kW) del intervalo de mayor consumo de cada franja.
+    """
+    periods = calendar.classify_days(days, QUARTER_HOURS)
+    readings = ~np.isnan(matrix)
+    kwh = np.where(readings, matrix, 0.0)
+    kw = kwh * 4  # kWh de un cuarto de hora -> kW medios
+    by_period = np.bincount(periods.ravel() - 1, weights=kwh.ravel(), minlength=3)
+    valle = periods == 3
+
+    def peak(mask):
+        return round(float(kw[mask & readings].max()), 3) if (mask & readings).any() else None
+
+    return {
+        "consumo_total": round(float(kwh.sum()), 3),
+        "periodo_medicion": {"inicio": str(days[0]), "fin": str(days[-1])},
+        "consumo_por_franja_horaria": {
+            "punta": round(float(by_period[0] + by_period[1]), 3),
+            "valle": round(float(by_period[2]), 3),
+        },
+        "consumo_por_periodo": {name: round(float(total), 3) for name, total in zip(PERIODS, by_period)},
+        "potencia_maxima_demandada": {"punta": peak(~valle), "valle": peak(valle)},
+        # Cobertura de la curva: días con lecturas y proporción de intervalos leídos
+        "intervalos": {"dias": int(len(days)), "cobertura": round(float(readings.mean()), 4)},
+    }
+
+
+def rollup_period(user_id, start, end):
+    """
+    Agregado de la curva de un periodo cualquiera (por ejemplo, el de una factura), o None sin lecturas.
+    """
+    days, matrix = load_curve(user_id, start, end)
+    return summarize(days, matrix, PeriodCalendar(days[0], days[-1])) if len(days) else None
+
+
+def rollup_users(user_ids, start, end):
+    """
+    Agregados por mes natural de las curvas de varios usuarios entre `start` y `end`, con una consulta y un
+    calendario de periodos para todo el lote: {user_id: {primer día del mes: data}}.
+    """
+    users, days, matrix = load_curves(user_ids, start, end)
+    if not len(days):
+        return {}
+    calendar = PeriodCalendar(days.min(), days.max())
+    months = days.astype("datetime64[M]")
+    # Las filas están ordenadas por usuario y día: cada (usuario, mes) es un tramo contiguo
+    boundaries = np.flatnonzero((users[1:] != users[:-1]) | (months[1:] != months[:-1])) + 1
+    rollups = {}
+    for first, last in zip(np.concatenate(([0], boundaries)), np.concatenate((boundaries, [len(days)]))):
+        month = months[first].astype("datetime64[D]").item()
+        rollups.setdefault(int(users[first]), {})[month] = summarize(days[first:last], matrix[first:last], calendar)
+    return rollups
+
+
+def monthly_rollups(user_id, start, end):
+    """
+    Agregados por mes natural de la curva de un usuario entre `start` y `end`: {primer día del mes: data}.
+    """
+    return rollup_users([user_id], start, end).get(user_id, {})
+
+
+def save_measurement(user_id, start, end, data):
+    """
+    Crea o actualiza el Measurement del usuario para el periodo [start, end].
+    """
+    measurement_start = make_aware(datetime.combine(start, time.min))
+    measurement_end = make_aware(datetime.combine(end, time.min))
+    updated = Measurement.objects.filter(
+        user_id=user_id, measurement_start=measurement_start, measurement_end=measurement_end
+    ).update(data=data, updated_at=now())
+    if not updated:
+        Measurement.objects.create(
+            user_id=user_id, measurement_start=measurement_start, measurement_end=measurement_end, data=data
+        )
+
+
+def materialize_measurements(user_id, periods):
+    """
+    Crea o actualiza un Measurement por cada periodo (inicio, fin) con el agregado de la curva, para que las
+    comparaciones con facturas usen las lecturas de intervalo. Retorna el número de mediciones escritas.
+    """
+    written = 0
+    for start, end in periods:
+        data = rollup_period(user_id, start, end)
+        if data is None:
+            continue
+        save_measurement(user_id, start, end, data)
+        written += 1
+    return written
+
+
+def month_periods(start, end):
+    """
+    Meses naturales (primer día, último día) que se solapan con [start, end].
+    """
+    periods = []
+    month = start.replace(day=1)
+    while month <= end:
+        next_month = (month + timedelta(days=32)).replace(day=1)
+        periods.append((month, next_month - timedelta(days=1)))
+        month = next_month
+    return periods
@@ -0,0 +1,104 @@
+################################################################################################################################
+############################################ PERIODOS HORARIOS DE LA TARIFA 2.0TD ##############################################
+################################################################################################################################
+
+# La energía de la tarifa 2.0TD (Circular 3/2020 de la CNMC) se factura en tres periodos según la hora local:
+#   - Lunes a viernes laborables: P1 (punta) 10-14 y 18-22, P2 (llano) 8-10, 14-18 y 22-24, P3 (valle) 0-8.
+#   - Sábados, domingos y festivos nacionales: P3 todo el día.
+# Los festivos son los nacionales de fecha fija (se excluyen los sustituibles y los que no tienen fecha fija).
+# La clasificación es vectorial: se precalcula un calendario de días laborables para el rango de fechas y cada
+# lectura se resuelve con una búsqueda en ese calendario y en la tabla de horas, sin bucles por lectura.
+
+import numpy as np
+
+
+PERIODS = ("P1", "P2", "P3")
+
+# Periodo (1-3) de cada hora de un día laborable
+WORKDAY_HOUR_PERIODS = np.array(
+    [3] * 8 + [2] * 2 + [1] * 4 + [2] * 4 + [1] * 4 + [2] * 2,
+    dtype=np.int8,
+)
+
+# Festivos nacionales de fecha fija (mes, día)
+NATIONAL_HOLIDAYS = ((1, 1), (1, 6), (5, 1), (8, 15), (10, 12), (11, 1), (12, 6), (12, 8), (12, 25))
+HOLIDAY_CODES = np.array([month * 100 + day for month, day in NATIONAL_HOLIDAYS])
+
+
+def working_days(days):
+    """
+    Array booleano: True si el día (datetime64[D]) es laborable (ni fin de semana ni festivo nacional).
+    """
+    days = np.asarray(days, dtype="datetime64[D]")
+    # El 1970-01-01 (día 0 de datetime64) fue jueves: (día + 3) % 7 es el día de la semana con lunes = 0
+    weekday = (days.astype(np.int64) + 3) % 7
+    months = days.astype("datetime64[M]")
+    month_day = (months.astype(np.int64) % 12 + 1) * 100 + (days - months.astype("datetime64[D]")).astype(np.int64) + 1
+    return (weekday < 5) & ~np.isin(month_day, HOLIDAY_CODES)
+
+
+class PeriodCalendar:
+    """
+    Calendario precalculado de días laborables entre `first_day` y `last_day`. Clasifica arrays de lecturas
+    en periodos con dos búsquedas por índice; se reutiliza para todos los clientes de un mismo lote.
+    """
+
+    def __init__(self, first_day, last_day):
+        self.first_day = np.datetime64(first_day, "D")
+        self.last_day = np.datetime64(last_day, "D")
+        self.working = working_days(np.arange(self.first_day, self.last_day + 1))
+
+    def day_offsets(self, days):
+        offsets = (np.asarray(days, dtype="datetime64[D]") - self.first_day).astype(np.int64)
+        if len(offsets) and (offsets.min() < 0 or offsets.max() >= len(self.working)):
+            raise ValueError("Hay lecturas fuera del rango del calendario.")
+        return offsets
+
+    def classify(self, timestamps):
+        """
+        Periodo (1-3, int8) de cada lectura; `timestamps` es el inicio de cada intervalo en hora local.
+        """
+        minutes = np.asarray(timestamps, dtype="datetime64[m]")
+        days = minutes.astype("datetime64[D]")
+        hours = (minutes - days).astype(np.int64) // 60
+        return np.where(self.working[self.day_offsets(days)], WORKDAY_HOUR_PERIODS[hours], np.int8(3)).astype(np.int8)
+
+    def classify_days(self, days, slots_per_day):
+        """
+        Matriz días x intervalos con el periodo (1-3) de cada intervalo de una curva de ancho fijo.
+        """
+        slot_periods = np.repeat(WORKDAY_HOUR_PERIODS, slots_per_day // 24)
+        working = self.working[self.day_offsets(days)]
+        return np.where(working[:, np.newaxis], slot_periods[np.newaxis, :], np.int8(3)).astype(np.int8)
+
+
+def calendar_for(timestamps):
+    minutes = np.asarray(timestamps, dtype="datetime64[m]")
+    return PeriodCalendar(minutes.min(), minutes.max())
+
+
+def period_sums(timestamps, kwh, calendar=None):
+    """
+    kWh de cada periodo: {"P1": ..., "P2": ..., "P3": ...}. Las lecturas NaN no suman.
+    """
+    kwh = np.asarray(kwh, dtype=np.float64)
+    if not len(kwh):
+        return dict.fromkeys(PERIODS, 0.0)
+    periods = (calendar or calendar_for(timestamps)).classify(timestamps)
+    totals = np.bincount(periods, weights=np.nan_to_num(kwh), minlength=4)
+    return {name: float(totals[index]) for index, name in enumerate(PERIODS, start=1)}
+
+
+def grouped_period_sums(group_ids, timestamps, kwh, calendar=None):
+    """
+    kWh por grupo y periodo para lecturas de muchos clientes (o meses) a la vez: `group_ids` son enteros
+    0..n-1 del mismo tamaño que las lecturas. Retorna una matriz n x 3 (columnas P1, P2, P3).
+    """
+    group_ids = np.asarray(group_ids, dtype=np.int64)
+    kwh = np.asarray(kwh, dtype=np.float64)
+    groups = int(group_ids.max()) + 1 if len(group_ids) else 0
+    if not groups:
+        return np.zeros((0, 3))
+    periods = (calendar or calendar_for(timestamps)).classify(timestamps)
+    totals = np.bincount(group_ids * 3 + (periods - 1), weights=np.nan_to_num(kwh), minlength=groups * 3)
+    return totals.reshape(groups, 3)
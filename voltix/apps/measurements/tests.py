@@ -1,3 +1,23 @@
+import os
+import csv
+import json
+import time
+import tempfile
+import numpy as np
+from datetime import date
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from apps.general.models import IntervalReading, Measurement, User
+from apps.measurements import intervals
+from apps.measurements.ingestion import ingest_measurements
+from apps.measurements.tariff_periods import PeriodCalendar, grouped_period_sums, period_sums, working_days
+
+
 # from django.test import TestCase
 # from django.urls import reverse
 # from rest_framework.test import APIClient
@@ -83,4 +103,189 @@
 
 # python site_app/manage.py test measurements.tests --keepdb -v 2
 
-# """
\ No newline at end of file
+# """
+
+
+class MeasurementIngestionTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(dni="123456789", fullname="Test User", email="testuser@example.com", password="x")
+        self.other = User.objects.create_user(dni="987654321", fullname="Other User", email="other@example.com", password="x")
+        self.client.force_authenticate(user=self.user)
+
+    def row(self, dni="123456789", **data):
+        return {
+            "user_dni": dni, "measurement_start": "2024-01-01", "measurement_end": "2024-01-31",
+            "data": {"consumo_total": 220, "consumo_por_franja_horaria": {"punta": 150.0, "valle": 70.0}, **data},
+        }
+
+    def test_ndjson_rows_are_validated_and_written_in_batches(self):
+        lines = [json.dumps(self.row(dni)) for dni in ("123456789", "987654321") * 5]
+        lines += ["{no es json", json.dumps(self.row(consumo_total="mucho")), json.dumps(self.row(dni="000"))]
+
+        with CaptureQueriesContext(connection) as queries:
+            report = ingest_measurements(iter(lines), "ndjson", batch_size=4)
+
+        self.assertEqual((report["rows"], report["created"], report["errors"]), (13, 10, 3))
+        self.assertEqual([error["line"] for error in report["error_details"]], [11, 12, 13])
+        self.assertIn("data.consumo_total", report["error_details"][1]["error"])
+        self.assertIn("000", report["error_details"][2]["error"])
+        # Una consulta de DNI por lote con usuarios nuevos y un INSERT por lote, no una por fila
+        self.assertLess(len(queries), 20)
+        self.assertEqual(Measurement.objects.filter(user=self.other).count(), 5)
+        measurement = Measurement.objects.first()
+        self.assertEqual(measurement.data, {"consumo_total": 220, "consumo_por_franja_horaria": {"punta": 150.0, "valle": 70.0}})
+        self.assertEqual(measurement.measurement_start.date().isoformat(), "2024-01-01")
+
+    def test_csv_columns_are_field_paths(self):
+        lines = [
+            "user_dni,measurement_start,measurement_end,consumo_total,consumo_por_franja_horaria.punta,eventos_registrados.interrupciones\n",
+            "123456789,2024-01-01,2024-01-31,\"220,5\",150,1\n",
+            "123456789,2024-02-01,2024-01-31,100,50,0\n",
+        ]
+
+        report = ingest_measurements(iter(lines), "csv")
+
+        self.assertEqual((report["created"], report["errors"]), (1, 1))
+        self.assertEqual(report["error_details"][0]["line"], 3)
+        self.assertEqual(
+            Measurement.objects.get().data,
+            {"consumo_total": 220.5, "consumo_por_franja_horaria": {"punta": 150.0}, "eventos_registrados": {"interrupciones": 1}},
+        )
+
+    def test_malformed_csv_line_is_a_rejected_row(self):
+        lines = [
+            "user_dni,measurement_start,measurement_end,consumo_total\n",
+            "123456789,2024-01-01,2024-01-31,100\n",
+            "123456789,2024-02-01,2024-02-29," + "9" * (csv.field_size_limit() + 1) + "\n",
+            "123456789,2024-03-01,2024-03-31,100\n",
+        ]
+
+        report = ingest_measurements(iter(lines), "csv")
+
+        self.assertEqual((report["rows"], report["created"], report["errors"]), (3, 2, 1))
+        self.assertEqual(report["error_details"][0]["line"], 3)
+        self.assertIn("CSV no válido", report["error_details"][0]["error"])
+
+    def test_endpoint_streams_the_body_and_limits_non_admins_to_their_own_rows(self):
+        body = "\n".join(json.dumps(self.row(dni)) for dni in ("123456789", "987654321")).encode()
+
+        response = self.client.post(reverse("measurement_ingest"), data=body, content_type="application/x-ndjson")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data["created"], response.data["errors"]), (1, 1))
+        self.assertEqual(Measurement.objects.get().user, self.user)
+
+        response = self.client.post(reverse("measurement_ingest"), data=b"{}", content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+    def test_management_command_loads_a_file(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".ndjson", delete=False) as export:
+            export.write("\n".join(json.dumps(self.row()) for _ in range(3)))
+        self.addCleanup(os.remove, export.name)
+
+        call_command("ingest_measurements", export.name, "--batch-size", "2", stdout=open(os.devnull, "w"))
+
+        self.assertEqual(Measurement.objects.count(), 3)
+
+
+class IntervalReadingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(dni="123456789", fullname="Test User", email="testuser@example.com", password="x")
+        # Enero de 2024, cuartohorario: 0,25 kWh por cuarto de hora (1 kW constante)
+        self.timestamps = np.arange("2024-01-01T00:00", "2024-02-01T00:00", 15, dtype="datetime64[m]")
+
+    def test_one_fixed_width_row_per_day(self):
+        self.assertEqual(intervals.store_readings(self.user.pk, self.timestamps, np.full(len(self.timestamps), 0.25), 15), 31)
+
+        reading = IntervalReading.objects.get(user=self.user, day=date(2024, 1, 15))
+        self.assertEqual(len(bytes(reading.values)), 96 * 4)
+        self.assertTrue(np.allclose(intervals.decode_values(reading.values), 0.25))
+
+    def test_partial_days_are_merged_and_missing_slots_stay_empty(self):
+        morning = np.arange("2024-01-02T00:00", "2024-01-02T06:00", 60, dtype="datetime64[m]")
+        evening = np.arange("2024-01-02T18:00", "2024-01-03T00:00", 60, dtype="datetime64[m]")
+        intervals.store_readings(self.user.pk, morning, np.ones(6), 60)
+        intervals.store_readings(self.user.pk, evening, np.full(6, 2.0), 60)
+
+        values = intervals.decode_values(IntervalReading.objects.get().values)
+        self.assertEqual(np.nansum(values), 18)
+        self.assertEqual(int(np.isnan(values).sum()), 12)
+        with self.assertRaises(ValueError):
+            intervals.store_readings(self.user.pk, morning, np.ones(6), 15)
+
+    def test_rollups_have_the_measurement_shape(self):
+        intervals.store_readings(self.user.pk, self.timestamps, np.full(len(self.timestamps), 0.25), 15)
+
+        month = intervals.monthly_rollups(self.user.pk, date(2024, 1, 1), date(2024, 1, 31))[date(2024, 1, 1)]
+
+        self.assertEqual(month["consumo_total"], 31 * 24)
+        # 22 días laborables: 8 h de P3, 8 h de P1 y 8 h de P2; fines de semana y el 1 de enero, todo P3
+        self.assertEqual(month["consumo_por_periodo"], {"P1": 22 * 8, "P2": 22 * 8, "P3": 22 * 8 + 9 * 24})
+        self.assertEqual(month["consumo_por_franja_horaria"], {"punta": 22 * 16, "valle": 22 * 8 + 9 * 24})
+        self.assertEqual(month["potencia_maxima_demandada"], {"punta": 1.0, "valle": 1.0})
+        self.assertEqual(month["periodo_medicion"], {"inicio": "2024-01-01", "fin": "2024-01-31"})
+        self.assertEqual(intervals.rollup_period(self.user.pk, date(2024, 1, 1), date(2024, 1, 7))["consumo_total"], 7 * 24)
+
+    def test_command_loads_a_curve_and_rolls_it_up_into_measurements(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as export:
+            export.write("user_dni,timestamp,kwh\n")
+            for timestamp in np.arange("2024-01-01T00:00", "2024-03-01T00:00", 60, dtype="datetime64[m]"):
+                export.write(f"123456789,{timestamp},0.5\n")
+            export.write("000,2024-01-01T00:00,1\n")
+        self.addCleanup(os.remove, export.name)
+
+        call_command("load_interval_readings", export.name, "--rollup", "months", stdout=open(os.devnull, "w"), stderr=open(os.devnull, "w"))
+        call_command("load_interval_readings", export.name, "--rollup", "months", stdout=open(os.devnull, "w"), stderr=open(os.devnull, "w"))
+
+        self.assertEqual(IntervalReading.objects.count(), 60)
+        measurements = Measurement.objects.filter(user=self.user).order_by("measurement_start")
+        self.assertEqual([m.data["consumo_total"] for m in measurements], [31 * 12, 29 * 12])
+
+
+class TariffPeriodTests(TestCase):
+    def test_hours_weekdays_and_national_holidays(self):
+        calendar = PeriodCalendar("2024-01-01", "2024-12-31")
+        timestamps = np.array([
+            "2024-01-02T07:45", "2024-01-02T08:00", "2024-01-02T10:00", "2024-01-02T14:30",
+            "2024-01-02T18:00", "2024-01-02T22:15", "2024-01-06T12:00", "2024-01-01T12:00", "2024-03-29T12:00",
+        ], dtype="datetime64[m]")
+
+        # El Viernes Santo (29/03/2024) no es festivo de fecha fija: es laborable
+        self.assertEqual(calendar.classify(timestamps).tolist(), [3, 2, 1, 2, 1, 2, 3, 3, 1])
+        self.assertEqual(int(working_days(np.arange("2024-01-01", "2025-01-01", dtype="datetime64[D]")).sum()), 256)
+        with self.assertRaises(ValueError):
+            calendar.classify(np.array(["2025-01-02T10:00"], dtype="datetime64[m]"))
+
+    def test_period_sums_for_a_year_of_many_customers(self):
+        year = np.arange("2024-01-01T00:00", "2025-01-01T00:00", 15, dtype="datetime64[m]")
+        customers = 50
+        timestamps = np.tile(year, customers)
+        group_ids = np.repeat(np.arange(customers), len(year))
+        kwh = np.full(len(timestamps), 0.25)
+
+        started = time.perf_counter()
+        totals = grouped_period_sums(group_ids, timestamps, kwh)
+        elapsed = time.perf_counter() - started
+
+        self.assertEqual(totals.shape, (customers, 3))
+        self.assertTrue(np.allclose(totals[0], [256 * 8, 256 * 8, 256 * 8 + 110 * 24]))
+        self.assertTrue(np.allclose(totals, totals[0]))
+        self.assertLess(elapsed, 10)
+        self.assertEqual(period_sums(year[:4], [1, 1, np.nan, 1]), {"P1": 0.0, "P2": 0.0, "P3": 3.0})
+
+    def test_batch_command_rewrites_monthly_measurements(self):
+        users = [
+            User.objects.create_user(dni=f"00000000{index}", fullname="Test User", email=f"u{index}@example.com", password="x")
+            for index in range(3)
+        ]
+        february = np.arange("2024-02-01T00:00", "2024-03-01T00:00", 60, dtype="datetime64[m]")
+        for user in users:
+            intervals.store_readings(user.pk, february, np.ones(len(february)), 60)
+
+        call_command("rollup_interval_readings", "--start", "2024-02-10", "--end", "2024-02-20", "--chunk-size", "2", stdout=open(os.devnull, "w"))
+
+        measurements = Measurement.objects.filter(user__in=users)
+        self.assertEqual(measurements.count(), 3)
+        self.assertEqual({m.data["consumo_total"] for m in measurements}, {29 * 24})
+        self.assertEqual({m.measurement_end.date() for m in measurements}, {date(2024, 2, 29)})
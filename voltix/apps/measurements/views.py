@@ -153,3 +153,69 @@ class MeasurementDetailView(APIView):
                 },
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
+
+
+from .ingestion import CONTENT_TYPES, ingest_measurements
+
+
+class MeasurementIngestView(APIView):
+    """
+    Carga masiva de exportaciones de contadores en NDJSON o CSV.
+    """
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        operation_description=(
+            "Carga una exportación de contadores como mediciones. El cuerpo de la petición se lee línea a línea "
+            "(nunca se carga entero en memoria), se valida fila a fila y se guarda en lotes de "
+            "MEASUREMENT_INGEST_BATCH_SIZE. Envía NDJSON (`Content-Type: application/x-ndjson`), un objeto por "
+            "línea con `user_dni`, `measurement_start`, `measurement_end` y `data`, o CSV (`Content-Type: text/csv`) "
+            "con una columna por ruta de campo de `data` (por ejemplo, `consumo_por_franja_horaria.punta`). Las "
+            "filas no válidas se informan con su número de línea y no detienen la carga. Los usuarios que no son "
+            "administradores solo pueden cargar sus propias mediciones."
+        ),
+        request_body=openapi.Schema(type=openapi.TYPE_STRING, format="binary", description="Flujo NDJSON o CSV"),
+        responses={
+            200: openapi.Response(
+                description="Exportación procesada",
+                examples={
+                    "application/json": {
+                        "status": "success",
+                        "rows": 3,
+                        "created": 2,
+                        "errors": 1,
+                        "error_details": [{"line": 2, "error": "data.consumo_total: campo obligatorio"}],
+                        "errors_truncated": False,
+                    }
+                },
+            ),
+            400: openapi.Response(
+                description="Cuerpo vacío",
+                examples={"application/json": {"status": "error", "message": "El cuerpo de la petición está vacío."}},
+            ),
+            415: openapi.Response(
+                description="Tipo de contenido no soportado",
+                examples={"application/json": {"status": "error", "message": "Tipo de contenido 'application/json' no soportado. Usa application/x-ndjson o text/csv."}},
+            ),
+        },
+    )
+    def post(self, request):
+        content_type = request.content_type.split(";")[0].strip().lower()
+        file_format = CONTENT_TYPES.get(content_type)
+        if file_format is None:
+            return Response(
+                {"status": "error", "message": f"Tipo de contenido '{content_type}' no soportado. Usa application/x-ndjson o text/csv."},
+                status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            )
+
+        # Se lee el cuerpo sin pasar por los parsers de DRF, que lo cargarían entero en memoria
+        stream = request.stream
+        if stream is None:
+            return Response({"status": "error", "message": "El cuerpo de la petición está vacío."}, status=status.HTTP_400_BAD_REQUEST)
+
+        report = ingest_measurements(
+            iter(stream.readline, b""),
+            file_format,
+            only_dni=None if request.user.is_staff else request.user.dni,
+        )
+        return Response({"status": "success", **report}, status=status.HTTP_200_OK)
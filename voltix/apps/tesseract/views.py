@@ -1,6 +1,7 @@
 from django.http import JsonResponse
+import numpy as np
 from PIL import Image
-import pytesseract
+from apps.invoices.ocr import get_ocr_backend
 
 def process_invoice(request):
     # Ruta a la imagen que quieres procesar
@@ -9,14 +10,9 @@ def process_invoice(request):
     try:
         # Cargar la imagen
         image = Image.open(image_path)
-        custom_oem_psm_config = r'--oem 3 --psm 11'
-        
 
-        # Asegúrate de que Tesseract esté en la ubicación correcta
-        pytesseract.pytesseract.tesseract_cmd = r"/usr/bin/tesseract"  # Cambia esta ruta si Tesseract está en otra ubicación
-
-        # Realiza la extracción de texto
-        text = pytesseract.image_to_string(image, lang='spa', config=custom_oem_psm_config)  # Asegúrate de tener el idioma 'spa' instalado
+        # Realiza la extracción de texto con el motor de OCR compartido (idioma 'spa', psm 11)
+        text = get_ocr_backend().image_to_string(np.asarray(image))
 
         # Retorna el texto extraído como respuesta JSON
         return JsonResponse({"text": text})
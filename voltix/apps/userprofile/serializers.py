@@ -51,6 +51,15 @@ class DuplicateFileValidatorSerializer(serializers.Serializer):
         value.seek(0)
         return value
 
+class ContractedPowerSerializer(serializers.Serializer):
+    contracted_power_kw = serializers.DecimalField(max_digits=7, decimal_places=3, allow_null=True)
+
+    def validate_contracted_power_kw(self, value):
+        if value is not None and value <= 0:
+            raise serializers.ValidationError("Contracted power must be greater than 0 kW.")
+        return value
+
+
 class CombinedValidatorSerializer(serializers.Serializer):
     photo = serializers.ImageField()
 
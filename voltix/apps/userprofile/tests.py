@@ -1,3 +1,17 @@
+import tempfile
+from io import BytesIO
+from unittest import mock
+from PIL import Image
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from apps.general.models import UploadLog, User
+from apps.general.utils.renditions import delete_renditions, generate_renditions
+
+
 # from django.test import TestCase
 # from django.urls import reverse
 # from rest_framework.test import APIClient
@@ -415,3 +429,69 @@
 #         # Verificar que la respuesta es 401 Unauthorized
 #         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)   
         
+
+
+class ProfilePhotoRenditionTests(TestCase):
+    @override_settings(IMAGE_RENDITION_FORMAT="JPEG", IMAGE_THUMBNAIL_SIZE=50, IMAGE_MEDIUM_SIZE=300)
+    def test_local_renditions_are_resized_once(self):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            buffer = BytesIO()
+            Image.new("RGB", (1200, 600), "orange").save(buffer, format="PNG")
+            name = default_storage.save("profile_photos/foto.png", ContentFile(buffer.getvalue()))
+
+            names = generate_renditions(name)
+
+            self.assertEqual(names["original"], name)
+            self.assertEqual(names["thumbnail"], "profile_photos/renditions/foto.thumbnail.jpg")
+            with default_storage.open(names["medium"]) as medium, Image.open(medium) as image:
+                self.assertEqual((image.format, image.size), ("JPEG", (300, 150)))
+            with default_storage.open(names["thumbnail"]) as thumbnail, Image.open(thumbnail) as image:
+                self.assertEqual(image.size, (50, 25))
+
+            # Las variantes existentes no se vuelven a generar
+            with mock.patch("apps.general.utils.renditions.Image.open") as mock_open:
+                self.assertEqual(generate_renditions(name), names)
+            mock_open.assert_not_called()
+
+            delete_renditions(name)
+            self.assertFalse(default_storage.exists(names["thumbnail"]))
+            self.assertTrue(default_storage.exists(name))
+
+    def test_rendition_failure_does_not_fail_the_photo_upload(self):
+        user = User.objects.create_user(dni="123456789", fullname="Test User", email="testuser@example.com", password="x")
+        client = APIClient()
+        client.force_authenticate(user=user)
+        buffer = BytesIO()
+        Image.new("RGB", (120, 60), "orange").save(buffer, format="PNG")
+        photo = SimpleUploadedFile("foto.png", buffer.getvalue(), content_type="image/png")
+
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root), \
+                mock.patch("apps.general.utils.renditions.generate_renditions", side_effect=OSError("disco lleno")):
+            response = client.post(reverse("upload_profile_photo"), {"photo": photo}, format="multipart")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data["photo_renditions"].values()), {response.data["photo_url"]})
+        self.assertTrue(UploadLog.objects.filter(user=user).exists())
+
+
+class ContractedPowerUpdateTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(dni="123456789", fullname="Test User", email="testuser@example.com", password="x")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_contracted_power_is_stored_as_a_number(self):
+        response = self.client.patch(reverse("patch_profile"), {"contracted_power_kw": "4.6"}, format="json")
+
+        self.assertEqual(response.status_code, 200)
+        self.user.profile.refresh_from_db()
+        self.assertEqual(self.user.profile.contracted_power_kw, 4.6)
+
+    def test_invalid_contracted_power_is_rejected(self):
+        for value in ("abc", 0, -3.3):
+            response = self.client.patch(reverse("patch_profile"), {"contracted_power_kw": value}, format="json")
+
+            self.assertEqual(response.status_code, 400, value)
+            self.assertIn("error_contracted_power_kw", response.data)
+        self.user.profile.refresh_from_db()
+        self.assertIsNone(self.user.profile.contracted_power_kw)
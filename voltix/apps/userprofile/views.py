@@ -11,6 +11,7 @@ from drf_yasg import openapi
 from rest_framework.parsers import MultiPartParser, FormParser
 from datetime import datetime
 from apps.general.utils.upload_cloudinary import process_and_upload_image
+from apps.general.utils.renditions import local_renditions, delete_renditions
 from django.conf import settings
 import os
 from django.utils.timezone import now
@@ -31,7 +32,8 @@ from datetime import timedelta
                     "birth_date": None,
                     "address": "",
                     "phone_number": "",
-                    "photo": ""
+                    "photo": "",
+                    "photo_renditions": None
                 }
             }
         ),
@@ -66,7 +68,10 @@ def profile_view(request):
         'birth_date': profile.birth_date,
         'address': profile.address,
         'phone_number': profile.phone_number,
+        'contracted_power_kw': profile.contracted_power_kw,
         'photo': request.build_absolute_uri(profile.photo.url) if profile.photo else None,
+        # Miniatura, vista previa y original (las fotos anteriores a las variantes las generan aquí)
+        'photo_renditions': local_renditions(profile.photo, request.build_absolute_uri),
     }
 
     return Response(profile_data)
@@ -166,7 +171,7 @@ def patch_profile(request):
             status=status.HTTP_400_BAD_REQUEST
         )
 
-    allowed_fields = ['birth_date', 'address', 'phone_number', 'photo']
+    allowed_fields = ['birth_date', 'address', 'phone_number', 'photo', 'contracted_power_kw']
     updated_fields = {}
 
     # Validar campos en el request
@@ -177,6 +182,17 @@ def patch_profile(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+    # La potencia contratada se usa en los cálculos de la comparación: debe ser un número mayor que 0 (o null)
+    if 'contracted_power_kw' in data:
+        power_serializer = ContractedPowerSerializer(data={'contracted_power_kw': data['contracted_power_kw']})
+        if not power_serializer.is_valid():
+            return Response(
+                {"error_contracted_power_kw": power_serializer.errors['contracted_power_kw'][0]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        power_kw = power_serializer.validated_data['contracted_power_kw']
+        data = {**data, 'contracted_power_kw': float(power_kw) if power_kw is not None else None}
+
     # Actualizar los campos permitidos
     for field in allowed_fields:
         if field in data:
@@ -201,7 +217,7 @@ def patch_profile(request):
 
 
 from rest_framework import serializers
-from .serializers import CombinedValidatorSerializer
+from .serializers import CombinedValidatorSerializer, ContractedPowerSerializer
 import os
 
 
@@ -236,11 +252,12 @@ def upload_profile_photo(request):
         profile = Profile.objects.get(user=request.user)
 
         if profile.photo:
+            delete_renditions(profile.photo.name)
             delete_file(os.path.join(settings.MEDIA_ROOT, profile.photo.name))
 
         profile.photo = photo
         profile.save()
-        
+
         UploadLog.objects.create(
             user=request.user,
             file_name=photo.name,
@@ -248,9 +265,11 @@ def upload_profile_photo(request):
             file_hash=file_hash,
         )
 
+        # Las variantes se generan al pedirlas: si fallan se sirve la foto original, sin fallar la subida
         return Response({
             "message": "Photo uploaded successfully.",
-            "photo_url": request.build_absolute_uri(profile.photo.url)
+            "photo_url": request.build_absolute_uri(profile.photo.url),
+            "photo_renditions": local_renditions(profile.photo, request.build_absolute_uri),
         }, status=200)
 
     except Profile.DoesNotExist:
@@ -0,0 +1,12 @@
+import os
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'site_app.settings.local')
+
+app = Celery('site_app')
+
+# Lee la configuración con prefijo CELERY_ desde los settings de Django
+app.config_from_object('django.conf:settings', namespace='CELERY')
+
+# Descubre automáticamente los tasks.py de cada app instalada
+app.autodiscover_tasks()
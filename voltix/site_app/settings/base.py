@@ -30,6 +30,7 @@ LOCAL_APPS = [
     'apps.authentication',
     'apps.invoices',
     'apps.measurements',
+    'apps.comparations',
     'apps.notifications',
     'apps.userprofile',
     'apps.users',
@@ -105,6 +106,12 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Variantes de las imágenes que sirve la API (miniatura y vista previa): formato (WEBP o JPEG), calidad y lado máximo en px
+IMAGE_RENDITION_FORMAT = os.getenv('IMAGE_RENDITION_FORMAT', 'WEBP')
+IMAGE_RENDITION_QUALITY = int(os.getenv('IMAGE_RENDITION_QUALITY', 80))
+IMAGE_THUMBNAIL_SIZE = int(os.getenv('IMAGE_THUMBNAIL_SIZE', 200))
+IMAGE_MEDIUM_SIZE = int(os.getenv('IMAGE_MEDIUM_SIZE', 800))
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
 # Configuración de internacionalización
@@ -122,14 +129,80 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 from .drf_settings import REST_FRAMEWORK, SIMPLE_JWT
 
+# Configuración de Celery y Redis
+CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL')  # Broker para gestionar las tareas
+CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND')  # Backend para resultados de las tareas
+CELERY_ACCEPT_CONTENT = ['json']  # Formato aceptado para mensajes
+CELERY_TASK_SERIALIZER = 'json'  # Serializador para tareas
+CELERY_TIMEZONE = 'UTC'  # Zona horaria
+CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True
+# Sin broker configurado (desarrollo local) las tareas se ejecutan en el mismo proceso
+CELERY_TASK_ALWAYS_EAGER = not CELERY_BROKER_URL
+
 # to add a job python voltix/manage.py crontab add
 # verify crontab jobs: python manage.py crontab show
 CRONJOBS = [
     ('0 0 * * *', 'django.core.management.call_command', ['clean_upload_logs']),
     ('*/1 * * * *', 'django.core.management.call_command', ['create_reminders']),
+    ('30 0 * * *', 'django.core.management.call_command', ['clean_invoice_cache']),
+    ('15 * * * *', 'django.core.management.call_command', ['clean_invoice_checkpoints']),
+    ('0 3 * * *', 'django.core.management.call_command', ['reconcile_invoices']),
 ]
 # to test: python voltix/manage.py clean_upload_logs
 
-
-
-
+# Procesamiento de facturas
+# Mínimo de caracteres alfanuméricos embebidos para usar la capa de texto del PDF en lugar de OCR
+INVOICE_TEXT_LAYER_MIN_CHARS = int(os.getenv('INVOICE_TEXT_LAYER_MIN_CHARS', 100))
+# Páginas de cada PDF que se procesan y presupuesto de píxeles por página renderizada
+INVOICE_MAX_PAGES = int(os.getenv('INVOICE_MAX_PAGES', 2))
+INVOICE_RENDER_MAX_PIXELS = int(os.getenv('INVOICE_RENDER_MAX_PIXELS', 9_000_000))
+# Hilos para preprocesar y hacer OCR de las páginas en paralelo y tiempo máximo de OCR por factura (segundos)
+INVOICE_OCR_WORKERS = int(os.getenv('INVOICE_OCR_WORKERS', 2))
+INVOICE_OCR_TIMEOUT = int(os.getenv('INVOICE_OCR_TIMEOUT', 60))
+# Motor de OCR: "auto" usa tesserocr (modelo cargado una vez por worker) si está instalado y si no pytesseract
+INVOICE_OCR_BACKEND = os.getenv('INVOICE_OCR_BACKEND', 'auto')
+TESSERACT_CMD = os.getenv('TESSERACT_CMD', '/usr/bin/tesseract')
+TESSERACT_DATA_PATH = os.getenv('TESSERACT_DATA_PATH', '')
+# Caché de resultados por SHA-256 del PDF: días sin uso antes de expirar y máximo de entradas (LRU)
+INVOICE_CACHE_TTL_DAYS = int(os.getenv('INVOICE_CACHE_TTL_DAYS', 30))
+INVOICE_CACHE_MAX_ENTRIES = int(os.getenv('INVOICE_CACHE_MAX_ENTRIES', 10000))
+# Selección del perfil de preprocesado según el ruido (sigma) y el contraste estimados de cada página
+INVOICE_PREPROCESS_FAST_MAX_NOISE = float(os.getenv('INVOICE_PREPROCESS_FAST_MAX_NOISE', 2.0))
+INVOICE_PREPROCESS_FAST_MIN_CONTRAST = float(os.getenv('INVOICE_PREPROCESS_FAST_MIN_CONTRAST', 40.0))
+INVOICE_PREPROCESS_HEAVY_MIN_NOISE = float(os.getenv('INVOICE_PREPROCESS_HEAVY_MIN_NOISE', 8.0))
+# OCR solo de las zonas de la plantilla de la comercializadora (apps/invoices/layouts.py) cuando se identifica
+INVOICE_ROI_OCR = os.getenv('INVOICE_ROI_OCR', 'True').lower() in ('true', '1', 't', 'yes')
+# Identificación de la comercializadora por la huella visual de la cabecera: distancia de Hamming máxima
+# (de 64 bits) y si se rechazan las facturas en las que ni la huella, ni la cabecera, ni el texto de la primera
+# página identifican una comercializadora soportada
+INVOICE_FINGERPRINT_MAX_DISTANCE = int(os.getenv('INVOICE_FINGERPRINT_MAX_DISTANCE', 10))
+INVOICE_REJECT_UNKNOWN_SUPPLIER = os.getenv('INVOICE_REJECT_UNKNOWN_SUPPLIER', 'False').lower() in ('true', '1', 't', 'yes')
+# Control de admisión del OCR: trabajos en curso como máximo (total y por usuario). Las subidas que superan
+# el límite reciben 429 con Retry-After (segundos). Cada plaza caduca tras INVOICE_ADMISSION_LEASE_SECONDS
+# por si un worker muere. Sin Redis (por defecto el broker de Celery) se cuentan los trabajos en la base de datos
+INVOICE_ADMISSION_REDIS_URL = os.getenv('INVOICE_ADMISSION_REDIS_URL', CELERY_BROKER_URL if (CELERY_BROKER_URL or '').startswith('redis') else '')
+INVOICE_ADMISSION_MAX_JOBS = int(os.getenv('INVOICE_ADMISSION_MAX_JOBS', 20))
+INVOICE_ADMISSION_MAX_JOBS_PER_USER = int(os.getenv('INVOICE_ADMISSION_MAX_JOBS_PER_USER', 2))
+INVOICE_ADMISSION_LEASE_SECONDS = int(os.getenv('INVOICE_ADMISSION_LEASE_SECONDS', 300))
+INVOICE_ADMISSION_RETRY_AFTER = int(os.getenv('INVOICE_ADMISSION_RETRY_AFTER', 15))
+# Horas que se conservan el PDF y los checkpoints de un trabajo fallido para poder reintentarlo
+INVOICE_CHECKPOINT_TTL_HOURS = int(os.getenv('INVOICE_CHECKPOINT_TTL_HOURS', 24))
+# Publicación en segundo plano de la imagen de la primera página en Cloudinary: reintentos, espera antes del
+# primer reintento (se duplica en cada uno) y tiempo máximo de cada subida (segundos)
+INVOICE_PUBLISH_MAX_RETRIES = int(os.getenv('INVOICE_PUBLISH_MAX_RETRIES', 5))
+INVOICE_PUBLISH_RETRY_DELAY = int(os.getenv('INVOICE_PUBLISH_RETRY_DELAY', 10))
+INVOICE_PUBLISH_TIMEOUT = int(os.getenv('INVOICE_PUBLISH_TIMEOUT', 30))
+# Horas durante las que una subida con la misma cabecera Idempotency-Key devuelve el trabajo original
+INVOICE_IDEMPOTENCY_TTL_HOURS = int(os.getenv('INVOICE_IDEMPOTENCY_TTL_HOURS', 24))
+# Las subidas de hasta este tamaño (el máximo admitido para una factura) se mantienen en memoria en lugar de
+# volcarse a un archivo temporal de Django antes de validarlas
+FILE_UPLOAD_MAX_MEMORY_SIZE = int(os.getenv('FILE_UPLOAD_MAX_MEMORY_SIZE', 5 * 1024 * 1024))
+
+# Ingesta masiva de mediciones (NDJSON/CSV): filas por lote de bulk_create y errores por fila que se informan como máximo
+MEASUREMENT_INGEST_BATCH_SIZE = int(os.getenv('MEASUREMENT_INGEST_BATCH_SIZE', 5000))
+MEASUREMENT_INGEST_MAX_ERRORS = int(os.getenv('MEASUREMENT_INGEST_MAX_ERRORS', 1000))
+
+# Tarifa del catálogo con la que se recalcula el total de una factura al compararla con la medición
+DEFAULT_TARIFF_CODE = os.getenv('DEFAULT_TARIFF_CODE', 'voltix-referencia')
+# Facturas por lote de la conciliación masiva (una consulta y un bulk_create por lote)
+RECONCILIATION_BATCH_SIZE = int(os.getenv('RECONCILIATION_BATCH_SIZE', 1000))